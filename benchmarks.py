@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the pln_inco modules. Part of the pln-inco package
+Run them with python -m pln_inco.benchmarks
+"""
+import time
+import os
+import sys
+import subprocess
+
+
+def benchmark_freeling_alignment(sizes=(1000,2000,4000,8000,16000,32000)):
+	"""
+	Time the alignment of our tokens with FreeLing tokens (L{freeling.alinearTokensFreeling}) on synthetic Spanish documents of growing size.
+	Documents include contractions (del, al), clitics (dámelo) and multiword expressions (a_pesar_de), so every alignment case is exercised.
+	FreeLing itself is not run: its output is built from the document.
+	@arg sizes: document sizes, in tokens
+	@type sizes: C{List}
+	@return: a list of (tokens, seconds, microseconds per token). A constant cost per token shows linear scaling
+	@rtype: C{List}
+	"""
+	from pln_inco import freeling
+	from pln_inco.util.Tokenizador import obtenerTokens
+
+	# Each phrase is a list of (our token, FreeLing tokens)
+	phrases=[
+		[(u'El',[u'El']),(u'perro',[u'perro']),(u'del',[u'de',u'el']),(u'vecino',[u'vecino']),(u'ladra',[u'ladra']),(u'.',[u'.'])],
+		[(u'Fuimos',[u'Fuimos']),(u'al',[u'a',u'el']),(u'parque',[u'parque']),(u'.',[u'.'])],
+		[(u'Dámelo',[u'Da',u'me',u'lo']),(u'ahora',[u'ahora']),(u'.',[u'.'])],
+		[(u'A pesar de',[u'A_pesar_de']),(u'todo',[u'todo']),(u',',[u',']),(u'llegó',[u'llegó']),(u'.',[u'.'])],
+	]
+
+	results=[]
+	for size in sizes:
+		words=[]
+		sentences=[]
+		while len(words)<size:
+			for phrase in phrases:
+				words+=[mine for (mine,theirs) in phrase]
+				sentences.append([(t,t.lower(),u'TAG') for (mine,theirs) in phrase for t in theirs])
+		text=u' '.join(words)
+		tokens=obtenerTokens(text)
+
+		t0=time.time()
+		freeling.alinearTokensFreeling(tokens,sentences)
+		seconds=time.time()-t0
+		results.append((len(tokens),seconds,1e6*seconds/len(tokens)))
+	return results
+
+
+def benchmark_import_times(modules=('lazy','genia_tagger','graphviz','penn_treebank','stanford_parser','syntax_trees','freeling','bioscope')):
+	"""
+	Measure the time it takes to import each module of the package. Each module is imported in a new Python process, so no module is already loaded.
+	@arg modules: module names, within the pln_inco package
+	@type modules: C{List}
+	@return: a list of (module, seconds)
+	@rtype: C{List}
+	"""
+	# The package parent directory must be in the path of the new processes
+	env=dict(os.environ)
+	package_parent=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+	env['PYTHONPATH']=os.pathsep.join([package_parent]+[p for p in [env.get('PYTHONPATH')] if p])
+
+	results=[]
+	for module in modules:
+		code='import time; t0=time.time(); import pln_inco.%s; print time.time()-t0' % module
+		p=subprocess.Popen([sys.executable,'-c',code],stdout=subprocess.PIPE,env=env)
+		output=p.communicate()[0]
+		if p.returncode==0:
+			results.append((module,float(output)))
+		else:
+			results.append((module,None))
+	return results
+
+
+def benchmark_bioscope_load(working_dir, bioscope_xml_file, prefix='a', processes=None):
+	"""
+	Time the load of the Bioscope corpus (L{bioscope.BioscopeCorpus}) from its working directory, which must include the .bioscope, .parsed and .genia files.
+	@arg working_dir: Bioscope corpus directory
+	@type working_dir: C{string}
+	@arg bioscope_xml_file: Bioscope corpus file
+	@type bioscope_xml_file: C{string}
+	@arg prefix: load only documents whose name matches the prefix
+	@type prefix: C{string}
+	@arg processes: number of worker processes for the load (see L{bioscope.BioscopeCorpus}). None loads the documents sequentially
+	@type processes: C{int}
+	@return: (documents, sentences, seconds)
+	@rtype: C{tuple}
+	"""
+	from pln_inco import bioscope
+
+	t0=time.time()
+	bcp=bioscope.BioscopeCorpusProcessor(working_dir,bioscope_xml_file)
+	corpus=bioscope.BioscopeCorpus(bcp,prefix,processes)
+	seconds=time.time()-t0
+	sentences=sum(len(d.sentences) for d in corpus.documents.values())
+	return (len(corpus.documents),sentences,seconds)
+
+
+def benchmark_bioscope_snapshot(working_dir, bioscope_xml_file, snapshot, prefix='a'):
+	"""
+	Compare the load of the Bioscope corpus from its files with the load from a snapshot (see L{bioscope.BioscopeCorpus.save_snapshot}). The snapshot file is rewritten.
+	@arg working_dir: Bioscope corpus directory
+	@type working_dir: C{string}
+	@arg bioscope_xml_file: Bioscope corpus file
+	@type bioscope_xml_file: C{string}
+	@arg snapshot: snapshot file
+	@type snapshot: C{string}
+	@arg prefix: load only documents whose name matches the prefix
+	@type prefix: C{string}
+	@return: (seconds to load from the files and save the snapshot, seconds to load from the snapshot, snapshot size in bytes)
+	@rtype: C{tuple}
+	"""
+	from pln_inco import bioscope
+
+	if os.path.exists(snapshot):
+		os.remove(snapshot)
+	bcp=bioscope.BioscopeCorpusProcessor(working_dir,bioscope_xml_file)
+	t0=time.time()
+	bioscope.BioscopeCorpus(bcp,prefix,snapshot=snapshot)
+	t1=time.time()
+	bioscope.BioscopeCorpus(bcp,prefix,snapshot=snapshot)
+	t2=time.time()
+	return (t1-t0,t2-t1,os.path.getsize(snapshot))
+
+
+def benchmark_leaf_attribute_memory(working_dir, bioscope_xml_file, prefix='a'):
+	"""
+	Compare the memory used by the leaf attributes of the loaded Bioscope corpus (L{bioscope.SentenceLeafAttributes} and their L{bioscope.LeafAttributes} labels)
+	with the memory the same attributes would use as one dictionary for each leaf, which is how they were stored before. Sizes are computed with C{sys.getsizeof}.
+	In the dictionaries, the lemma, pos, chunk and entity strings belong to each leaf, while the tag lists share their strings
+	@arg working_dir: Bioscope corpus directory
+	@type working_dir: C{string}
+	@arg bioscope_xml_file: Bioscope corpus file
+	@type bioscope_xml_file: C{string}
+	@arg prefix: load only documents whose name matches the prefix
+	@type prefix: C{string}
+	@return: (leaves, bytes as dictionaries, bytes as columnar store)
+	@rtype: C{tuple}
+	"""
+	from pln_inco import bioscope
+
+	bcp=bioscope.BioscopeCorpusProcessor(working_dir,bioscope_xml_file)
+	corpus=bioscope.BioscopeCorpus(bcp,prefix)
+
+	leaves=0
+	dict_bytes=0
+	columnar_bytes=0
+	for (docId,d) in corpus.iter_documents():
+		for s in d.sentences.values():
+			if s.leaf_attributes is None:
+				continue
+			leaves+=len(s.leaf_attributes)
+			columnar_bytes+=sys.getsizeof(s.leaf_attributes)+sys.getsizeof(s.leaf_attributes.__dict__)+sys.getsizeof(s.leaf_attributes.ids)
+			for t in s.data.subtrees(lambda t: isinstance(t.label(),bioscope.LeafAttributes)):
+				label=t.label()
+				columnar_bytes+=sys.getsizeof(label)
+				values=label.copy()
+				dict_bytes+=sys.getsizeof(values)
+				dict_bytes+=sum([sys.getsizeof(values[key]) for key in bioscope.LEAF_LABEL_KEYS])
+
+	# The shared values are counted once
+	columnar_bytes+=sys.getsizeof(corpus.leaf_values.values)+sys.getsizeof(corpus.leaf_values.value_ids)
+	for value in corpus.leaf_values.values:
+		columnar_bytes+=sys.getsizeof(value)+sys.getsizeof((type(value),value))
+	return (leaves,dict_bytes,columnar_bytes)
+
+
+def benchmark_conll_export(sizes=(100000,400000,1600000)):
+	"""
+	Time the CoNLL export of attribute tables (L{bioscope.gen_conll_file_hc}) of growing size. Tables are synthetic, and are created in a temporary directory,
+	with the columns used by the export (document_id, sentence_id, token_num, sentence_type) and some attributes
+	@arg sizes: table sizes, in rows
+	@type sizes: C{List}
+	@return: a list of (rows, seconds, rows per second)
+	@rtype: C{List}
+	"""
+	import sqlite3
+	import tempfile
+	import shutil
+	from pln_inco import bioscope
+
+	results=[]
+	directory=tempfile.mkdtemp()
+	try:
+		for size in sizes:
+			dbname=os.path.join(directory,'attributes%d.db' % size)
+			conn=sqlite3.connect(dbname)
+			conn.execute('create table attributes (document_id text, sentence_id text, token_num integer, sentence_type text, token text, lemma text, pos text, hedge_cue text)')
+			rows=(('a%d' % (i/1000),'S%d' % (i/25),i%25,bioscope.SENTENCE_TYPES[(i/25)%len(bioscope.SENTENCE_TYPES)],'token%d' % (i%500),'lemma%d' % (i%400),'NN','O') for i in range(size))
+			conn.executemany('insert into attributes values (?,?,?,?,?,?,?,?)',rows)
+			conn.commit()
+			conn.close()
+			results.append(bioscope.gen_conll_file_hc(dbname,'attributes','ALL',os.path.join(directory,'attributes.conll'),['token','lemma','pos'],'hedge_cue',None,create_index=True))
+	finally:
+		shutil.rmtree(directory)
+	return results
+
+
+def benchmark_bioscope_retokenize(sizes=(1000,4000,16000,64000)):
+	"""
+	Time the realignment of bioscope tokens with Genia words (L{bioscope.bioscope_retokenize}) on synthetic sentences of growing size, 
+	where hyphenated terms, split by the Treebank tokenizer in two to eight tokens, are single Genia words
+	@arg sizes: sentence sizes, in Genia words
+	@type sizes: C{List}
+	@return: a list of (tokens, seconds, microseconds per token, alignment statistics). A constant cost per token shows linear scaling
+	@rtype: C{List}
+	"""
+	from pln_inco import bioscope
+
+	# Each term is a Genia word, and its bioscope tokens
+	terms=[('expression',['expression']),('of',['of']),('NF-kappaB',['NF','-','kappaB']),('and',['and']),('IL-2-dependent',['IL','-','2','-','dependent']),
+		('T-cell',['T','-','cell']),('-LRB-',['(']),('CD28/CD3-mediated/co-stimulated',['CD28','/','CD3','-','mediated','/','co','-stimulated']),('-RRB-',[')']),('.',['.'])]
+	results=[]
+	for size in sizes:
+		genia_words=[]
+		bioscope_tokens=[]
+		while len(genia_words)<size:
+			for (word,tokens) in terms:
+				genia_words.append((word,word.lower(),'NN','O','O'))
+				bioscope_tokens+=[(token,{'SpecCue':['O'],'NegCue':['O'],'specXcope':['O'],'negXcope':['O']}) for token in tokens]
+
+		stats={}
+		t0=time.time()
+		bioscope.bioscope_retokenize(genia_words,bioscope_tokens,stats)
+		seconds=time.time()-t0
+		results.append((len(bioscope_tokens),seconds,1e6*seconds/len(bioscope_tokens),stats))
+	return results
+
+
+def benchmark_attribute_table(working_dir, bioscope_xml_file, prefix='a'):
+	"""
+	Time the build of the attribute table (L{bioscope.gen_attribute_table}) from the loaded Bioscope corpus. The table is written to a temporary database
+	@arg working_dir: Bioscope corpus directory
+	@type working_dir: C{string}
+	@arg bioscope_xml_file: Bioscope corpus file
+	@type bioscope_xml_file: C{string}
+	@arg prefix: load only documents whose name matches the prefix
+	@type prefix: C{string}
+	@return: (rows, seconds)
+	@rtype: C{tuple}
+	"""
+	import tempfile
+	import shutil
+	from pln_inco import bioscope
+
+	bcp=bioscope.BioscopeCorpusProcessor(working_dir,bioscope_xml_file)
+	corpus=bioscope.BioscopeCorpus(bcp,prefix)
+	directory=tempfile.mkdtemp()
+	try:
+		return bioscope.gen_attribute_table(os.path.join(directory,'attributes.db'),'bioscope',corpus)
+	finally:
+		shutil.rmtree(directory)
+
+
+def benchmark_basic_attributes(working_dir, bioscope_xml_file, prefix='a', repeat=5):
+	"""
+	Measure the cost per token of extracting the token attributes of the loaded Bioscope corpus, sentence by sentence (L{bioscope.BioscopeSentence.get_basic_attributes})
+	and document by document (L{bioscope.BioscopeDocument.iter_basic_attributes})
+	@arg working_dir: Bioscope corpus directory
+	@type working_dir: C{string}
+	@arg bioscope_xml_file: Bioscope corpus file
+	@type bioscope_xml_file: C{string}
+	@arg prefix: load only documents whose name matches the prefix
+	@type prefix: C{string}
+	@arg repeat: number of passes over the corpus
+	@type repeat: C{int}
+	@return: (tokens, microseconds per token by sentence, microseconds per token by document)
+	@rtype: C{tuple}
+	"""
+	from pln_inco import bioscope
+
+	bcp=bioscope.BioscopeCorpusProcessor(working_dir,bioscope_xml_file)
+	corpus=bioscope.BioscopeCorpus(bcp,prefix)
+	sentences=[s for d in corpus.documents.values() for s in d.sentences.values() if s.data_loaded]
+
+	t0=time.time()
+	for i in range(repeat):
+		tokens=0
+		for s in sentences:
+			tokens+=len(s.get_basic_attributes())-1
+	t1=time.time()
+	for i in range(repeat):
+		for d in corpus.documents.values():
+			for row in d.iter_basic_attributes():
+				pass
+	t2=time.time()
+	if not tokens:
+		return (0,0.0,0.0)
+	return (tokens,1e6*(t1-t0)/(repeat*tokens),1e6*(t2-t1)/(repeat*tokens))
+
+
+if __name__ == '__main__':
+	print 'Import times'
+	for (module,seconds) in benchmark_import_times():
+		if seconds is None:
+			print '%-16s failed' % module
+		else:
+			print '%-16s %8.1f ms' % (module,1000*seconds)
+
+	print 'FreeLing token alignment'
+	for (tokens,seconds,per_token) in benchmark_freeling_alignment():
+		print '%8d tokens %8.3f s %8.2f us/token' % (tokens,seconds,per_token)
+
+	print 'CoNLL export'
+	for (rows,seconds,rows_per_second) in benchmark_conll_export():
+		print '%8d rows %8.3f s %10.0f rows/s' % (rows,seconds,rows_per_second)
+
+	print 'Bioscope token realignment'
+	for (tokens,seconds,per_token,stats) in benchmark_bioscope_retokenize():
+		print '%8d tokens %8.3f s %8.2f us/token %8d merges (longest %d tokens) %8d unaligned' % (tokens,seconds,per_token,stats['merges'],stats['longest_merge'],stats['unaligned'])
+
+	# The Bioscope benchmarks need the corpus: python -m pln_inco.benchmarks <working_dir> <bioscope_xml_file>
+	if len(sys.argv)>2:
+		print 'Bioscope corpus load'
+		for processes in (None,0):
+			(documents,sentences,seconds)=benchmark_bioscope_load(sys.argv[1],sys.argv[2],processes=processes)
+			print '%8d documents %8d sentences %8.3f s %s' % (documents,sentences,seconds,'sequential' if processes is None else 'parallel')
+
+		print 'Bioscope corpus snapshot'
+		(source_seconds,snapshot_seconds,size)=benchmark_bioscope_snapshot(sys.argv[1],sys.argv[2],os.path.join(sys.argv[1],'benchmark.snapshot'))
+		print '%8.3f s from files %8.3f s from snapshot %10d bytes' % (source_seconds,snapshot_seconds,size)
+
+		print 'Leaf attribute memory'
+		(leaves,dict_bytes,columnar_bytes)=benchmark_leaf_attribute_memory(sys.argv[1],sys.argv[2])
+		print '%8d leaves %10d bytes as dictionaries %10d bytes columnar' % (leaves,dict_bytes,columnar_bytes)
+
+		print 'Token attribute extraction'
+		(tokens,sentence_cost,document_cost)=benchmark_basic_attributes(sys.argv[1],sys.argv[2])
+		print '%8d tokens %8.2f us/token by sentence %8.2f us/token by document' % (tokens,sentence_cost,document_cost)
+
+		print 'Attribute table'
+		(rows,seconds)=benchmark_attribute_table(sys.argv[1],sys.argv[2])
+		print '%8d rows %8.3f s' % (rows,seconds)
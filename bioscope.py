@@ -1,23 +1,294 @@
 # -*- coding: utf-8 -*- 
 
-import nltk,nltk.tokenize,xml.etree
+import xml.etree
 import os,codecs,fnmatch,re,types, copy,shutil
 from sys import *
-from pln_inco import graphviz,penn_treebank,stanford_parser
+from pln_inco.lazy import LazyModule
 from string import *
 import pln_inco
 import time
 import sqlite3
 import os.path
+import collections
+import multiprocessing
+import threading
+import traceback
+import hashlib
+import marshal
+import mmap
+import struct
+import UserDict
+import array
+import json
+
+# nltk and the other pln_inco modules are loaded the first time they are used
+nltk=LazyModule('nltk')
+graphviz=LazyModule('pln_inco.graphviz')
+penn_treebank=LazyModule('pln_inco.penn_treebank')
+stanford_parser=LazyModule('pln_inco.stanford_parser')
+numpy=LazyModule('numpy')
+
+# Corpus snapshots (see L{BioscopeCorpus.save_snapshot}). Change the version when the format, or the loaded information, changes
+SNAPSHOT_MAGIC='PLN_INCO BIOSCOPE SNAPSHOT\n'
+SNAPSHOT_VERSION=3
+# Attributes of the enriched leaf labels, in the order they are stored in snapshots
+LEAF_LABEL_KEYS=('lemma','pos','chunk','entity','specCue','negCue','specXcope','negXcope')
+# Attributes whose values are lists of tags
+LEAF_LABEL_LIST_KEYS=('specCue','negCue','specXcope','negXcope')
+# Sentence types (see L{BioscopeSentence.get_sentence_type}), as stored in the sentence_type column of the attribute tables
+SENTENCE_TYPES=('SPECULATION_NEGATION','SPECULATION','NEGATION','NONE')
+
+class LeafValues:
+	"""
+	Values of the leaf attributes, shared by the sentences of a corpus (see L{BioscopeCorpus.leaf_values}). L{SentenceLeafAttributes} stores their ids, 
+	which are their position in C{values}. Values are only added, so the vocabulary lives as long as the corpus that uses it. It can be used from several threads
+	@ivar values: the values. Lists are stored as tuples
+	@type values: C{List}
+	"""
+
+	def __init__(self):
+		self.values=[]
+		self.value_ids=dict()
+		self.lock=threading.Lock()
+
+	def id(self,value):
+		"""
+		Return the id of a value, adding it if it is new. str and unicode values are kept apart, so values come back with their original type
+		@rtype: C{int}
+		"""
+		if isinstance(value,types.ListType):
+			value=tuple(value)
+		key=(type(value),value)
+		value_id=self.value_ids.get(key)
+		if value_id is None:
+			self.lock.acquire()
+			try:
+				# Another thread may have added it meanwhile
+				value_id=self.value_ids.get(key)
+				if value_id is None:
+					value_id=len(self.values)
+					self.values.append(value)
+					self.value_ids[key]=value_id
+			finally:
+				self.lock.release()
+		return value_id
+
+	def __len__(self):
+		return len(self.values)
+
+# Penn Treebank tokenizer shared by every tokenization of bioscope text (see L{bioscope_tokenize_segments}), and the tokens of the text segments
+# already tokenized, by (type,segment). The cache is emptied when it reaches TOKENIZED_SEGMENTS_CACHE_SIZE segments
+_treebank_tokenizer=None
+_tokenized_segments=dict()
+TOKENIZED_SEGMENTS_CACHE_SIZE=100000
+
+
+class SentenceLeafAttributes:
+	"""
+	Columnar store for the attributes of the leaves of a sentence (see L{LEAF_LABEL_KEYS}). Values are kept as ids of a L{bioscope.LeafValues} vocabulary, 
+	usually the one of the corpus, in a single C{array}, one row for each leaf. The tree labels are L{bioscope.LeafAttributes} views of one of its rows.
+	Pickled stores keep the values, not the ids, so they can be sent to other processes (see L{use_values})
+	@ivar values: the vocabulary of the ids
+	@type values: L{bioscope.LeafValues}
+	"""
+
+	def __init__(self,rows=[],values=None):
+		"""
+		@arg rows: initial rows: tuples with the values of each attribute, in the order of L{LEAF_LABEL_KEYS}
+		@type rows: C{List}
+		@arg values: the vocabulary. If not given, the store gets its own
+		@type values: L{bioscope.LeafValues}
+		@rtype: C{None}
+		"""
+		if values is None:
+			values=LeafValues()
+		self.values=values
+		self.ids=array.array('i')
+		for row in rows:
+			self.append(row)
+
+	def append(self,row):
+		"""
+		Add a leaf, given the values of each attribute, in the order of L{LEAF_LABEL_KEYS}, and return its index
+		@rtype: C{int}
+		"""
+		value_id=self.values.id
+		self.ids.extend([value_id(value) for value in row])
+		return len(self)-1
+
+	def use_values(self,values):
+		"""
+		Move the store to another vocabulary, for example the corpus one for a store received from another process. The tree labels keep working
+		@arg values: the new vocabulary
+		@type values: L{bioscope.LeafValues}
+		@rtype: C{None}
+		"""
+		if values is not self.values:
+			old_values=self.values.values
+			self.ids=array.array('i',[values.id(old_values[value_id]) for value_id in self.ids])
+			self.values=values
+
+	def __len__(self):
+		return len(self.ids)/len(LEAF_LABEL_KEYS)
+
+	def get(self,leaf,key):
+		"""
+		Return the value of an attribute for a leaf. List values are returned as new lists
+		@arg leaf: leaf index
+		@type leaf: C{int}
+		@arg key: attribute name, one of L{LEAF_LABEL_KEYS}
+		@type key: C{string}
+		"""
+		value=self.values.values[self.ids[leaf*len(LEAF_LABEL_KEYS)+LEAF_LABEL_KEYS.index(key)]]
+		if key in LEAF_LABEL_LIST_KEYS:
+			return list(value)
+		return value
+
+	def set(self,leaf,key,value):
+		"""
+		Change the value of an attribute for a leaf
+		@arg leaf: leaf index
+		@type leaf: C{int}
+		@arg key: attribute name, one of L{LEAF_LABEL_KEYS}
+		@type key: C{string}
+		@rtype: C{None}
+		"""
+		self.ids[leaf*len(LEAF_LABEL_KEYS)+LEAF_LABEL_KEYS.index(key)]=self.values.id(value)
+
+	def row(self,leaf):
+		"""
+		Return the values of every attribute for a leaf, in the order of L{LEAF_LABEL_KEYS}
+		@rtype: C{tuple}
+		"""
+		start=leaf*len(LEAF_LABEL_KEYS)
+		values=self.values.values
+		(lemma,pos,chunk,entity,specCue,negCue,specXcope,negXcope)=[values[value_id] for value_id in self.ids[start:start+len(LEAF_LABEL_KEYS)]]
+		return (lemma,pos,chunk,entity,list(specCue),list(negCue),list(specXcope),list(negXcope))
+
+	def rows(self):
+		"""
+		Return the values of every leaf
+		@rtype: C{List}
+		"""
+		return [self.row(leaf) for leaf in range(len(self))]
+
+	def label(self,leaf):
+		"""
+		Return a tree label for a leaf 
+		@rtype: L{bioscope.LeafAttributes}
+		"""
+		return LeafAttributes(self,leaf)
+
+	def __getstate__(self):
+		return self.rows()
+
+	def __setstate__(self,rows):
+		self.__init__(rows)
+
+
+class LeafAttributes(object):
+	"""
+	Tree label with the attributes of a leaf, that reads and writes them in a L{bioscope.SentenceLeafAttributes} row.
+	It behaves like the dictionary that was used before, for example C{label['pos']}, with two differences: its keys are always those of 
+	L{LEAF_LABEL_KEYS}, and list values are copies, so a change must be assigned (C{label['specCue']=tags}, not C{label['specCue'][0]='B-SPECCUE'})
+	"""
+
+	__slots__=('store','leaf')
+
+	def __init__(self,store,leaf):
+		"""
+		@arg store: the sentence leaf attributes
+		@type store: L{bioscope.SentenceLeafAttributes}
+		@arg leaf: leaf index
+		@type leaf: C{int}
+		"""
+		self.store=store
+		self.leaf=leaf
+
+	def __getitem__(self,key):
+		if key not in LEAF_LABEL_KEYS:
+			raise KeyError(key)
+		return self.store.get(self.leaf,key)
+
+	def __setitem__(self,key,value):
+		"""
+		Change an attribute of the leaf. Changing the cue attributes does not update the sentence cues: call L{BioscopeSentence.find_cues} after that
+		"""
+		if key not in LEAF_LABEL_KEYS:
+			raise KeyError('Leaf attributes only have the keys of LEAF_LABEL_KEYS: %r' % (key,))
+		self.store.set(self.leaf,key,value)
+
+	def update(self,values):
+		for (key,value) in dict(values).iteritems():
+			self[key]=value
+
+	def get(self,key,default=None):
+		if key in LEAF_LABEL_KEYS:
+			return self.store.get(self.leaf,key)
+		return default
+
+	def __contains__(self,key):
+		return key in LEAF_LABEL_KEYS
+
+	has_key=__contains__
+
+	def __iter__(self):
+		return iter(LEAF_LABEL_KEYS)
+
+	def __len__(self):
+		return len(LEAF_LABEL_KEYS)
+
+	def keys(self):
+		return list(LEAF_LABEL_KEYS)
+
+	def values(self):
+		return list(self.store.row(self.leaf))
+
+	def items(self):
+		return zip(LEAF_LABEL_KEYS,self.store.row(self.leaf))
+
+	def copy(self):
+		return dict(self.items())
+
+	def __eq__(self,other):
+		if isinstance(other,LeafAttributes):
+			other=other.copy()
+		return self.copy()==other
+
+	def __ne__(self,other):
+		return not self==other
+
+	__hash__=None
+
+	def __repr__(self):
+		return repr(self.copy())
+
+	def __reduce__(self):
+		return (LeafAttributes,(self.store,self.leaf))
+
+# Types of the enriched leaf labels
+LEAF_LABEL_TYPES=(types.DictType,LeafAttributes)
 
 class BioscopeCorpus:
 	""" 
 	This class includes every info we collect / generate about the Bioscope corpus. The related BioscopeCorpusProcessor loads the original corpus files into this structure
-	@ivar documents: dictionary of L{bioscope.BioscopeDocument}, indexed by the document's id
+	@ivar documents: dictionary of L{bioscope.BioscopeDocument}, indexed by the document's id. In lazy mode, it is a L{bioscope.LazyDocuments} mapping
 	@type documents: C{Dictionary}
+	@ivar load_errors: documents that could not be loaded, indexed by the document's id. The value is the error description
+	@type load_errors: C{Dictionary}
+	@ivar retokenize_stats: statistics of the realignment of bioscope tokens with Genia words (see L{bioscope_retokenize}) for the loaded documents, 
+	with the same keys. It is empty if no sentence needed realignment. In lazy mode, it counts the documents loaded so far
+	@type retokenize_stats: C{Dictionary}
+	@ivar prefix: prefix of the loaded documents
+	@type prefix: C{string}
+	@ivar leaf_values: vocabulary of the leaf attributes of the corpus sentences (see L{bioscope.SentenceLeafAttributes})
+	@type leaf_values: L{bioscope.LeafValues}
+	@ivar cue_index: index of the hedge and negation cues of the corpus: a dictionary from (lemma, cue type) to a list of (docId, sentenceId, leaf number). 
+	It is built the first time it is used (see L{get_cue_index}), so loads that do not look up cues do not pay for it
+	@type cue_index: C{Dictionary}
 	"""
 	
-	def __init__(self,bcp,prefix):
+	def __init__(self,bcp,prefix,processes=None,snapshot=None,lazy=False,cache_size=100):
 		"""
 		Loads the corpus documents from the corpus files. 
 		@arg bcp: Environment information for the corpus original files.
@@ -25,25 +296,410 @@ class BioscopeCorpus:
 		@rtype: C{None}
 		@arg prefix: Load only documents whose name matches the prefix 
 		@type prefix: String
+		@arg processes: if given, documents are loaded in parallel, by this number of worker processes (0 means one for each CPU). 
+		The result is the same as the sequential load. It cannot be used in lazy mode, where each document is loaded when it is first used: C{ValueError} is raised
+		@type processes: C{int}
+		@arg snapshot: if given, snapshot file for the corpus. If it is up to date, the corpus is loaded from it; otherwise, the corpus is loaded 
+		from the corpus files and saved to the snapshot (see L{save_snapshot})
+		@type snapshot: C{string}
+		@arg lazy: if True, documents are not loaded now, but the first time they are used, and only the last C{cache_size} used documents are kept 
+		in memory (see L{bioscope.LazyDocuments}). The snapshot is used if it is up to date, but it is not written
+		@type lazy: C{bool}
+		@arg cache_size: number of documents kept in memory in lazy mode
+		@type cache_size: C{int}
 		"""
 		
+		if lazy and processes is not None:
+			raise ValueError('Documents cannot be loaded in parallel in lazy mode')
+
+		self.prefix=prefix
+		self.load_errors=dict()
+		self.retokenize_stats=dict()
+		self.leaf_values=LeafValues()
+		self.cue_index=None
+		# In lazy mode, memory map of the snapshot the documents are read from (see L{close})
+		self._snapshot_data=None
+
+		if lazy:
+			opened_snapshot=snapshot and self._open_snapshot(snapshot,bcp)
+			if opened_snapshot:
+				# Documents are read from the snapshot memory map, which stays open
+				(data,header,start)=opened_snapshot
+				self._snapshot_data=data
+				self.load_errors=header['load_errors']
+				self.retokenize_stats=header['retokenize_stats']
+				index=dict([(docId,(offset,length)) for (docId,offset,length) in header['index']])
+				load_document=lambda docId: _read_snapshot_document(data,start+index[docId][0],index[docId][1],docId,bcp,self.leaf_values)
+				document_ids=sorted(index)
+			else:
+				load_document=lambda docId: self._load_document(docId,bcp)
+				document_ids=sorted([docId for docId in bcp.get_doc_ids('a') if re.match(prefix,docId)])
+			self.documents=LazyDocuments(document_ids,load_document,cache_size)
+			return
+
+		self.documents=dict()
+		if snapshot and self.load_snapshot(snapshot,bcp):
+			return
+
 		# Get document ids from the corpus
-		document_ids=bcp.get_doc_ids('a')
+		document_ids=[docId for docId in bcp.get_doc_ids('a') if re.match(prefix,docId)]
 
 		# Create document list  
-		self.documents=dict()
-		contador=0
-		total=len(document_ids)
-		for docId in document_ids:
-			if re.match(prefix,docId):
-				contador+=1
-				#print "Loading document ",docId, contador, " from ", total
-				try:
-					d=BioscopeDocument(docId,bcp)
-					d.add_genia_and_bioscope_info(bcp)			
+		if processes is None:
+			for docId in document_ids:
+				d=self._load_document(docId,bcp)
+				if d is not None:
 					self.documents[docId]=d
-				except IndexError:
-					print "I couldn't load document ",docId
+		else:
+			# Each worker gets its copy of bcp when it starts, and sends back the loaded documents, in the same order as document_ids
+			pool=multiprocessing.Pool(processes or None,_init_load_worker,(bcp,))
+			try:
+				for (docId,d,error,retokenize_stats) in pool.imap(_load_document,document_ids):
+					if d is None and error is None:
+						# An unexpected error, raised again here
+						d=self._load_document(docId,bcp)
+					else:
+						d=self._add_loaded_document(docId,d,error,retokenize_stats)
+					if d is not None:
+						self.documents[docId]=d
+				pool.close()
+			finally:
+				pool.terminate()
+				pool.join()
+
+		if snapshot:
+			self.save_snapshot(snapshot,bcp)
+
+	def close(self):
+		"""
+		Close the snapshot file documents are read from in lazy mode. After that, documents that are not in memory cannot be loaded.
+		It does nothing if the corpus was not loaded lazily from a snapshot
+		@rtype: C{None}
+		"""
+		if self._snapshot_data is not None:
+			self._snapshot_data.close()
+			self._snapshot_data=None
+
+	def get_cue_index(self):
+		"""
+		Return the cue index (see C{cue_index}), building it the first time. In lazy mode, building it reads the whole corpus, one document at a time
+		@rtype: C{Dictionary}
+		"""
+		if self.cue_index is None:
+			cue_index=dict()
+			for (docId,d) in self.iter_documents():
+				for s in sorted(d.sentences.values(),key=lambda s:s.sindex):
+					for (leaf,cue_type,lemma) in s.cues:
+						cue_index.setdefault((lemma,cue_type),[]).append((docId,s.sentenceId,leaf))
+			self.cue_index=cue_index
+		return self.cue_index
+
+	def find_cue(self,lemma,cue_type='speculation'):
+		"""
+		Return the occurrences of a cue in the corpus, using the cue index
+		@arg lemma: cue lemma, according to Genia, for example 'suggest'
+		@type lemma: C{string}
+		@arg cue_type: 'speculation' or 'negation'
+		@type cue_type: C{string}
+		@return: list of (docId, sentenceId, leaf number), in document order
+		@rtype: C{List}
+		"""
+		return list(self.get_cue_index().get((lemma,cue_type),[]))
+
+	def _load_document(self,docId,bcp):
+		"""
+		Load a document from the corpus files. Returns None if the document could not be loaded, and registers the error in C{load_errors}
+		@rtype: L{bioscope.BioscopeDocument}
+		"""
+		#print "Loading document ",docId
+		(d,error,retokenize_stats)=_read_document(docId,bcp,self.leaf_values)
+		return self._add_loaded_document(docId,d,error,retokenize_stats)
+
+	def _add_loaded_document(self,docId,d,error,retokenize_stats):
+		"""
+		Register the result of loading a document (see L{bioscope._read_document}): the error in C{load_errors} if it could not be loaded, 
+		or its realignment statistics in C{retokenize_stats}. Documents loaded by worker processes are moved to the corpus C{leaf_values}. 
+		Returns the document, or None
+		@rtype: L{bioscope.BioscopeDocument}
+		"""
+		if d is None:
+			print "I couldn't load document ",docId
+			self.load_errors[docId]=error
+		else:
+			add_retokenize_stats(self.retokenize_stats,retokenize_stats)
+			for s in d.sentences.itervalues():
+				if s.leaf_attributes is not None:
+					s.leaf_attributes.use_values(self.leaf_values)
+		return d
+
+	def iter_documents(self):
+		"""
+		Iterate over the corpus documents, in the order of their ids. In lazy mode, documents that are not in memory are loaded, 
+		but not kept, so the whole corpus can be traversed using the memory of a single document. Documents that could not be loaded are skipped
+		@return: iterator of (docId,document) pairs
+		@rtype: C{iterator}
+		"""
+		if isinstance(self.documents,LazyDocuments):
+			for item in self.documents.iter_uncached():
+				yield item
+		else:
+			for docId in sorted(self.documents):
+				yield (docId,self.documents[docId])
+
+	def save_snapshot(self,filename,bcp):
+		"""
+		Save the loaded corpus (parsing trees with their leaf attributes, sentence ids and C{data_loaded} flags, and load errors) to a binary snapshot file. 
+		The file starts with a header, including the fingerprint of the corpus files (see L{BioscopeCorpusProcessor.get_source_fingerprint}) and 
+		an index with the position of each document, which is stored separately (with C{marshal}), so documents can be read from a memory map of the file
+		@arg filename: snapshot file
+		@type filename: C{string}
+		@arg bcp: Environment information for the corpus original files.
+		@type bcp: L{bioscope.BioscopeCorpusProcessor}
+		@rtype: C{None}
+		"""
+
+		payloads=[]
+		index=[]
+		offset=0
+		for docId in sorted(self.documents):
+			d=self.documents[docId]
+			sentences=[(s.sentenceId,s.sindex,s.data_loaded,s.leaf_attributes.rows() if s.leaf_attributes is not None else None,_encode_tree(s.data)) for s in sorted(d.sentences.values(),key=lambda s:s.sindex)]
+			payload=marshal.dumps(sentences,2)
+			payloads.append(payload)
+			index.append((docId,offset,len(payload)))
+			offset+=len(payload)
+
+		header=marshal.dumps({'version':SNAPSHOT_VERSION,'python':tuple(version_info[:2]),'fingerprint':bcp.get_source_fingerprint(),
+			'prefix':self.prefix,'load_errors':self.load_errors,'retokenize_stats':self.retokenize_stats,'index':index},2)
+
+		# Write to a temporary file, and then replace the snapshot, so it is never left incomplete
+		temp_filename=filename+'.tmp'
+		f=open(temp_filename,'wb')
+		f.write(SNAPSHOT_MAGIC)
+		f.write(struct.pack('<Q',len(header)))
+		f.write(header)
+		for payload in payloads:
+			f.write(payload)
+		f.close()
+		os.rename(temp_filename,filename)
+
+	def load_snapshot(self,filename,bcp):
+		"""
+		Load the corpus from a snapshot file written by L{save_snapshot}, if it is up to date: it was saved for the same prefix, by the same snapshot version, 
+		and the corpus files did not change since then
+		@arg filename: snapshot file
+		@type filename: C{string}
+		@arg bcp: Environment information for the corpus original files.
+		@type bcp: L{bioscope.BioscopeCorpusProcessor}
+		@return: True if the corpus was loaded, False if the snapshot does not exist or is out of date
+		@rtype: C{bool}
+		"""
+
+		opened_snapshot=self._open_snapshot(filename,bcp)
+		if not opened_snapshot:
+			return False
+		(data,header,start)=opened_snapshot
+		try:
+			documents=dict()
+			for (docId,offset,length) in header['index']:
+				documents[docId]=_read_snapshot_document(data,start+offset,length,docId,bcp,self.leaf_values)
+		finally:
+			data.close()
+
+		self.documents=documents
+		self.load_errors=header['load_errors']
+		self.retokenize_stats=header['retokenize_stats']
+		return True
+
+	def _open_snapshot(self,filename,bcp):
+		"""
+		Open a snapshot file, and check it is up to date (see L{load_snapshot}). 
+		@return: (memory map of the file, header, position of the first document), or None if the snapshot does not exist or is out of date
+		@rtype: C{tuple}
+		"""
+
+		if not os.path.isfile(filename) or os.path.getsize(filename)<len(SNAPSHOT_MAGIC)+8:
+			return None
+		f=open(filename,'rb')
+		try:
+			data=mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+		finally:
+			f.close()
+
+		header=None
+		if data[:len(SNAPSHOT_MAGIC)]==SNAPSHOT_MAGIC:
+			start=len(SNAPSHOT_MAGIC)+8
+			(header_length,)=struct.unpack('<Q',data[len(SNAPSHOT_MAGIC):start])
+			try:
+				header=marshal.loads(data[start:start+header_length])
+			except (EOFError,ValueError,TypeError):
+				# A damaged header, for example from another snapshot version
+				pass
+		if header is None or header['version']!=SNAPSHOT_VERSION or header['python']!=tuple(version_info[:2]) or header['prefix']!=self.prefix \
+			or header['fingerprint']!=bcp.get_source_fingerprint():
+			data.close()
+			return None
+		return (data,header,start+header_length)
+
+
+class LazyDocuments(UserDict.DictMixin):
+	"""
+	Dictionary of documents (L{bioscope.BioscopeDocument}), indexed by the document's id, that loads each document the first time it is used. 
+	Only the last used documents are kept in memory. Documents that could not be loaded are not in the dictionary (using them raises C{KeyError}, 
+	and iterating skips them). Their ids are in C{keys()} until they are first used, because it is not known before; then they are dropped, 
+	so they are not loaded again
+	"""
+
+	def __init__(self,document_ids,load_document,cache_size=100):
+		"""
+		@arg document_ids: ids of the documents, in iteration order
+		@type document_ids: C{List}
+		@arg load_document: function that, given a document id, loads the document, or returns None if it could not be loaded (registering the error) 
+		@type load_document: C{function}
+		@arg cache_size: maximum number of documents kept in memory
+		@type cache_size: C{int}
+		@rtype: C{None}
+		"""
+		self.document_ids=list(document_ids)
+		self.id_set=set(self.document_ids)
+		self.load_document=load_document
+		self.cache_size=cache_size
+		# Loaded documents, most recently used last
+		self.cache=collections.OrderedDict()
+
+	def keys(self):
+		return list(self.document_ids)
+
+	def __iter__(self):
+		return iter(list(self.document_ids))
+
+	def __len__(self):
+		return len(self.document_ids)
+
+	def __contains__(self,docId):
+		return docId in self.id_set
+
+	has_key=__contains__
+
+	def __getitem__(self,docId):
+		if docId in self.cache:
+			d=self.cache.pop(docId)
+		elif docId in self.id_set:
+			d=self._load(docId)
+			if d is None:
+				raise KeyError(docId)
+			while len(self.cache)>=self.cache_size:
+				self.cache.popitem(last=False)
+		else:
+			raise KeyError(docId)
+		self.cache[docId]=d
+		return d
+
+	def iteritems(self):
+		for docId in list(self.document_ids):
+			if docId in self.id_set:
+				try:
+					yield (docId,self[docId])
+				except KeyError:
+					pass
+
+	def _load(self,docId):
+		"""
+		Load a document. If it could not be loaded, drop its id, and return None
+		@rtype: L{bioscope.BioscopeDocument}
+		"""
+		d=self.load_document(docId)
+		if d is None:
+			self.id_set.discard(docId)
+			self.document_ids.remove(docId)
+		return d
+
+	def iter_uncached(self):
+		"""
+		Iterate over the (docId,document) pairs, without adding the loaded documents to the cache. Documents that could not be loaded are skipped
+		@rtype: C{iterator}
+		"""
+		for docId in list(self.document_ids):
+			if docId in self.cache:
+				d=self.cache[docId]
+			else:
+				d=self._load(docId)
+			if d is not None:
+				yield (docId,d)
+
+
+def _read_snapshot_document(data,offset,length,docId,bcp,leaf_values):
+	"""
+	Build a document (L{bioscope.BioscopeDocument}) from its snapshot representation, found at the given position of the snapshot file
+	"""
+	sentences=[]
+	for (sentenceId,sindex,data_loaded,rows,tree) in marshal.loads(data[offset:offset+length]):
+		s=BioscopeSentence(docId,sentenceId,sindex,bcp)
+		if rows is not None:
+			s.leaf_attributes=SentenceLeafAttributes(rows,leaf_values)
+		s.data=_decode_tree(tree,s.leaf_attributes)
+		s.data_loaded=data_loaded
+		s.find_cues()
+		sentences.append(s)
+	return BioscopeDocument(docId,bcp,sentences)
+
+
+def _encode_tree(t):
+	"""
+	Given a parsing tree, return it as nested tuples (label,children), that can be stored with C{marshal}. L{bioscope.LeafAttributes} labels are stored as their leaf index
+	(the attributes themselves are stored with the sentence)
+	"""
+	label=t.label()
+	if isinstance(label,LeafAttributes):
+		label=label.leaf
+	return (label,[child if isinstance(child,basestring) else _encode_tree(child) for child in t])
+
+
+def _decode_tree(encoded,leaf_attributes):
+	"""
+	Build the parsing tree (C{nltk.tree.Tree}) encoded by L{_encode_tree}, with labels that refer to the given sentence leaf attributes
+	"""
+	(label,children)=encoded
+	if isinstance(label,int):
+		label=leaf_attributes.label(label)
+	return nltk.tree.Tree(label,[child if isinstance(child,basestring) else _decode_tree(child,leaf_attributes) for child in children])
+
+
+def _init_load_worker(bcp):
+	"""
+	Keep the corpus processor for the documents loaded by the worker process, and create the vocabulary of their leaf attributes
+	"""
+	global _worker_bcp,_worker_leaf_values
+	_worker_bcp=bcp
+	_worker_leaf_values=LeafValues()
+
+
+def _load_document(docId):
+	"""
+	Load a document in a worker process. Returns (docId,)+ the result of L{_read_document}.
+	Returns (docId,None,None,None) for any other error: the error may not be picklable, so the main process loads the document again, and raises it, 
+	as the sequential load does
+	"""
+	try:
+		return (docId,)+_read_document(docId,_worker_bcp,_worker_leaf_values)
+	except Exception:
+		return (docId,None,None,None)
+
+
+def _read_document(docId,bcp,leaf_values=None):
+	"""
+	Load a document from the corpus files, for the sequential and the parallel loads of L{BioscopeCorpus}, so both handle errors the same way. 
+	Returns (document,None,realignment statistics), or (None,error description,None) if the document could not be loaded because its files do not match 
+	(an C{IndexError}). Other errors are raised. The leaf attributes of the document use the leaf_values vocabulary (see L{bioscope.LeafValues})
+	"""
+	retokenize_stats=dict()
+	try:
+		d=BioscopeDocument(docId,bcp)
+		d.add_genia_and_bioscope_info(bcp,retokenize_stats,leaf_values)
+		return (d,None,retokenize_stats)
+	except IndexError:
+		return (None,traceback.format_exc(),None)
+
 		
 class BioscopeDocument:
 	""" 
@@ -55,16 +711,22 @@ class BioscopeDocument:
 	"""
 	
 	
-	def __init__(self, docId,bcp):
+	def __init__(self, docId,bcp,sentences=None):
 		""" 
 		Create the document and its sentences, loading from the corresponding files. This method does not loads Genia information (this is done with 
 		L{bioscope.BioscopeDocument.add_genia_and_bioscope_info}
 		
 		@type bcp: L{bioscope.BioscopeCorpusProcessor}
+		@arg sentences: if given, the document sentences (L{bioscope.BioscopeSentence}), already loaded. Files are not read
+		@type sentences: C{List}
 		@rtype: C{None}
 		"""
 
 		self.docId=docId
+
+		if sentences is not None:
+			self.sentences=dict([(s.sentenceId,s) for s in sentences])
+			return
 		
 		# Get sentence ids within the document 
 		sentence_ids=bcp.get_sentence_ids(docId)
@@ -83,9 +745,13 @@ class BioscopeDocument:
 			#print>>stderr, key, sentence.sindex
 			sentence.data=parsed_sentences[sentence.sindex]
 
-	def add_genia_and_bioscope_info(self,bcp):	
+	def add_genia_and_bioscope_info(self,bcp,retokenize_stats=None,leaf_values=None):	
 		"""
 		Adds to the parsing tree the tagging information produced by Genia Tagger
+		@arg retokenize_stats: if given, the statistics of the realignment of bioscope tokens with Genia words are added to it (see L{bioscope_retokenize})
+		@type retokenize_stats: C{dict}
+		@arg leaf_values: vocabulary for the leaf attributes, usually the corpus one. If not given, each sentence gets its own
+		@type leaf_values: L{bioscope.LeafValues}
 		@rtype: C{None}
 		"""
 	
@@ -101,16 +767,16 @@ class BioscopeDocument:
 
 			# If tokenization is different, use some heuristics to realign
 			if len(genia_words)!=len(bioscope_tokens) and genia_words and bioscope_tokens:
-				bioscope_tokens=pln_inco.bioscope.bioscope_retokenize(genia_words,bioscope_tokens)
+				bioscope_tokens=pln_inco.bioscope.bioscope_retokenize(genia_words,bioscope_tokens,retokenize_stats)
 				
 			if len(genia_words)==len(bioscope_tokens)==len(parse_tree.leaves()):
+				leaf_attributes=SentenceLeafAttributes(values=leaf_values)
 				j=0
-				for p in parse_tree.leaves():
+				for tpos in parse_tree.treepositions('leaves'):
 					# Traverse the tree leaves and add information from Genia results
-					tpos=parse_tree.leaf_treeposition(j)
 					leaf_parent= tpos[0:len(tpos)-1]
 
-					# Modify the tree label, changing it into a Dictionary with the Genia attributes
+					# Modify the tree label, changing it into the Genia attributes (a L{bioscope.LeafAttributes} view of the sentence leaf attributes)
 					# By default, this label is the POS
 					pos=parse_tree[leaf_parent].label()
 
@@ -123,9 +789,12 @@ class BioscopeDocument:
 					specXcope=bioscope_tokens[j][1]['specXcope']
 					negXcope=bioscope_tokens[j][1]['negXcope']
 					
-					parse_tree[leaf_parent].set_label({'lemma':lemma, 'pos':pos, 'chunk':chunk, 'entity':ne, 'specCue':specCue, 'negCue':negCue,'specXcope':specXcope,'negXcope':negXcope})
+					leaf_attributes.append((lemma,pos,chunk,ne,specCue,negCue,specXcope,negXcope))
+					parse_tree[leaf_parent].set_label(leaf_attributes.label(j))
 					j+=1
+				sentence.leaf_attributes=leaf_attributes
 				sentence.data_loaded=True
+				sentence.find_cues()
 			else:
 				print >> stderr, "Problem:"+sentence.sentenceId+":"+self.docId
 				print >> stderr, sentence.sentenceId+':'+self.docId+':'+"Genia    words:",[x[0] for x in genia_words]
@@ -133,6 +802,20 @@ class BioscopeDocument:
 				print >> stderr, sentence.sentenceId+':'+self.docId+':'+"Leaves:        ",[x for x in parse_tree.leaves()]
 				print >> stderr, "Lengths:",len(genia_words)," ",len(bioscope_tokens)," ", len(parse_tree.leaves())
 				sentence.data_loaded=False
+
+	def iter_basic_attributes(self):
+		"""
+		Iterate over the tokens and their attributes (see L{BioscopeSentence.get_basic_attributes}) of every sentence of the document whose information was loaded, 
+		in document order
+		@return: iterator of (sentenceId, token number, attributes) tuples
+		@rtype: C{iterator}
+		"""
+		for sentence in sorted(self.sentences.values(),key=lambda s:s.sindex):
+			if sentence.data_loaded:
+				token_num=0
+				for attributes in sentence.iter_basic_attributes():
+					yield (sentence.sentenceId,token_num,attributes)
+					token_num+=1
 				
 class BioscopeSentence:
 	""" 
@@ -147,6 +830,11 @@ class BioscopeSentence:
 		@type data: C{nltk.Tree}
 		@ivar data_loaded: feature indicating if the information for the sentence has been correctly loaded 
 		@type data_loaded: C{bool}
+		@ivar leaf_attributes: attributes of the tree leaves, which the preterminal labels refer to. None if the information was not loaded
+		@type leaf_attributes: L{bioscope.SentenceLeafAttributes}
+		@ivar cues: hedge and negation cues in the sentence, as (leaf number, cue type, lemma) tuples. The cue type is 'speculation' or 'negation'. 
+		A leaf that is both appears twice
+		@type cues: C{List}
 	"""
 	
 	def __init__(self,docId,sentenceId,sindex,bcp):
@@ -161,51 +849,34 @@ class BioscopeSentence:
 		self.sindex=sindex
 		self.data=None
 		self.data_loaded=False
+		self.leaf_attributes=None
+		self.cues=[]
+		self._leaf_tables=None
 		
+	def find_cues(self):
+		"""
+		Find the hedge and negation cues of the sentence, from the leaf labels, and keep them in C{cues}. 
+		This is done when the sentence is loaded; call it again if the tree or its labels change
+		@rtype: C{None}
+		"""
+		cues=[]
+		if self.data is not None:
+			j=0
+			for tpos in self.data.treepositions('leaves'):
+				label=self.data[tpos[0:len(tpos)-1]].label()
+				if isinstance(label,LEAF_LABEL_TYPES):
+					for (key,cue_type) in (('specCue','speculation'),('negCue','negation')):
+						if [tag for tag in label[key] if tag!='O']:
+							cues.append((j,cue_type,label['lemma']))
+				j+=1
+		self.cues=cues
+
 	def has_hedging(self):
 		"""
 		Returns true if the sentence includes a hedge cude
 		@rtype: C{bool}
 		"""
-
-
-		def has_hedge_cue(s): 
-			""" 
-			Given a node, returns True if it corresponds to a hedge cue
-			@rtype: bool
-			@arg s: tree node
-			@type s: types.StringType o types.DictType
-			"""
-			if isinstance(s,types.StringType):
-				return False
-			elif isinstance(s,types.DictType):
-				if s['specCue'] !='O':
-					return True
-				else:
-					return False
-
-
-		def has_hedging(t):
-			"""
-			Given a tree, returns True if it includes a hedge cue
-			@rtype:bool
-			@arg t:
-			@type t: nltk.tree.Tree
-			"""
-			hh=False
-			if has_hedge_cue(t.label()):
-				return True
-			else:
-				for child in t: 
-					if isinstance(child,nltk.tree.Tree):
-						hh=has_hedging(child)
-
-					if hh:
-						return True
-
-			return False
-			
-		return has_hedging(self.data)
+		return bool([cue for cue in self.cues if cue[1]=='speculation'])
 
 
 	def has_negation(self):
@@ -213,46 +884,21 @@ class BioscopeSentence:
 		Returns True if the sentence includes a negation mark
 		@rtype: C{bool}
 		"""
+		return bool([cue for cue in self.cues if cue[1]=='negation'])
 
-
-		def has_negation_cue(s): 
-			""" 
-			Given a node, return True if it corresponds to a Negation Cue
-			@rtype: bool
-			@arg s: Tree node 
-			@type s: types.StringType o types.DictType
-			"""
-			if isinstance(s,types.StringType):
-				return False
-			elif isinstance(s,types.DictType):
-				if s['negCue'] !='O':
-					return True
-				else:
-					return False
-
-
-		def has_negation(t):
-			"""
-			Given a parsing tree, returns True if it includes a negation cue
-			@rtype:bool
-			@arg t:
-			@type t: nltk.tree.Tree
-			"""
-			hh=False
-			#if has_negation_cue(t.node):
-			if has_negation_cue(t.label()):
-				return True
-			else:
-				for child in t: 
-					if isinstance(child,nltk.tree.Tree):
-						hh=has_negation(child)
-
-					if hh:
-						return True
-
-			return False
-			
-		return has_negation(self.data)
+	def get_sentence_type(self):
+		"""
+		Returns the sentence type, according to its cues: 'SPECULATION_NEGATION', 'SPECULATION', 'NEGATION' or 'NONE'
+		@rtype: C{string}
+		"""
+		if self.has_hedging() and self.has_negation():
+			return 'SPECULATION_NEGATION'
+		elif self.has_hedging():
+			return 'SPECULATION'
+		elif self.has_negation():
+			return 'NEGATION'
+		else:
+			return 'NONE'
 
 
 	def get_dot(self):
@@ -268,7 +914,7 @@ class BioscopeSentence:
 			if isinstance(s,unicode):
 				# If we have a unicode string, returns it  
 				res=s
-			elif isinstance(s,types.DictType):
+			elif isinstance(s,LEAF_LABEL_TYPES):
 				# build the string using dictionary values 
 				res=s['pos']
 				
@@ -331,28 +977,94 @@ class BioscopeSentence:
 		The first element is a list with the attributes names
 		@rtype: C{List}
 		"""
-
-
-		def get_tree_leaves(t):
-			"""
-			Given a tree, returns a list with its elements and tags, inorder.
-			"""
-			
-			res=[]
-			for child in t: 
-				if isinstance(child, unicode):
-					#s=t.node
-					s=t.label()
-					res=[(child,s['lemma'],s['pos'],s['chunk'],strip(s['entity']),s['specCue'],s['negCue'],s['specXcope'],s['negXcope'])]
-				else:
-					res += get_tree_leaves(child)
-			return res
-				
 		
 		s_table=[('TOKEN','LEMMA','POS','CHUNK','NE','SPEC-CUE','NEG-CUE','SPEC-XCOPE','NEG-XCOPE')]
-		s_table += get_tree_leaves(self.data)
+		s_table += self.iter_basic_attributes()
 		return s_table
+
+	def iter_basic_attributes(self):
+		"""
+		Iterate over the tokens and their attributes, like L{get_basic_attributes} (without the attribute names). The tree is traversed inorder, 
+		without recursion, and rows are generated as the leaves are found
+		@rtype: C{iterator}
+		"""
+
+		# Nodes to visit, the next one at the end
+		stack=[self.data]
+		pop=stack.pop
+		while stack:
+			t=pop()
+
+			# A leaf replaces what was found before it in the node, so only the last leaf gives a row, followed by the subtrees to its right
+			leaf=None
+			subtrees=[]
+			for child in t:
+				if isinstance(child,basestring):
+					leaf=child
+					subtrees=[]
+				else:
+					subtrees.append(child)
+
+			if leaf is not None:
+				s=t.label()
+				if isinstance(s,LeafAttributes):
+					(lemma,pos,chunk,entity,specCue,negCue,specXcope,negXcope)=s.store.row(s.leaf)
+					yield (leaf,lemma,pos,chunk,entity.strip(),specCue,negCue,specXcope,negXcope)
+				else:
+					yield (leaf,s['lemma'],s['pos'],s['chunk'],s['entity'].strip(),s['specCue'],s['negCue'],s['specXcope'],s['negXcope'])
+
+			if subtrees:
+				subtrees.reverse()
+				stack.extend(subtrees)
 	
+	def _get_leaf_tables(self):
+		"""
+		Return the leaf tables of the sentence tree: (tree, leaves, leaf treepositions, node spans). They are built with a single traversal of the tree,
+		the first time they are used, and built again if the tree is replaced
+		@rtype: C{tuple}
+		"""
+		if self._leaf_tables is None or self._leaf_tables[0] is not self.data:
+			parse_tree=self.data
+			leaf_treepositions=parse_tree.treepositions('leaves')
+			leaves=[parse_tree[leaf_treepos] for leaf_treepos in leaf_treepositions]
+
+			# Every node includes the leaves below it. Leaves are visited in order, so the first one found is the first leaf of the node
+			spans=dict()
+			j=0
+			for leaf_treepos in leaf_treepositions:
+				for k in range(len(leaf_treepos)+1):
+					node_treepos=leaf_treepos[:k]
+					if node_treepos in spans:
+						spans[node_treepos]=(spans[node_treepos][0],j)
+					else:
+						spans[node_treepos]=(j,j)
+				j+=1
+			self._leaf_tables=(parse_tree,leaves,leaf_treepositions,spans)
+		return self._leaf_tables
+
+	def get_leaves(self):
+		"""
+		Return the leaves of the sentence tree (do not modify the list)
+		@rtype: C{List}
+		"""
+		return self._get_leaf_tables()[1]
+
+	def get_leaf_treepositions(self):
+		"""
+		Return the treeposition of each leaf of the sentence tree, indexed by leaf number (do not modify the list)
+		@rtype: C{List}
+		"""
+		return self._get_leaf_tables()[2]
+
+	def get_node_span(self,treepos):
+		"""
+		Given a tree node, return the numbers of its first and last leaves
+		@arg treepos: node position within the sentence tree
+		@type treepos: C{tuple}
+		@rtype: C{tuple}
+		"""
+		return self._get_leaf_tables()[3][tuple(treepos)]
+
 	def get_leaf_grandparent(self,leaf_pos,gp_number):
 		"""
 		Given a tree leave, returns its grandparent tree, and a treepos indicating the position in the original tree
@@ -365,7 +1077,7 @@ class BioscopeSentence:
 		"""
 		parse_tree=self.data
 		# Get the leave treepos 
-		leaf_treepos=parse_tree.leaf_treeposition(leaf_pos)
+		leaf_treepos=self.get_leaf_treepositions()[leaf_pos]
 		# Its grandparent treepos is just the same, without the last gp_number elements 
 		leaf_grandparent=leaf_treepos[0:len(leaf_treepos)-gp_number]
 		
@@ -379,27 +1091,10 @@ class BioscopeSentence:
 		@type treepos: C{List}
 		@rtype: C{sequence}
 		"""
-		parse_tree=self.data
-		subtree=parse_tree[treepos]
-		# Move from 0, to find the first position of the scope 
-		current_treepos=treepos
-		while not isinstance(parse_tree[current_treepos],types.StringType):
-			current_treepos=current_treepos+(0,)
-		subtree_start_treepos=current_treepos
-		subtree_end=subtree.leaf_treeposition(len(subtree.leaves())-1)
-		subtree_end_treepos=treepos+subtree_end
-		
-		j=0
-		for l in parse_tree.leaves():
-			if parse_tree.leaf_treeposition(j) == subtree_start_treepos:
-				start=j
-			if parse_tree.leaf_treeposition(j)== subtree_end_treepos:
-				if parse_tree[subtree_end_treepos]=='.':
-					end=j-1
-				else:
-					end=j
-				break
-			j+=1
+		# The scope goes from the first to the last leaf of the node 
+		(start,end)=self.get_node_span(treepos)
+		if self.get_leaves()[end]=='.':
+			end=end-1
 		return (start,end)
 			
 
@@ -425,7 +1120,7 @@ class BioscopeSentence:
 		if parse_tree[treepos].node in ['S','SBAR']:
 			child_number=0
 			for child in parse_tree[treepos]:
-				if isinstance(child.node,types.DictType):
+				if isinstance(child.node,LEAF_LABEL_TYPES):
 					if child.node['lemma']<>',':
 						current_treepos=treepos+(child_number,)
 						break
@@ -443,7 +1138,7 @@ class BioscopeSentence:
 			j=0
 			while j<len(children):
 				child=children[j]
-				if isinstance(child.node,types.DictType):
+				if isinstance(child.node,LEAF_LABEL_TYPES):
 					if child.node['pos']=='DT' and children[j+1].node['pos']=='JJ':
 						pass
 					else:
@@ -451,23 +1146,10 @@ class BioscopeSentence:
 						break
 				j+=1
 				
-		while not isinstance(parse_tree[current_treepos],types.StringType):
-			current_treepos=current_treepos+(0,)
-		subtree_start_treepos=current_treepos
-		subtree_end=subtree.leaf_treeposition(len(subtree.leaves())-1)
-		subtree_end_treepos=treepos+subtree_end
-		
-		j=0
-		for l in parse_tree.leaves():
-			if parse_tree.leaf_treeposition(j) == subtree_start_treepos:
-				start=j
-			if parse_tree.leaf_treeposition(j)== subtree_end_treepos:
-				if parse_tree[subtree_end_treepos]=='.':
-					end=j-1
-				else:
-					end=j
-				break
-			j+=1
+		start=self.get_node_span(current_treepos)[0]
+		end=self.get_node_span(treepos)[1]
+		if self.get_leaves()[end]=='.':
+			end=end-1
 		return (start,end)
 		
 		
@@ -476,22 +1158,7 @@ class BioscopeSentence:
 		Given a tree and a node, returns the left position of the scope
 		"""
 		
-		parse_tree=self.data
-		
-		current_treepos=treepos
-		while not isinstance(parse_tree[current_treepos],types.StringType):
-			current_treepos=current_treepos+(0,)
-		subtree_start_treepos=current_treepos
-		
-		j=0
-		for l in parse_tree.leaves():
-			if parse_tree.leaf_treeposition(j) == subtree_start_treepos:
-				start=j
-				break
-			else:
-				j+=1
-		
-		return start
+		return self.get_node_span(treepos)[0]
 
 
 
@@ -499,20 +1166,9 @@ class BioscopeSentence:
 			"""
 			Given a tree and a node, returns the right position of the scope
 			"""
-			parse_tree=self.data
-			subtree_end=parse_tree[treepos].leaf_treeposition(len(parse_tree[treepos].leaves())-1)
-			subtree_end_treepos=treepos+subtree_end
-			
-			j=0
-			for l in parse_tree.leaves():
-				if parse_tree.leaf_treeposition(j)== subtree_end_treepos:
-					if parse_tree[subtree_end_treepos] in ('.',':'):
-						end=j-1
-					else:
-						end=j
-					break
-				j+=1
-			
+			end=self.get_node_span(treepos)[1]
+			if self.get_leaves()[end] in ('.',':'):
+				end=end-1
 			return end
 
 
@@ -530,8 +1186,8 @@ class BioscopeSentence:
 		parse_tree=self.data
 		subtree=parse_tree[treepos]
 		node_pos=subtree.node
-		hedge_cue_treepos=parse_tree.leaf_treeposition(hedge_cue_pos)
-		leaves=parse_tree.leaves()
+		hedge_cue_treepos=self.get_leaf_treepositions()[hedge_cue_pos]
+		leaves=self.get_leaves()
 
 		
 		#parent_treepos=treepos[0:len(treepos)-1]
@@ -553,7 +1209,7 @@ class BioscopeSentence:
 				# Omit PP and SBAR to the left of the scope
 				j=0
 				for child in subtree:
-					if isinstance(child.node,types.DictType):
+					if isinstance(child.node,LEAF_LABEL_TYPES):
 						if child.node['lemma']<>',':
 							start=self.get_scope_start(treepos+(j,))
 							break
@@ -602,7 +1258,7 @@ class BioscopeSentence:
 				# If the hedge cue is a JJ, delete determiners
 				hedge_cue_treepos2=hedge_cue_treepos[0:len(hedge_cue_treepos)-1]
 				if parse_tree[hedge_cue_treepos2].node['pos']=='JJ':
-					first_leaf=parse_tree.leaf_treeposition(start)
+					first_leaf=self.get_leaf_treepositions()[start]
 					first_leaf_parent=first_leaf[0:len(first_leaf)-1]
 
 					if parse_tree[first_leaf_parent].node['pos']=='DT':	
@@ -653,6 +1309,9 @@ class BioscopeCorpusProcessor:
 	@ivar parser_grammar_file: stanford parser Grammar file
 	@type parser_grammar_file: C{string}
 	
+	@ivar bioscope_xml_file: Bioscope corpus file, within the C{working_dir}
+	@type bioscope_xml_file: C{string}
+
 	@ivar original_bioscope_corpus: XML file for the Bioscope corpus 
 	@type original_bioscope_corpus: C{xml.etree.ElementTree}
 	
@@ -670,6 +1329,12 @@ class BioscopeCorpusProcessor:
 
 	@ivar att_database: SQLite file for the corpus. It is called attributes.db, and placed in the C{working_dir}
 	@type att_database:C{string}
+
+	@ivar bioscope_cache_size: number of .bioscope documents whose xml tree is kept in memory (see L{get_bioscope_document})
+	@type bioscope_cache_size: C{int}
+
+	@ivar full_fingerprint: if True, L{get_source_fingerprint} checks every .genia file, not only the genia directory. False by default
+	@type full_fingerprint: C{bool}
 	
 	"""
 	
@@ -688,6 +1353,7 @@ class BioscopeCorpusProcessor:
 		"""
 		
 		self.working_dir=working_dir
+		self.bioscope_xml_file=bioscope_xml_file
 		self.txt_dir=os.path.join(working_dir,'txt')
 		self.parsed_files_dir=os.path.join(working_dir,'parsed')
 		self.bioscope_files_dir=os.path.join(working_dir,'bioscope')
@@ -720,6 +1386,78 @@ class BioscopeCorpusProcessor:
 		# SQLite DB for storign attributes
 		self.att_database=os.path.join(working_dir,'attributes.db');
 
+		# Parsed .bioscope documents, most recently used last
+		self.bioscope_cache_size=8
+		self._bioscope_documents=collections.OrderedDict()
+
+		# The genia directory has a file for each sentence, so by default the snapshot fingerprint does not look at each of them
+		self.full_fingerprint=False
+
+	def get_source_fingerprint(self,full=None):
+		"""
+		Return a fingerprint of the corpus files the L{bioscope.BioscopeCorpus} is loaded from (the corpus xml file, and the .bioscope, .parsed and .genia files). 
+		The corpus xml file, and the .bioscope and .parsed files (one for each document) are fingerprinted by their names, sizes and modification times.
+		The .genia files are one for each sentence, so, unless C{full} is True, only the names of the files and the modification time of their directory are used:
+		the fingerprint changes when a .genia file is added, removed or renamed, but not when one is rewritten in place
+		@arg full: if True, fingerprint each .genia file like the others. Defaults to C{full_fingerprint}. Fingerprints with and without C{full} differ
+		@type full: C{bool}
+		@rtype: C{string}
+		"""
+
+		if full is None:
+			full=self.full_fingerprint
+
+		files=[self.bioscope_xml_file]
+		genia_names=[]
+		for directory in (self.bioscope_files_dir,self.parsed_files_dir,self.genia_files_dir):
+			if os.path.isdir(directory):
+				names=[os.path.join(os.path.basename(directory),name) for name in sorted(os.listdir(directory))]
+				if directory==self.genia_files_dir and not full:
+					genia_names=names
+				else:
+					files+=names
+
+		fingerprint=hashlib.sha1()
+		for name in files:
+			st=os.stat(os.path.join(self.working_dir,name))
+			fingerprint.update('%s\t%d\t%r\n' % (name,st.st_size,st.st_mtime))
+		if genia_names:
+			fingerprint.update('%s\t%r\n' % (os.path.basename(self.genia_files_dir),os.stat(self.genia_files_dir).st_mtime))
+			fingerprint.update('\n'.join(genia_names))
+		return fingerprint.hexdigest()
+
+	def get_bioscope_document(self,docId):
+		"""
+		Read and parse the .bioscope file for a document, and index its sentences by id. The result is cached, so the file is parsed once, 
+		no matter how many sentences are looked up
+		@arg docId: document identifier
+		@type docId: C{string}
+		@return: (ids,sentences) where ids is the list of sentence identifiers, in document order, and sentences is a dictionary from sentence identifier to its xml element
+		@rtype: C{tuple}
+		"""
+		
+		if docId in self._bioscope_documents:
+			document=self._bioscope_documents.pop(docId)
+		else:
+			bioscope_doc=self.bioscope_files_corpus.xml(docId+'.bioscope')
+			ids=[]
+			sentences=dict()
+			for sentence in bioscope_doc.getchildren():
+				ids.append(sentence.get('id'))
+				sentences[sentence.get('id')]=sentence
+			document=(ids,sentences)
+			while len(self._bioscope_documents)>=self.bioscope_cache_size:
+				self._bioscope_documents.popitem(last=False)
+		self._bioscope_documents[docId]=document
+		return document
+
+	def get_bioscope_sentence(self,docId,sentenceId):
+		"""
+		Return the xml element for a sentence of the .bioscope file, using the document cache (see L{get_bioscope_document})
+		@rtype: C{xml.etree.ElementTree}
+		"""
+		return self.get_bioscope_document(docId)[1][sentenceId]
+
 		
 	def get_doc_ids(self,prefix):
 		""" 
@@ -746,12 +1484,7 @@ class BioscopeCorpusProcessor:
 		
 		"""
 		
-		bioscope_doc=self.bioscope_files_corpus.xml(docId+'.bioscope')
-		ids=[]
-		for sentence in bioscope_doc.getchildren():
-			ids.append(sentence.get('id'))
-		
-		return ids							
+		return list(self.get_bioscope_document(docId)[0])
 			
 	def load_parsed_sentences(self,docId):
 		""" 
@@ -761,8 +1494,42 @@ class BioscopeCorpusProcessor:
 		
 		# Lo primero que hace es parsear el documento, solamente si el documento tiene alguna marca de incertidumbre
 		return self.parsed_files_corpus.parsed_sents(docId+'.parsed')
-		
-		
+
+	def parse_txt_files(self,doc_ids,workers=None,nthreads=1):
+		"""
+		Parse the text version of the given documents (the .txt files in C{txt_dir}, one sentence per line) with the Stanford Parser, and write the results
+		to C{parsed_files_dir}, one .parsed file for each document. The sentences of every document are parsed together, split into shards that run in parallel
+		(see L{stanford_parser.lexicalized_parser_parse_batch}). If a parser process loses or merges a sentence, C{ValueError} is raised before any file is written, 
+		so the analysis are never shifted to other sentences
+		@arg doc_ids: document identifiers
+		@type doc_ids: C{List}
+		@arg workers: number of parser processes
+		@type workers: C{int}
+		@arg nthreads: number of threads for each parser process
+		@type nthreads: C{int}
+		@return: the timing for each shard
+		@rtype: C{List}
+		"""
+
+		document_sentences=[]
+		for docId in doc_ids:
+			f=open(os.path.join(self.txt_dir,docId+'.txt'),'r')
+			# The parser skips empty lines, so we do not send them
+			document_sentences.append([line for line in f.read().split('\n') if line.strip()])
+			f.close()
+
+		(parsed,timings)=stanford_parser.lexicalized_parser_parse_batch([s for sentences in document_sentences for s in sentences],output='penn',workers=workers,nthreads=nthreads)
+
+		i=0
+		for (docId,sentences) in zip(doc_ids,document_sentences):
+			f=open(os.path.join(self.parsed_files_dir,docId+'.parsed'),'w')
+			for tree in parsed[i:i+len(sentences)]:
+				f.write(tree+'\n\n')
+			f.close()
+			i+=len(sentences)
+		return timings
+
+
 	def get_genia_words(self,docId,sentenceId):
 		""" 
 		Given a document and sentence dentifier, return a list of (word,lemma,pos,chunk,ne) tuples generated by the Genia tagger
@@ -783,36 +1550,9 @@ class BioscopeCorpusProcessor:
 		@rtype: Int
 		"""
 		
-
-		def includes_hedging_or_negation(element,xcope_id,scope_type):
-			if element.tag=='cue' and element.get('type')==scope_type and element.get('ref')==xcope_id:
-				return True
-			else:
-				for ch in element.getchildren():
-					if includes_hedging_or_negation(ch,xcope_id,scope_type):
-						return True
-				return False
-
-
-		def get_bioscope_element_hedge_or_negation_levels(element,scope_type):
-			if element.tag=='xcope' and includes_hedging_or_negation(element,element.get('id'),scope_type):
-				nested_levels=1
-			else:
-				nested_levels=0
-
-			# Sum children hedge nesting level
-			child_max_nested_levels=0
-			for ch in element.getchildren():
-					if get_bioscope_element_hedge_or_negation_levels(ch,scope_type) > child_max_nested_levels:
-						child_max_nested_levels=get_bioscope_element_hedge_or_negation_levels(ch,scope_type)
-			return child_max_nested_levels+nested_levels
-					
-		bioscope_doc=self.bioscope_files_corpus.xml(docId+'.bioscope')
-		for sentence in bioscope_doc.getchildren():
-			if sentence.get('id')==sentenceId:
-				hedge_levels= get_bioscope_element_hedge_or_negation_levels(sentence,scope_type)
-
-		return hedge_levels
+		sentence=self.get_bioscope_sentence(docId,sentenceId)
+		(xcope_types,levels)=bioscope_scope_info(sentence)
+		return levels.get(scope_type,0)
 		
 	def get_bioscope_tokens(self,docId,sentenceId):
 		"""
@@ -820,259 +1560,177 @@ class BioscopeCorpusProcessor:
 		@rtype: C{List}
 		"""
 
-		# Get the max nesting levels for the sentence 
-		max_hedge_levels=self.get_max_nesting_level(docId,sentenceId,scope_type='speculation')
-		hedge_scopes = ['O' for i in range(max_hedge_levels)]
-		max_negation_levels=self.get_max_nesting_level(docId,sentenceId,scope_type='negation')
-		negation_scopes = ['O' for i in range(max_negation_levels)]
-		
-		
-		def includes_hedging_or_negation(element,xcope_id,scope_type):
-			if element.tag=='cue' and element.get('type')==scope_type and element.get('ref')==xcope_id:
-				return True
-			else:
-				for ch in element.getchildren():
-					if includes_hedging_or_negation(ch,xcope_id,scope_type):
-						return True
-	
-				return False
-		
-		
-		def get_bioscope_element_spec_tags(element,hedge_cue_num,negation_cue_num,hedge_scopes,negation_scopes):
+		sentence=self.get_bioscope_sentence(docId,sentenceId)
+
+		# Find which xcopes are speculation/negation scopes, and the max nesting levels for the sentence 
+		(xcope_types,levels)=bioscope_scope_info(sentence)
+		max_hedge_levels=levels.get('speculation',0)
+		max_negation_levels=levels.get('negation',0)
+
+		# Tokenize every text segment of the sentence using the Penn Treebank tokenizer... The elements below take the token lists in the same order
+		segment_tokens=iter(bioscope_tokenize_segments(bioscope_get_text_segments(sentence)))
+
+		# At the begining of the sentence, the scope lists are empty ('O'). 
+		# Each one works as a stack: an xcope takes the first 'O' level when it starts ('B'), which becomes 'I' after its first token, and it drops the last level when it ends
+		hedge_scopes=['O' for i in range(max_hedge_levels)]
+		negation_scopes=['O' for i in range(max_negation_levels)]
+
+		# Cue marks for the tokens that are not part of a cue
+		no_hedge_cues=['O' for i in range(max(max_hedge_levels,1))]
+		no_negation_cues=['O' for i in range(max(max_negation_levels,1))]
+
+		def scope_marks(scopes,b_mark,i_mark):
+			"""
+			Return the scope marks for the current token, and move the levels that begin to 'I'
+			"""
+			marks=[]
+			j=0
+			for i in scopes:
+				if i=='B':
+					marks.append(b_mark)
+					scopes[j]='I'
+				elif i=='I':
+					marks.append(i_mark)
+				else:
+					marks.append('O')
+				j=j+1
+			if not marks:
+				marks=['O']
+			return marks
+
+		def begin_scope(scopes):
+			"""
+			Substitute the first 'O' with a 'B'
+			"""
+			j=0
+			for i in scopes:
+				if i!='O':
+					j=j+1
+				else:
+					scopes[j]='B'
+					break
+
+		def end_scope(scopes):
+			"""
+			Drop the last nesting level
+			"""
+			j=0
+			while j<len(scopes) and scopes[j]!='O':
+				j=j+1
+			scopes[j-1]='O'
+
+		def get_bioscope_element_spec_tags(element,hedge_cue_num,negation_cue_num):
 			
 			""" 
 			Given an element of the xml tree (C{xml.etree.ElementTree}), returns the Bioscope marks. If the node corresponds to a text, it tokenizes it.
-			Adicionalmente, si es un texto, lo tokeniza.
 			@type element: C{xml.etree.ElementTree}
 
 			"""
-		
-			# Tokenize using the Penn Treebank tokenizer... 
-			wt=nltk.tokenize.TreebankWordTokenizer()
-
-			# Find each token's attributes
-			hedge_cues=['O' for i in range(max_hedge_levels)]
-			negation_cues=['O' for i in range(max_negation_levels)]
-			if element.tag=='sentence':
-				# At the begining of the sentence, the speculation mark is False, the negation mark is empty, and the scope list is also empty
-				# La lista de scopes está vacía
-				hedge_scopes=['O' for i in hedge_scopes]
-				negation_scopes=['O' for i in negation_scopes]
-				hedge_cues=['O' for i in hedge_cues]
-				negation_cues=['O' for i in negation_cues]
-			elif element.tag=='cue' and element.get('type')=='negation':
-				# Found a negation cue
-				pass
-			elif element.tag=='cue' and element.get('type')=='speculation':
-				# Starts a speculation block
-				# Elements within this scope are marked as speculative
-				pass
-			elif element.tag=='xcope':
-				# If i am in a speculation/negation scope, I still do not have a hedge cue
-				
-				# If it is a hedge scope, increase de nesting levelSi es un hedge de scope, entonces aumento un nivel de anidamiento
-				if includes_hedging_or_negation(element,element.get('id'),scope_type='speculation'):
-					hedge_cue_num=hedge_cue_num+1
-					# New hedging level
-					j=0
-					for i in hedge_scopes:
-						if i!='O':
-							j=j+1
-						else:
-							# Substitute the first 'O' with a 'B'
-							hedge_scopes[j]='B'
-							break
-					
-				if includes_hedging_or_negation(element,element.get('id'),scope_type='negation'):
-					negation_cue_num=negation_cue_num+1				
-					# New negation level 
-					j=0
-					for i in negation_scopes:
-						if i!='O':
-							j=j+1
-						else:
-							negation_scopes[j]='B'
-							break
 
-			
-			# If the text contains text, tokenize it and add the corresponding tags
-			if element.text:
-				element_text=wt.tokenize(element.text)
-			else:
-				element_text=[]
-				
+			types=xcope_types.get(element,())
+
+			# If it is a speculation/negation scope, increase the nesting level
+			if 'speculation' in types:
+				hedge_cue_num=hedge_cue_num+1
+				begin_scope(hedge_scopes)
+			if 'negation' in types:
+				negation_cue_num=negation_cue_num+1
+				begin_scope(negation_scopes)
+
+			# If the element contains text, tokenize it and add the corresponding tags
 			element_tagged_text=[]
-			
-			first_token=True
-			for elem in element_text:
-				
-				# Load the speculation mark values
-				
-				if hedge_cue_num>0 and element.get('type')=='speculation':
-					if first_token:
-						hedge_cues[hedge_cue_num-1]='B-SPECCUE'
-						first_token=False
-					else:
-						hedge_cues[hedge_cue_num-1]='I-SPECCUE'
-				else:
-					hedge_cues=['O' for i in hedge_cues]
-					
-				# Load negation mark values
-				if negation_cue_num>0  and element.get('type')=='negation':
-					if first_token:
-						negation_cues[negation_cue_num-1]='B-NEGCUE'
-						first_token=False
-					else:
-						negation_cues[negation_cue_num-1]='I-NEGCUE'
-				else:
-					negation_cues=['O' for i in negation_cues]
+			if element.text:
+				first_token=True
+				for elem in segment_tokens.next():
 					
-				# Load scope marks 
-				j=0
-				hedge_scope_marks=[]
-				for i in hedge_scopes:
-					if i=='B':
-						hedge_scope_marks.append('B-SPECXCOPE')
-						hedge_scopes[j]='I'
-					elif i=='I':
-						hedge_scope_marks.append('I-SPECXCOPE')						
+					# Load the speculation/negation mark values
+					if hedge_cue_num>0 and element.get('type')=='speculation':
+						hedge_cues=['O' for i in range(max_hedge_levels)]
+						if first_token:
+							hedge_cues[hedge_cue_num-1]='B-SPECCUE'
+							first_token=False
+						else:
+							hedge_cues[hedge_cue_num-1]='I-SPECCUE'
 					else:
-						hedge_scope_marks.append('O')	
-					j=j+1
+						hedge_cues=list(no_hedge_cues)
 
-
-				# Load negation scope marks 
-				j=0
-				negation_scope_marks=[]
-				for i in negation_scopes:
-					if i=='B':
-						negation_scope_marks.append('B-NEGXCOPE')
-						negation_scopes[j]='I'
-					elif i=='I':
-						negation_scope_marks.append('I-NEGXCOPE')						
+					if negation_cue_num>0  and element.get('type')=='negation':
+						negation_cues=['O' for i in range(max_negation_levels)]
+						if first_token:
+							negation_cues[negation_cue_num-1]='B-NEGCUE'
+							first_token=False
+						else:
+							negation_cues[negation_cue_num-1]='I-NEGCUE'
 					else:
-						negation_scope_marks.append('O')	
-					j=j+1
-					
-			
-				if not hedge_scope_marks:
-					hedge_scope_marks=['O']
+						negation_cues=list(no_negation_cues)
 
-				if not negation_scope_marks:
-					negation_scope_marks=['O']
+					# Add the element to the tagged text
+					element_tagged_text.append((elem,{'SpecCue':hedge_cues,'NegCue':negation_cues,'specXcope':scope_marks(hedge_scopes,'B-SPECXCOPE','I-SPECXCOPE'),'negXcope':scope_marks(negation_scopes,'B-NEGXCOPE','I-NEGXCOPE')}))
 
-				if not hedge_cues:
-					hedge_cues=['O']
-				
-				if not negation_cues:
-					negation_cues=['O']
-					
-					
-				#print >> stderr, 'Anoto el texto ',elem, ' con el tag ',hedge_cues
-				# Add the element to the tagged text
-				element_tagged_text.append((elem,{'SpecCue':[h for h in hedge_cues],'NegCue':[h for h in negation_cues],'specXcope':hedge_scope_marks,'negXcope':negation_scope_marks}))
-					
-							
-			
 			# Process childen 
-			j=0
 			for ch in element.getchildren():
-				element_tagged_text += get_bioscope_element_spec_tags(ch,hedge_cue_num,negation_cue_num,hedge_scopes,negation_scopes)
+				element_tagged_text += get_bioscope_element_spec_tags(ch,hedge_cue_num,negation_cue_num)
 			
-			# Process the text to the right of the tag
+			# If the scope ends, drop the last nesting level
+			if 'speculation' in types:
+				end_scope(hedge_scopes)
+			if 'negation' in types:
+				end_scope(negation_scopes)
+
+			# Process the text to the right of the tag. What appears to the right is never a speculation/negation mark
+			hedge_scope_marks=scope_marks(hedge_scopes,'B-SPECXCOPE','I-SPECXCOPE')
+			negation_scope_marks=scope_marks(negation_scopes,'B-NEGXCOPE','I-NEGXCOPE')
+			element_tagged_tail=[]
 			if element.tail:
-				element_tail=wt.tokenize(element.tail)
-			else:
-				element_tail=[]
+				for elem in segment_tokens.next():
+					element_tagged_tail.append((elem,{'SpecCue':list(no_hedge_cues),'NegCue':list(no_negation_cues), 'specXcope':hedge_scope_marks,'negXcope':negation_scope_marks}))
 
-			element_tagged_tail=[]
-			
-			
-			# What appears to the right is never a speculation/negation mark
-			hedge_cues=['O' for i in hedge_cues]
-			negation_cues=['O' for i in negation_cues]
+			return element_tagged_text + element_tagged_tail
 			
-			# If the speculation scope ends, drop the las nesting level
-			if includes_hedging_or_negation(element,element.get('id'),scope_type='speculation') and element.tag=='xcope':
-				j=0
-				for i in hedge_scopes:
-					if i !='O':
-						j=j+1
-					else:
-						hedge_scopes[j-1]='O'
-						break
-				# If at the end, assign True to the first one, because there is only one
-				hedge_scopes[j-1]='O'
-						
-			# Same for speculation 
-			if includes_hedging_or_negation(element,element.get('id'),scope_type='negation') and element.tag=='xcope':
-				j=0
-				for i in negation_scopes:
-					if i !='O':
-						j=j+1
-					else:
-						negation_scopes[j-1]='O'
-						break
-				negation_scopes[j-1]='O'
-						
-						
-
-			# Load scope mark values
-			j=0
-			hedge_scope_marks=[]
-			for i in hedge_scopes:
-				if i=='B':
-					hedge_scope_marks.append('B-SPECXCOPE')
-					hedge_scopes[j]='I'
-				elif i=='I':
-					hedge_scope_marks.append('I-SPECXCOPE')						
-				else:
-					hedge_scope_marks.append('O')	
-				j=j+1
-
-			# Same for negation scope marks
-			j=0
-			negation_scope_marks=[]
-			for i in negation_scopes:
-				if i=='B':
-					negation_scope_marks.append('B-NEGXCOPE')
-					negation_scopes[j]='I'
-				elif i=='I':
-					negation_scope_marks.append('I-NEGXCOPE')						
-				else:
-					negation_scope_marks.append('O')	
-				j=j+1
-
+		return get_bioscope_element_spec_tags(sentence,hedge_cue_num=0,negation_cue_num=0)
 
-					
-			if not hedge_scope_marks:
-				hedge_scope_marks=['O']
-
-			if not negation_scope_marks:
-				negation_scope_marks=['O']
-				
-			if not hedge_cues:
-				hedge_cues=['O']
-				
-							
-			if not negation_cues:
-				negation_cues=['O']
-			
-			
-			for elem in element_tail:
-				element_tagged_tail.append((elem,{'SpecCue':[h for h in hedge_cues],'NegCue':[h for h in negation_cues], 'specXcope':hedge_scope_marks,'negXcope':negation_scope_marks}))
+def bioscope_scope_info(sentence):
+	"""
+	Given a Bioscope sentence, find its speculation/negation scopes, and their nesting levels, in one traversal of the xml tree.
+	An xcope element is a scope of a given type if it includes a cue of that type which refers to it (the cue's ref attribute is the xcope's id)
+	@arg sentence: sentence element of a .bioscope file
+	@type sentence: C{xml.etree.ElementTree}
+	@return: (xcope_types,levels). xcope_types is a dictionary from each xcope element to the set of cue types that refer to it. 
+	levels is a dictionary from each cue type to the maximum nesting level of its scopes within the sentence
+	@rtype: C{tuple}
+	"""
 
+	xcope_types=dict()
+	# xcopes containing the current element, by id
+	open_xcopes=dict()
 
+	def visit(element):
+		"""
+		Register the cues of the element's subtree, and return the nesting levels for the subtree
+		"""
+		if element.tag=='xcope':
+			xcope_types[element]=set()
+			open_xcopes.setdefault(element.get('id'),[]).append(element)
+		elif element.tag=='cue':
+			for xcope in open_xcopes.get(element.get('ref'),[]):
+				xcope_types[xcope].add(element.get('type'))
+
+		# Max children nesting level
+		levels=dict()
+		for ch in element.getchildren():
+			for (scope_type,level) in visit(ch).iteritems():
+				if level>levels.get(scope_type,0):
+					levels[scope_type]=level
+
+		if element.tag=='xcope':
+			open_xcopes[element.get('id')].pop()
+			for scope_type in xcope_types[element]:
+				levels[scope_type]=levels.get(scope_type,0)+1
+		return levels
+
+	levels=visit(sentence)
+	return (xcope_types,levels)
 
-			return element_tagged_text + element_tagged_tail
-			
-		
-		# Read the bioscope file
-		bioscope_doc=self.bioscope_files_corpus.xml(docId+'.bioscope')
-		for sentence in bioscope_doc.getchildren():
-			if sentence.get('id')==sentenceId:
-				tokens=get_bioscope_element_spec_tags(sentence,hedge_cue_num=0,negation_cue_num=0, hedge_scopes=hedge_scopes, negation_scopes=negation_scopes)
-		return tokens
 
 def bioscope_get_text(xml_element):
 	""" 
@@ -1095,15 +1753,70 @@ def bioscope_get_text(xml_element):
 	texto_hijos=[bioscope_get_text(ch) for ch in xml_element.getchildren()]
 	res=''.join([texto]+texto_hijos+[tail])
 	return res
+
+
+def bioscope_get_text_segments(xml_element):
+	"""
+	Given a bioscope xml tree, return its text segments (the text and tail of each element), in the order they are tokenized by
+	L{BioscopeCorpusProcessor.get_bioscope_tokens}: the text of an element, the segments of its children and then its tail. Empty segments are left out
+	@arg xml_element: XML for the Bioscope corpus
+	@type xml_element: C{xml.etree.ElementTree}
+	@rtype: C{List}
+	"""
+
+	segments=[]
+	def add_segments(element):
+		if element.text:
+			segments.append(element.text)
+		for ch in element.getchildren():
+			add_segments(ch)
+		if element.tail:
+			segments.append(element.tail)
+	add_segments(xml_element)
+	return segments
+
+
+def bioscope_tokenize_segments(segments):
+	"""
+	Tokenize a list of text segments with C{nltk.tokenize.TreebankWordTokenizer}, in one batch. Each segment is tokenized on its own, so 
+	tokens never cross segment boundaries, and the results are the same as tokenizing them one by one. The tokenizer is created once, and shared 
+	by every call, and the tokens of each segment are cached, so segments that repeat (blanks, punctuation, cue words) are tokenized only once
+	@arg segments: text segments
+	@type segments: C{List}
+	@return: a list with the tokens of each segment. The token lists are shared, and must not be modified
+	@rtype: C{List}
+	"""
+	global _treebank_tokenizer
+
+	if _treebank_tokenizer is None:
+		_treebank_tokenizer=nltk.tokenize.TreebankWordTokenizer()
+	tokenize=_treebank_tokenizer.tokenize
+	tokenized=[]
+	for segment in segments:
+		key=(type(segment),segment)
+		tokens=_tokenized_segments.get(key)
+		if tokens is None:
+			if len(_tokenized_segments)>=TOKENIZED_SEGMENTS_CACHE_SIZE:
+				_tokenized_segments.clear()
+			tokens=tokenize(segment)
+			_tokenized_segments[key]=tokens
+		tokenized.append(tokens)
+	return tokenized
 				
 
-def bioscope_retokenize(genia_words,bioscope_tokens):
+def bioscope_retokenize(genia_words,bioscope_tokens,stats=None):
 	"""
 	Given a list of words, resulting form the GENIA tagger tokenizer, and another, resulting from text tokenizing using C{nltk.tokenize.TreebankWordTokenizer()}, retokenizes the second one, to mache Genia tagging
+	Both lists are walked once, side by side: when a Genia word is split in several bioscope tokens (any number of them), they are joined 
+	into one token, with the bioscope attributes of the first one. Tokens that cannot be aligned are kept as they are
 	@arg genia_words: list of words from Genia Tagger tokenization
 	@type genia_words: C{List}
 	@arg bioscope_tokens: list of word from the C{nltk.tokenize.TreebankWordTokenizer()}
 	@type bioscope_tokens: C{List}
+	@arg stats: if given, alignment counts are added to it: 'sentences', 'tokens' (bioscope tokens read), 'merges' (Genia words built 
+	by joining tokens), 'merged_tokens' (tokens joined), 'longest_merge' (most tokens joined into one word) and 'unaligned' (Genia words 
+	matched by no token or token sequence)
+	@type stats: C{dict}
 	@return: bioscope_tokens, retokenizado
 	@rtype: C{List}
 	"""
@@ -1112,43 +1825,82 @@ def bioscope_retokenize(genia_words,bioscope_tokens):
 	# Ignoro los warnings al convertir unicode, no quiero problemas
 	warnings.simplefilter('ignore')
 
-	for i in range(0,len(genia_words)):
-		if i<len(bioscope_tokens):
-			genia_word=genia_words[i][0]
-			treebank_token=bioscope_tokens[i][0]
-			
-			if genia_word != treebank_token:
-				# 0: brackets seem different, by the are just encoded following the PennTreebank annotation guidelines. Skip. 
-				if treebank_token in ('(',')','[',']','{','}'):
-					pass
-				else:
-					# 2: if the genia word mathces the bioscope word plus the following word, join them
-					if i<len(bioscope_tokens)-1 and genia_word==treebank_token+bioscope_tokens[i+1][0]:
-						bioscope_tokens[i]=(bioscope_tokens[i][0]+bioscope_tokens[i+1][0], bioscope_tokens[i][1]) 
-						del(bioscope_tokens[i+1])
-					# Caso 3: ... even three separated words
-					elif i<len(bioscope_tokens)-2 and  genia_word==treebank_token+bioscope_tokens[i+1][0]+bioscope_tokens[i+2][0]:
-						del(bioscope_tokens[i+1])
-						del(bioscope_tokens[i+1])
-					# Caso 4:... even four f**  
-					elif i<len(bioscope_tokens)-3 and genia_word==treebank_token+bioscope_tokens[i+1][0]+bioscope_tokens[i+2][0]+bioscope_tokens[i+3][0]:
-						bioscope_tokens[i]=(bioscope_tokens[i][0]+bioscope_tokens[i+1][0]+bioscope_tokens[i+2][0]+bioscope_tokens[i+3][0], bioscope_tokens[i][1]) 					
-						del(bioscope_tokens[i+1])
-						del(bioscope_tokens[i+1])
-						del(bioscope_tokens[i+1])
+	retokenized=[]
+	merges=merged_tokens=longest_merge=unaligned=0
+	n=len(bioscope_tokens)
+	j=0
+	for genia_analysis in genia_words:
+		if j>=n:
+			break
+		genia_word=genia_analysis[0]
+		treebank_token=bioscope_tokens[j][0]
+		# 0: brackets seem different, by the are just encoded following the PennTreebank annotation guidelines. Skip. 
+		if genia_word==treebank_token or treebank_token in ('(',')','[',']','{','}'):
+			retokenized.append(bioscope_tokens[j])
+			j+=1
+			continue
+		# If the genia word matches the bioscope word plus the following ones, join them
+		# offset is the number of characters of the genia word covered by the tokens from j to k
+		k=j
+		offset=0
+		try:
+			while k<n and genia_word.startswith(bioscope_tokens[k][0],offset):
+				offset+=len(bioscope_tokens[k][0])
+				k+=1
+				if offset==len(genia_word):
+					break
+		except UnicodeDecodeError:
+			# str and unicode words that cannot be compared do not match
+			offset=-1
+		if offset==len(genia_word) and k-j>1:
+			retokenized.append((''.join([token for (token,attributes) in bioscope_tokens[j:k]]),bioscope_tokens[j][1]))
+			merges+=1
+			merged_tokens+=k-j
+			longest_merge=max(longest_merge,k-j)
+			j=k
+		else:
+			retokenized.append(bioscope_tokens[j])
+			unaligned+=1
+			j+=1
+	retokenized.extend(bioscope_tokens[j:])
 	warnings.simplefilter('always')
-	return bioscope_tokens
+
+	if stats is not None:
+		stats['sentences']=stats.get('sentences',0)+1
+		stats['tokens']=stats.get('tokens',0)+n
+		stats['merges']=stats.get('merges',0)+merges
+		stats['merged_tokens']=stats.get('merged_tokens',0)+merged_tokens
+		stats['longest_merge']=max(stats.get('longest_merge',0),longest_merge)
+		stats['unaligned']=stats.get('unaligned',0)+unaligned
+	return retokenized
+
+
+def add_retokenize_stats(stats,more_stats):
+	"""
+	Add the realignment statistics of L{bioscope_retokenize} in more_stats to stats: counts are added, and the longest merge is the longest of both
+	@arg stats: statistics, updated
+	@type stats: C{dict}
+	@arg more_stats: statistics to add
+	@type more_stats: C{dict}
+	@rtype: C{None}
+	"""
+	for (key,value) in more_stats.iteritems():
+		if key=='longest_merge':
+			stats[key]=max(stats.get(key,0),value)
+		else:
+			stats[key]=stats.get(key,0)+value
 	
 
-def gen_conll_file_hc(dbname,tablename,sentence_type,filename,xs,y,predicted_y):
+def gen_conll_file_hc(dbname,tablename,sentence_type,filename,xs,y,predicted_y,batch_size=10000,create_index=False):
 	""" 
 	Given a BIOSCOPE db table, generate the file for training/evaluation using CRF++
 	The file is in CoNLL format (one line for each token, with attributes space separated, and the last one is the target class). Blank lines separate sentences
+	Rows are read in batches, and written in chunks, so the table is never loaded in memory
 	@arg dbname: file for the database file 
 	@type dbname:C{string}
 	@arg tablename: table name
 	@type tablename:C{string}
-	@arg sentence_type: a string for SENTENCE_TYPE. If ALL, use every tuple
+	@arg sentence_type: one of L{SENTENCE_TYPES}. If ALL, use every tuple
 	@type sentence_type: C{string}
 	@arg xs: list of attributes to generate. They must match the table's column name, and do not include the target class
 	@type xs: List
@@ -1156,15 +1908,27 @@ def gen_conll_file_hc(dbname,tablename,sentence_type,filename,xs,y,predicted_y):
 	@type y:List
 	@arg predicted_y: Learned class (for evaluation)
 	@type predicted_y: C{string}
+	@arg batch_size: number of rows read, and written, at a time
+	@type batch_size: C{int}
+	@arg create_index: if True, create (if it does not exist) the index for the row order of the file, so SQLite does not have to sort the table.
+	Note that the index is written to the database, and stays there. Tables built by L{gen_attribute_table} already have it
+	@type create_index: C{bool}
+	@return: (rows, seconds, rows per second)
+	@rtype: C{tuple}
 	"""
 
-	content=''	
-	t0=time.clock()
+	t0=time.time()
 	f=open(filename,'w+')
 	conn= sqlite3.connect(dbname)	
 	conn.text_factory = str
-	conn.row_factory=sqlite3.Row
 	c=conn.cursor()
+
+	if create_index:
+		if sentence_type=='ALL':
+			c.execute('create index if not exists '+tablename+'_conll_idx on '+tablename+' (document_id,sentence_id,token_num)')
+		else:
+			c.execute('create index if not exists '+tablename+'_conll_type_idx on '+tablename+' (sentence_type,document_id,sentence_id,token_num)')
+		conn.commit()
 	
 	# Create the attribute list 
 	cabezal_select=','.join(xs)
@@ -1178,22 +1942,300 @@ def gen_conll_file_hc(dbname,tablename,sentence_type,filename,xs,y,predicted_y):
 		c.execute('select document_id,sentence_id,token_num, '+cabezal_select+' from '+tablename+' where sentence_type=?  order by document_id,sentence_id,token_num', (sentence_type,))	
 	
 	prev_sentence_id='-1'	
-	in_scope=False
-	for row in c:
-		if (prev_sentence_id != row['sentence_id']):
-			# Sentence end, leave a blank space, except for the first sentence
-			if prev_sentence_id != '-1':					
-				content=content+'\n'
-			prev_sentence_id = row['sentence_id']
-		for k in row.keys():
-			value=row[k]		
-			content=content+str(value)+'\t'
-
-		# Delete las tab
-		content=rstrip(content)
-		content=content+'\n'	
-		f.write(content)
-		content=''
+	rows=0
+	while True:
+		batch=c.fetchmany(batch_size)
+		if not batch:
+			break
+		content=[]
+		for row in batch:
+			if (prev_sentence_id != row[1]):
+				# Sentence end, leave a blank space, except for the first sentence
+				if prev_sentence_id != '-1':					
+					line='\n'
+				else:
+					line=''
+				prev_sentence_id = row[1]
+			else:
+				line=''
+
+			# Values are tab separated, without the trailing blanks
+			content.append(rstrip(line+'\t'.join([str(value) for value in row])))
+			content.append('\n')
+		f.write(''.join(content))
+		rows+=len(batch)
 	f.close()
 	c.close()
+	conn.close()
+
+	seconds=time.time()-t0
+	return (rows,seconds,rows/seconds if seconds else 0.0)
 	
+
+def gen_conll_files_hc(dbname,tablename,jobs,batch_size=10000,create_index=False):
+	""" 
+	Generate several CoNLL files from the same BIOSCOPE db table, like L{gen_conll_file_hc}, with a single pass over the table.
+	Each job selects its rows and attributes from the rows read, and all the files are written at the same time
+	@arg dbname: file for the database file 
+	@type dbname:C{string}
+	@arg tablename: table name
+	@type tablename:C{string}
+	@arg jobs: list of (sentence_type, xs, y, filename) or (sentence_type, xs, y, filename, predicted_y) tuples, with the same meaning as the arguments of L{gen_conll_file_hc}
+	@type jobs: C{List}
+	@arg batch_size: number of rows read, and written, at a time
+	@type batch_size: C{int}
+	@arg create_index: if True, create (if it does not exist) the index for the row order of the files, so SQLite does not have to sort the table.
+	Note that the index is written to the database, and stays there. Tables built by L{gen_attribute_table} already have it
+	@type create_index: C{bool}
+	@return: (list with the number of rows written for each job, seconds, rows read per second)
+	@rtype: C{tuple}
+	"""
+
+	t0=time.time()
+	conn= sqlite3.connect(dbname)	
+	conn.text_factory = str
+	c=conn.cursor()
+
+	if create_index:
+		c.execute('create index if not exists '+tablename+'_conll_idx on '+tablename+' (document_id,sentence_id,token_num)')
+		conn.commit()
+
+	# Read every column any job needs, once. Each job keeps the positions of its columns in the rows read
+	columns=['document_id','sentence_id','token_num','sentence_type']
+	job_columns=[]
+	for job in jobs:
+		(sentence_type,xs,y,filename)=job[0:4]
+		predicted_y=len(job)>4 and job[4]
+		names=columns[0:3]+list(xs)+[y]
+		if predicted_y:
+			names.append(predicted_y)
+		positions=[]
+		for name in names:
+			if name not in columns:
+				columns.append(name)
+			positions.append(columns.index(name))
+		job_columns.append(positions)
+
+	files=[open(job[3],'w+') for job in jobs]
+	prev_sentence_ids=['-1' for job in jobs]
+	job_rows=[0 for job in jobs]
+	rows=0
+	try:
+		c.execute('select '+','.join(columns)+' from '+tablename+' order by document_id,sentence_id,token_num')
+		while True:
+			batch=c.fetchmany(batch_size)
+			if not batch:
+				break
+			contents=[[] for job in jobs]
+			for row in batch:
+				values=[str(value) for value in row]
+				for j in range(len(jobs)):
+					if jobs[j][0]!='ALL' and jobs[j][0]!=row[3]:
+						continue
+					if (prev_sentence_ids[j] != row[1]):
+						# Sentence end, leave a blank space, except for the first sentence
+						if prev_sentence_ids[j] != '-1':
+							line='\n'
+						else:
+							line=''
+						prev_sentence_ids[j] = row[1]
+					else:
+						line=''
+					contents[j].append(rstrip(line+'\t'.join([values[k] for k in job_columns[j]])))
+					contents[j].append('\n')
+					job_rows[j]+=1
+			for j in range(len(jobs)):
+				files[j].write(''.join(contents[j]))
+			rows+=len(batch)
+	finally:
+		for f in files:
+			f.close()
+		c.close()
+		conn.close()
+
+	seconds=time.time()-t0
+	return (job_rows,seconds,rows/seconds if seconds else 0.0)
+
+# Columns of the attribute tables (see L{gen_attribute_table}), after document_id, sentence_id, token_num and sentence_type. 
+# They correspond to the attributes of L{BioscopeSentence.get_basic_attributes}
+ATTRIBUTE_TABLE_COLUMNS=('token','lemma','pos','chunk','ne','spec_cue','neg_cue','spec_xcope','neg_xcope')
+# Columns whose values are lists of BIO tags, one for each nesting level
+ATTRIBUTE_TABLE_LIST_COLUMNS=('spec_cue','neg_cue','spec_xcope','neg_xcope')
+
+def gen_attribute_table(dbname,tablename,corpus,batch_size=10000):
+	"""
+	Build a BIOSCOPE db table (the table L{gen_conll_file_hc} reads) from a loaded corpus: one row for each token of the sentences whose information was loaded, 
+	with its document, sentence, position, sentence type (see L{BioscopeSentence.get_sentence_type}), and the attributes of L{BioscopeSentence.get_basic_attributes}.
+	Tag lists are stored comma separated. If the table exists, it is replaced.
+	Rows are inserted in batches, in a single transaction (if the build fails, the previous table is kept), with the database settings for bulk loads, which are restored at the end. 
+	The indexes for the CoNLL files are built after the rows
+	@arg dbname: file for the database file, for example the C{att_database} of the L{BioscopeCorpusProcessor}
+	@type dbname:C{string}
+	@arg tablename: table name
+	@type tablename:C{string}
+	@arg corpus: the loaded corpus. Lazy corpora are read one document at a time
+	@type corpus: L{bioscope.BioscopeCorpus}
+	@arg batch_size: number of rows inserted at a time
+	@type batch_size: C{int}
+	@return: (rows, seconds)
+	@rtype: C{tuple}
+	"""
+
+	def attribute_rows():
+		"""
+		Generate the table rows, document by document
+		"""
+		for (docId,d) in corpus.iter_documents():
+			sentence_types=dict()
+			for (sentenceId,token_num,attributes) in d.iter_basic_attributes():
+				if sentenceId not in sentence_types:
+					sentence_types[sentenceId]=d.sentences[sentenceId].get_sentence_type()
+				yield (docId,sentenceId,token_num,sentence_types[sentenceId])+tuple([','.join(value) if isinstance(value,list) else value for value in attributes])
+
+	t0=time.time()
+	conn=sqlite3.connect(dbname)
+	conn.text_factory = str
+	c=conn.cursor()
+
+	# The database may hold other tables, so its settings are restored when the table is built (journal_mode is kept in the database file)
+	journal_mode=c.execute('pragma journal_mode').fetchone()[0]
+	synchronous=c.execute('pragma synchronous').fetchone()[0]
+	# Bulk load settings: writes do not wait for the disk. If the program crashes, the WAL journal keeps the database consistent, but if the
+	# operating system crashes, or the power fails, while the table is built, the whole database file may be corrupted
+	c.execute('pragma journal_mode=WAL')
+	c.execute('pragma synchronous=OFF')
+	c.execute('pragma temp_store=MEMORY')
+
+	# One explicit transaction, including the drop and create, so if the build fails the previous table is kept
+	conn.isolation_level=None
+	c.execute('begin')
+	try:
+		c.execute('drop table if exists '+tablename)
+		c.execute('create table '+tablename+' (document_id text, sentence_id text, token_num integer, sentence_type text, '+', '.join([column+' text' for column in ATTRIBUTE_TABLE_COLUMNS])+')')
+		insert='insert into '+tablename+' values ('+','.join(['?' for i in range(4+len(ATTRIBUTE_TABLE_COLUMNS))])+')'
+
+		rows=0
+		batch=[]
+		for row in attribute_rows():
+			batch.append(row)
+			if len(batch)>=batch_size:
+				c.executemany(insert,batch)
+				rows+=len(batch)
+				batch=[]
+		c.executemany(insert,batch)
+		rows+=len(batch)
+
+		# Indexes are faster to build once the rows are in. These are the ones gen_conll_file_hc uses
+		c.execute('create index '+tablename+'_conll_idx on '+tablename+' (document_id,sentence_id,token_num)')
+		c.execute('create index '+tablename+'_conll_type_idx on '+tablename+' (sentence_type,document_id,sentence_id,token_num)')
+		c.execute('commit')
+	except Exception:
+		# Keep the original error: if the rollback also fails, it is the one raised
+		error=exc_info()
+		try:
+			c.execute('rollback')
+		except Exception:
+			pass
+		raise error[0],error[1],error[2]
+	finally:
+		c.execute('pragma synchronous=%d' % synchronous)
+		c.execute('pragma journal_mode=%s' % journal_mode)
+		c.close()
+		conn.close()
+
+	return (rows,time.time()-t0)
+
+def export_feature_arrays(corpus,directory):
+	"""
+	Export the token attributes of a loaded corpus (those of L{BioscopeSentence.get_basic_attributes}, for the sentences whose information was loaded) as integer encoded NumPy arrays,
+	for classifier training. The directory gets:
+		- one .npy file for each column of L{ATTRIBUTE_TABLE_COLUMNS}, with the value id of each token of the corpus. The tag list columns (L{ATTRIBUTE_TABLE_LIST_COLUMNS}) 
+		are two dimensional, with one integer column for each nesting level: the id of the tag at that level, or of 'O' if the token's list is shorter than 
+		the corpus's maximum level for the column. Their vocabularies are of single tags
+		- sentence_offsets.npy, with the position of the first token of each sentence, and the total number of tokens at the end
+		- vocabularies.json, with the list of values of each column (the value id is the position in the list), and sentences.json, with the (docId, sentenceId) of each sentence
+	Use L{load_feature_arrays} to load them
+	@arg corpus: the loaded corpus. Lazy corpora are read one document at a time
+	@type corpus: L{bioscope.BioscopeCorpus}
+	@arg directory: output directory. It is created if it does not exist
+	@type directory: C{string}
+	@return: (sentences, tokens)
+	@rtype: C{tuple}
+	"""
+
+	# For each column, the value ids of each level. Other columns have a single level
+	columns=[[array.array('i')] if column not in ATTRIBUTE_TABLE_LIST_COLUMNS else [] for column in ATTRIBUTE_TABLE_COLUMNS]
+	vocabularies=[[] for column in ATTRIBUTE_TABLE_COLUMNS]
+	value_ids=[dict() for column in ATTRIBUTE_TABLE_COLUMNS]
+	sentence_offsets=array.array('l',[0])
+	sentences=[]
+	tokens=0
+
+	def encode(i,value):
+		value_id=value_ids[i].get(value)
+		if value_id is None:
+			value_id=len(vocabularies[i])
+			vocabularies[i].append(value)
+			value_ids[i][value]=value_id
+		return value_id
+
+	for (docId,d) in corpus.iter_documents():
+		for (sentenceId,token_num,attributes) in d.iter_basic_attributes():
+			if token_num==0:
+				# A new sentence starts
+				if sentences:
+					sentence_offsets.append(tokens)
+				sentences.append((docId,sentenceId))
+			for i in range(len(ATTRIBUTE_TABLE_COLUMNS)):
+				value=attributes[i]
+				levels=columns[i]
+				if isinstance(value,list):
+					while len(levels)<len(value):
+						# A deeper level than any before: previous tokens are outside it
+						levels.append(array.array('i',[encode(i,'O')])*tokens)
+					for level in range(len(levels)):
+						levels[level].append(encode(i,value[level] if level<len(value) else 'O'))
+				else:
+					levels[0].append(encode(i,value))
+			tokens+=1
+	if sentences:
+		sentence_offsets.append(tokens)
+
+	if not os.path.isdir(directory):
+		os.makedirs(directory)
+	for i in range(len(ATTRIBUTE_TABLE_COLUMNS)):
+		levels=[numpy.frombuffer(level,dtype=numpy.int32) if level else numpy.zeros(0,dtype=numpy.int32) for level in columns[i]]
+		if ATTRIBUTE_TABLE_COLUMNS[i] in ATTRIBUTE_TABLE_LIST_COLUMNS:
+			values=numpy.column_stack(levels) if levels else numpy.zeros((0,0),dtype=numpy.int32)
+		else:
+			values=levels[0]
+		numpy.save(os.path.join(directory,ATTRIBUTE_TABLE_COLUMNS[i]+'.npy'),values)
+	numpy.save(os.path.join(directory,'sentence_offsets.npy'),numpy.array(sentence_offsets,dtype=numpy.int64))
+	f=open(os.path.join(directory,'vocabularies.json'),'w')
+	json.dump(dict(zip(ATTRIBUTE_TABLE_COLUMNS,vocabularies)),f)
+	f.close()
+	f=open(os.path.join(directory,'sentences.json'),'w')
+	json.dump(sentences,f)
+	f.close()
+	return (len(sentences),tokens)
+
+def load_feature_arrays(directory,mmap_mode='r'):
+	"""
+	Load the arrays written by L{export_feature_arrays}. By default, arrays are memory mapped, so they are not copied into memory
+	@arg directory: directory of the arrays
+	@type directory: C{string}
+	@arg mmap_mode: C{numpy.load} memory map mode. None reads the arrays into memory
+	@type mmap_mode: C{string}
+	@return: (arrays, sentence_offsets, vocabularies, sentences). arrays and vocabularies are dictionaries indexed by column name. 
+	The arrays of the tag list columns have a column for each nesting level (see L{export_feature_arrays})
+	@rtype: C{tuple}
+	"""
+	arrays=dict([(column,numpy.load(os.path.join(directory,column+'.npy'),mmap_mode=mmap_mode)) for column in ATTRIBUTE_TABLE_COLUMNS])
+	sentence_offsets=numpy.load(os.path.join(directory,'sentence_offsets.npy'),mmap_mode=mmap_mode)
+	f=open(os.path.join(directory,'vocabularies.json'),'r')
+	vocabularies=json.load(f)
+	f.close()
+	f=open(os.path.join(directory,'sentences.json'),'r')
+	sentences=[tuple(sentence) for sentence in json.load(f)]
+	f.close()
+	return (arrays,sentence_offsets,vocabularies,sentences)
@@ -2,13 +2,32 @@
 
 import os
 import re
+import threading
+import Queue
+import multiprocessing
 from subprocess import Popen, PIPE
-from pln_inco.util.Tokenizador import *
+from pln_inco.lazy import LazyModule
 
+# El tokenizador se carga recién cuando se usa
+Tokenizador = LazyModule('pln_inco.util.Tokenizador')
 
-# Utilizamos el 'analyzer' de FreeLing
-# La variable de entorno $FREELINGSHARE debe estar seteada
-base_cmd_freeling = ['analyzer', '-f', '%s/config/es.cfg' % os.environ['FREELINGSHARE']]
+
+def comandoBaseFreeling():
+	"""Devuelve el comando para ejecutar el 'analyzer' de FreeLing, que es el que utilizamos.
+
+	La variable de entorno $FREELINGSHARE debe estar seteada; se lee recién al ejecutar
+	FreeLing, por lo que el módulo se puede importar aunque no lo esté."""
+
+	return ['analyzer', '-f', '%s/config/es.cfg' % os.environ['FREELINGSHARE']]
+
+
+# Nombre anterior del comando, que se mantiene para el código que lo usa. Se calcula al importar el
+# módulo si $FREELINGSHARE está seteada; si no, es None (las funciones del módulo usan
+# comandoBaseFreeling(), que la lee al ejecutar FreeLing).
+if 'FREELINGSHARE' in os.environ:
+	base_cmd_freeling = comandoBaseFreeling()
+else:
+	base_cmd_freeling = None
 
 
 def salidaProceso(cmd, entrada):
@@ -22,7 +41,124 @@ def salidaProceso(cmd, entrada):
 	return tokens
 
 
-def obtenerSalidaFreeling(texto, outf, parametros):
+class SesionFreeling:
+	"""Proceso 'analyzer' de FreeLing que se mantiene corriendo entre llamadas.
+
+	FreeLing carga sus diccionarios y modelos una sola vez, al crear la sesión. El analyzer se
+	ejecuta con --flush, por lo que procesa cada línea apenas la recibe. Después de cada texto
+	se envía una línea con una marca; la salida del texto termina donde aparece la marca.
+
+	Una sesión se puede pasar como parámetro sesion de obtenerSalidaFreeling() y
+	obtenerInfoEtiquetadoFreeling(), siempre que se haya creado con el mismo outf y parámetros."""
+
+	MARCA = u'FinDeTextoPlnInco'
+
+	def __init__(self, outf='tagged', parametros=[]):
+		"""Inicia el analyzer con la configuración por defecto para el idioma español.
+		outf y parametros son los mismos de obtenerSalidaFreeling()."""
+
+		self.outf = outf
+		self.parametros = [p for p in parametros if p != '--flush']
+		self.cmd = comandoBaseFreeling() + ['--outf', outf] + self.parametros + ['--flush']
+		self.proceso = Popen(self.cmd, stdin=PIPE, stdout=PIPE)
+		# Una sesión puede compartirse entre hilos, pero procesa un texto a la vez
+		self.lock = threading.Lock()
+
+	def procesar(self, texto):
+		"""Procesa el texto y devuelve una lista con todas las líneas de la salida,
+		igual que salidaProceso().
+
+		El texto se escribe desde otro hilo mientras se lee la salida: si se escribiera todo antes
+		de leer, con un texto grande se llenarían a la vez los pipes de entrada y de salida, y
+		tanto el analyzer como este proceso quedarían bloqueados."""
+
+		self.lock.acquire()
+		try:
+			# Freeling no soporta UTF-8
+			entrada = (texto.rstrip('\n') + u'\n' + self.MARCA + u'\n').encode('iso-8859-1')
+
+			def escribir():
+				try:
+					self.proceso.stdin.write(entrada)
+					self.proceso.stdin.flush()
+				except IOError:
+					# El analyzer terminó; la lectura lo detecta
+					pass
+
+			escritor = threading.Thread(target=escribir)
+			escritor.daemon = True
+			escritor.start()
+
+			lineas = []
+			try:
+				while True:
+					linea = self.proceso.stdout.readline()
+					if linea == '':
+						raise IOError('El proceso de FreeLing terminó inesperadamente')
+					linea = linea.decode('iso-8859-1')
+					if self.MARCA in linea:
+						break
+					# Las líneas vacías iniciales son el fin de la oración de la marca anterior
+					if lineas or linea != u'\n':
+						lineas.append(linea[:-1])
+			finally:
+				escritor.join()
+		finally:
+			self.lock.release()
+
+		# salidaProceso() devuelve además lo que sigue al último fin de línea
+		return lineas + [u'']
+
+	def cerrar(self):
+		"""Termina el proceso analyzer."""
+
+		if self.proceso.poll() is None:
+			self.proceso.stdin.close()
+			self.proceso.wait()
+
+
+class PoolSesionesFreeling:
+	"""Conjunto de SesionFreeling, todas con la misma configuración.
+
+	Cada texto se procesa con la primera sesión libre, por lo que varios hilos pueden
+	usar el pool al mismo tiempo. Se puede pasar en lugar de una sesión."""
+
+	def __init__(self, cantidad, outf='tagged', parametros=[]):
+		"""Inicia cantidad sesiones, con los parámetros de SesionFreeling."""
+
+		self.outf = outf
+		self.parametros = [p for p in parametros if p != '--flush']
+		self.sesiones = [SesionFreeling(outf, parametros) for i in range(cantidad)]
+		self.libres = Queue.Queue()
+		for sesion in self.sesiones:
+			self.libres.put(sesion)
+
+	def procesar(self, texto):
+		"""Procesa el texto con la primera sesión libre (ver SesionFreeling.procesar())."""
+
+		sesion = self.libres.get()
+		try:
+			return sesion.procesar(texto)
+		finally:
+			self.libres.put(sesion)
+
+	def cerrar(self):
+		"""Termina todas las sesiones."""
+
+		for sesion in self.sesiones:
+			sesion.cerrar()
+
+
+def nuevaSesionEtiquetado(cantidad=1):
+	"""Devuelve una sesión (o, si cantidad es mayor que 1, un pool de sesiones) con la configuración
+	que utiliza obtenerInfoEtiquetadoFreeling()."""
+
+	if cantidad > 1:
+		return PoolSesionesFreeling(cantidad, 'tagged', ['--ner', 'basic'])
+	return SesionFreeling('tagged', ['--ner', 'basic'])
+
+
+def obtenerSalidaFreeling(texto, outf, parametros, sesion=None):
 	"""Devuelve una lista con información del texto, obtenida con Freeling.
 	Freeling utilizará el archivo de configuración por defecto para el idioma español.
 
@@ -31,25 +167,33 @@ def obtenerSalidaFreeling(texto, outf, parametros):
 	En parametros pueden ir más parámetros de configuración de Freeling. Por ejemplo,
 	parametros podría ser ['--ner', 'basic', '--noafx'].
 	
+	Si se indica una sesion (SesionFreeling o PoolSesionesFreeling), creada con el mismo outf
+	y parametros, el texto se procesa con ella en lugar de iniciar un nuevo analyzer.
+	
 	La salida se devuelve como texto plano."""
 
-	cmd =  base_cmd_freeling + ['--outf', outf] + parametros
+	if sesion is not None:
+		return [linea[:-1] for linea in sesion.procesar(texto)]
+	cmd =  comandoBaseFreeling() + ['--outf', outf] + parametros
 	return [linea[:-1] for linea in salidaProceso(cmd, texto)]
 
 
-def obtenerInfoEtiquetadoFreeling(texto):
+def obtenerInfoEtiquetadoFreeling(texto, sesion=None):
 	"""Devuelve una lista de las oraciones identificadas por Freeling.
 	
 	Cada oración es una lista de tuplas (token, lema, tag gramatical).
 	Los tokens son los strings tal cuál los genera Freeling, sin marcas de dónde comienzan y
-	terminan en el texto original."""
+	terminan en el texto original.
+
+	Si se indica una sesion (ver nuevaSesionEtiquetado()), se utiliza en lugar de iniciar
+	un nuevo analyzer."""
 
 	# Las opciones '--noafx', '--noloc', '--nonumb', '--nodate', '--noquant' no las utilizamos,
 	# pues la función que determina dónde comienzan y terminan los tokens de Freeling
 	# (obtenerLemasEtiquetasFreeling) funciona de todas formas.
 	#
 	# Las líneas de freeling vienen en formato "token lema tag prob".
-	salida_Freeling = obtenerSalidaFreeling(texto, 'tagged', ['--ner', 'basic', '--flush'])[:-1]
+	salida_Freeling = obtenerSalidaFreeling(texto, 'tagged', ['--ner', 'basic', '--flush'], sesion)[:-1]
 	oraciones = []
 	oracion = []
 	for linea in salida_Freeling:
@@ -75,7 +219,7 @@ def sacarTildes(texto):
 	return texto
 
 
-def obtenerOracionesEtiquetadasFreeling(text_file, encoding):
+def obtenerOracionesEtiquetadasFreeling(text_file, encoding, sesion=None):
 	"""Devuelve una lista de las oraciones identificadas por Freeling.
 	
 	Cada oración es una lista de tuplas (token, lema, tag gramatical).
@@ -87,19 +231,104 @@ def obtenerOracionesEtiquetadasFreeling(text_file, encoding):
 	'tag_freeling').
 
 	En encoding se debe especificar la codificación del archivo de texto, por ejemplo 'iso-8859-1'
-	o 'utf-8'."""
+	o 'utf-8'.
+
+	Si se indica una sesion (ver nuevaSesionEtiquetado()), se utiliza en lugar de iniciar
+	un nuevo analyzer."""
 
 	f = open(text_file, 'rU')
 	texto = f.read().decode(encoding)
 	
-	tokens_mios = obtenerTokens(texto)
-	oraciones_freeling = obtenerInfoEtiquetadoFreeling(texto)
+	tokens_mios = Tokenizador.obtenerTokens(texto)
+	oraciones_freeling = obtenerInfoEtiquetadoFreeling(texto, sesion)
 
 	f.close()
 
+	return alinearTokensFreeling(tokens_mios, oraciones_freeling)
+
+
+# Sesión de FreeLing de cada proceso de etiquetarDocumentosFreeling(), y el error con el que falló
+# su creación
+_sesion_trabajador = None
+_error_trabajador = None
+
+
+def _iniciarTrabajador():
+	"""Inicia la sesión de FreeLing del proceso.
+
+	Si falla no se levanta la excepción: un error en el inicializador termina el proceso y el pool
+	lo vuelve a crear indefinidamente. El error se guarda y se devuelve con cada documento."""
+
+	global _sesion_trabajador, _error_trabajador
+	try:
+		_sesion_trabajador = nuevaSesionEtiquetado()
+	except Exception, e:
+		_error_trabajador = '%s: %s' % (e.__class__.__name__, e)
+
+
+def _etiquetarDocumento(args):
+	"""Etiqueta un documento con la sesión del proceso."""
+
+	(text_file, encoding) = args
+	if _sesion_trabajador is None:
+		raise IOError('No se pudo iniciar FreeLing en el proceso (%s)' % _error_trabajador)
+	return (text_file, obtenerOracionesEtiquetadasFreeling(text_file, encoding, _sesion_trabajador))
+
+
+def etiquetarDocumentosFreeling(archivos, encoding, procesos=None):
+	"""Etiqueta varios documentos con obtenerOracionesEtiquetadasFreeling(), repartiéndolos
+	entre procesos que mantienen cada uno su propia sesión de FreeLing.
+
+	En archivos se indica un directorio (se etiquetan todos sus archivos) o una lista (o cualquier
+	iterable) de archivos. En procesos la cantidad de procesos; por defecto, uno por núcleo.
+
+	Es un generador: devuelve un par (archivo, resultado) por documento, a medida que se
+	terminan de etiquetar, por lo que no necesariamente en el orden de archivos.
+
+	Cada documento se envía entero a la sesión del proceso. SesionFreeling.procesar() lee la
+	salida mientras escribe el texto, por lo que los documentos grandes no bloquean al proceso.
+
+	Antes de crear los procesos se inicia una sesión de prueba, por lo que si $FREELINGSHARE no está
+	seteada o el analyzer no se puede ejecutar el error se levanta enseguida. Si aun así falla la
+	sesión de un proceso, se levanta IOError al etiquetar el primer documento que le toque."""
+
+	if isinstance(archivos, basestring) and os.path.isdir(archivos):
+		archivos = [os.path.join(archivos, nombre) for nombre in sorted(os.listdir(archivos))]
+		archivos = [archivo for archivo in archivos if os.path.isfile(archivo)]
+
+	sesion = nuevaSesionEtiquetado()
+	try:
+		sesion.procesar(u'')
+	finally:
+		sesion.cerrar()
+
+	pool = multiprocessing.Pool(procesos, _iniciarTrabajador)
+	try:
+		for resultado in pool.imap_unordered(_etiquetarDocumento, ((archivo, encoding) for archivo in archivos)):
+			yield resultado
+		pool.close()
+	finally:
+		pool.terminate()
+		pool.join()
+
+
+def alinearTokensFreeling(tokens_mios, oraciones_freeling):
+	"""Alinea los tokens de Freeling con los nuestros (los de obtenerTokens()), y devuelve
+	el resultado de obtenerOracionesEtiquetadasFreeling().
+
+	tokens_mios es la lista de TokenTexto del texto, y oraciones_freeling la salida de
+	obtenerInfoEtiquetadoFreeling() para el mismo texto.
+
+	El recorrido es una sola pasada, en tiempo lineal: nuestros tokens se consumen desde una pila
+	(el próximo token está en el tope), por lo que agregar el resto de una contracción o de un
+	clítico como próximo token no requiere insertar en el medio de una lista."""
+
+	TokenTexto = Tokenizador.TokenTexto
+
 	resultado = []
 	
-	j = 0 # Índice para recorrer tokens_mios
+	# Pila con nuestros tokens, el tope (el último) es el token actual
+	pila_mios = tokens_mios[::-1]
 	
 	# Recorremos todas las oraciones que nos dio Freeling
 	for tokens_freeling in oraciones_freeling:
@@ -114,7 +343,7 @@ def obtenerOracionesEtiquetadasFreeling(text_file, encoding):
 		i = 0
 		while i < len(tokens_freeling):
 			(token_freeling, lema, tag_freeling) = tokens_freeling[i]
-			token_mio = tokens_mios[j]
+			token_mio = pila_mios[-1]
 
 			#
 			# Ej.
@@ -144,8 +373,9 @@ def obtenerOracionesEtiquetadasFreeling(text_file, encoding):
 				# Cuidado especial en casos de locuciones como "con_el_culo_a_el_aire", donde el token_freeling
 				# eventualmente será algo como "a_el_aire".
 				#
-				caso_del = token_mio.texto.lower() == 'del' and token_freeling.lower()[:3] != 'del' and token_freeling.lower()[:2] == 'de'
-				caso_al = token_mio.texto.lower() == 'al' and token_freeling.lower()[:2] != 'al' and token_freeling.lower()[:1] == 'a'
+				texto_mio = token_mio.texto.lower()
+				caso_del = texto_mio == 'del' and token_freeling[:3].lower() != 'del' and token_freeling[:2].lower() == 'de'
+				caso_al = texto_mio == 'al' and token_freeling[:2].lower() != 'al' and token_freeling[:1].lower() == 'a'
 			
 				# Casos de sufijos
 				#       contándoselo -> contando se lo
@@ -182,10 +412,12 @@ def obtenerOracionesEtiquetadasFreeling(text_file, encoding):
 					# Ej.
 					# resto: selo
 					#print 'Inserto resto=%s' % resto
-					tokens_mios.insert(j+1, TokenTexto(resto, token_mio.ini, token_mio.fin))
+					# El resto pasa a ser nuestro próximo token
+					# (si ya no quedan tokens nuestros, no hay próximo token)
+					if pila_mios:
+						pila_mios[-1] = TokenTexto(resto, token_mio.ini, token_mio.fin)
 				
 					token_freeling = ''
-					j += 1
 				
 				else:
 
@@ -197,18 +429,28 @@ def obtenerOracionesEtiquetadasFreeling(text_file, encoding):
 						elif caso_al:
 							token_mio.texto = 'a'
 				
-						tokens_mios.insert(j+1, TokenTexto('el', token_mio.ini, token_mio.fin))
+						# El "el" queda como próximo token, debajo del actual
+						if pila_mios:
+							pila_mios[-1] = TokenTexto('el', token_mio.ini, token_mio.fin)
+							pila_mios.append(token_mio)
 
 					# token_mio debería estar al principio en token_freeling
 					# Lo borramos del token_freeling
+					# (casi siempre está al principio, y alcanza con cortar; si no, borramos la primera ocurrencia)
 			
-					token_freeling_viejo = token_freeling
-					token_freeling = token_freeling.replace(token_mio.texto, '', 1)
+					if token_mio.texto and token_freeling.startswith(token_mio.texto):
+						token_freeling = token_freeling[len(token_mio.texto):]
+						cambio = True
+					else:
+						largo_viejo = len(token_freeling)
+						token_freeling = token_freeling.replace(token_mio.texto, '', 1)
+						cambio = len(token_freeling) != largo_viejo
 					if len(token_freeling) > 0 and token_freeling[0] == '_':
 						token_freeling = token_freeling[1:]
+						cambio = True
 			
 					# Si no hizo nada, caso raro. Probablemente sea porque quedan caracteres raros al final del token de Freeling.
-					if token_freeling_viejo == token_freeling:
+					if not cambio:
 						token_freeling = ''
 
 					# Seteamos el ini (si ya lo habíamos seteado, el valor será distinto a -1)
@@ -220,10 +462,11 @@ def obtenerOracionesEtiquetadasFreeling(text_file, encoding):
 						mi_TokenTexto_freeling.fin = token_mio.fin
 						resultado_oracion.append((mi_TokenTexto_freeling, {'lema_freeling' : lema, 'tag_freeling' : tag_freeling}))
 
-					j += 1
+					if pila_mios:
+						pila_mios.pop()
 					# Agarramos el siguiente si los hay
-					if j < len(tokens_mios):
-						token_mio = tokens_mios[j]
+					if pila_mios:
+						token_mio = pila_mios[-1]
 
 			i += 1
 		
@@ -232,5 +475,6 @@ def obtenerOracionesEtiquetadasFreeling(text_file, encoding):
 	return resultado
 
 
-__all__ = ['obtenerOracionesEtiquetadasFreeling', 'obtenerSalidaFreeling', 'obtenerInfoEtiquetadoFreeling']
+__all__ = ['obtenerOracionesEtiquetadasFreeling', 'obtenerSalidaFreeling', 'obtenerInfoEtiquetadoFreeling',
+	'SesionFreeling', 'PoolSesionesFreeling', 'nuevaSesionEtiquetado', 'etiquetarDocumentosFreeling']
 
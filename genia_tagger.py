@@ -3,6 +3,10 @@ import subprocess
 import shlex
 import codecs
 import os
+import time
+import Queue
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 """
 Module for using the GENIA tagger
 Part of the pln-inco package
@@ -15,11 +19,212 @@ def tag(fileName, geniaHome):
 	@arg geniaHome: GENIA Home. We need it because GENIA only works when the file is in its own directory (!)
 	"""
 
-	# change to the GENIA home
-	present_dir=os.getcwd()
-	os.chdir(geniaHome)
-	p=subprocess.Popen(['./geniatagger',fileName], stdout=subprocess.PIPE)
+	# run the tagger within the GENIA home, without changing our own working directory,
+	# so several files can be tagged at the same time from different threads
+	p=subprocess.Popen(['./geniatagger',fileName], cwd=geniaHome, stdout=subprocess.PIPE)
 	result= p.communicate()[0]
-	# back to the directory we started
-	os.chdir(present_dir)
 	return result
+
+def tag_files(fileNames, geniaHome, workers=None, batch_size=50):
+	"""
+	Process a list of files with the GENIA tagger, using a temporary L{GeniaTaggerPool} of up to C{workers} taggers (see L{GeniaTaggerPool.tag_files}).
+	Results are returned in the same order as the files. For each file, the result is the same text L{tag} would return
+	@arg fileNames: list of files to process. As in L{tag}, relative names are taken from the GENIA home
+	@type fileNames: C{List}
+	@arg geniaHome: GENIA Home
+	@type geniaHome: C{string}
+	@arg workers: number of tagger processes. Defaults to the number of cores, but no more than the number of files
+	@type workers: C{int}
+	@arg batch_size: number of sentences sent to a tagger at once
+	@type batch_size: C{int}
+	@rtype: C{List}
+	"""
+
+	if not workers:
+		workers=multiprocessing.cpu_count()
+	pool=GeniaTaggerPool(geniaHome, max(1, min(workers, len(fileNames))))
+	try:
+		return pool.tag_files(fileNames, batch_size)
+	finally:
+		pool.close()
+
+
+class GeniaTaggerSession:
+	"""
+	A running GENIA tagger process. The tagger loads its models only once, when the session starts. Sentences are then written to its
+	standard input, one per line, and the results are read from its standard output: one line for each token, and a blank line after each sentence.
+	@ivar geniaHome: GENIA Home, used as the working directory for the tagger process
+	@type geniaHome: C{string}
+	@ivar process: the running tagger
+	@type process: C{subprocess.Popen}
+	"""
+
+	def __init__(self, geniaHome):
+		"""
+		Start the tagger process, within the GENIA home
+		@arg geniaHome: GENIA Home. We need it because GENIA only works within its own directory
+		@type geniaHome: C{string}
+		@rtype: C{None}
+		"""
+		self.geniaHome=geniaHome
+		self.process=subprocess.Popen(['./geniatagger'], cwd=geniaHome, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+	def tag_sentence(self, sentence):
+		"""
+		Tag a single sentence, and return the tagger results, just as they appear in its output: one token per line, with word, lemma, POS, chunk and named entity separated by tabs
+		@arg sentence: the sentence text
+		@type sentence: C{string}
+		@rtype: C{string}
+		"""
+		if isinstance(sentence, unicode):
+			sentence=sentence.encode('utf-8')
+		# The tagger reads one sentence for each line
+		sentence=' '.join(sentence.split())
+		if not sentence:
+			return ''
+		self.process.stdin.write(sentence+'\n')
+		self.process.stdin.flush()
+
+		# Read until the blank line that closes the sentence
+		lines=[]
+		while True:
+			line=self.process.stdout.readline()
+			if not line:
+				raise IOError('GENIA tagger process finished unexpectedly')
+			if line.strip()=='':
+				break
+			lines.append(line)
+		return ''.join(lines)
+
+	def close(self):
+		"""
+		Close the tagger input and wait for the process to finish
+		@rtype: C{None}
+		"""
+		if self.process.poll() is None:
+			self.process.stdin.close()
+			self.process.wait()
+
+
+class GeniaTaggerPool:
+	"""
+	A set of warm L{GeniaTaggerSession}s. Sentences are split in batches, and each batch is sent to the first idle session, so
+	tagging a whole corpus uses as many cores as sessions in the pool. The pool also counts sentences, tokens and time,
+	to report throughput for the work done so far (see L{throughput}).
+	@ivar geniaHome: GENIA Home
+	@type geniaHome: C{string}
+	@ivar sessions: tagger sessions in the pool
+	@type sessions: C{List}
+	@ivar sentences: number of sentences tagged
+	@type sentences: C{int}
+	@ivar tokens: number of tokens tagged
+	@type tokens: C{int}
+	@ivar elapsed: time (seconds) spent tagging
+	@type elapsed: C{float}
+	"""
+
+	def __init__(self, geniaHome, workers=None):
+		"""
+		Start the tagger sessions
+		@arg geniaHome: GENIA Home
+		@type geniaHome: C{string}
+		@arg workers: number of tagger processes. Defaults to the number of cores
+		@type workers: C{int}
+		@rtype: C{None}
+		"""
+		if not workers:
+			workers=multiprocessing.cpu_count()
+		self.geniaHome=geniaHome
+		self.sessions=[GeniaTaggerSession(geniaHome) for i in range(workers)]
+		self.idle_sessions=Queue.Queue()
+		for session in self.sessions:
+			self.idle_sessions.put(session)
+		self.sentences=0
+		self.tokens=0
+		self.elapsed=0.0
+
+	def _tag_batch(self, batch):
+		"""
+		Tag a batch of sentences with the first idle session
+		"""
+		session=self.idle_sessions.get()
+		try:
+			return [session.tag_sentence(sentence) for sentence in batch]
+		finally:
+			self.idle_sessions.put(session)
+
+	def tag_sentences(self, sentences, batch_size=50):
+		"""
+		Tag a list of sentences, spreading them across the pool sessions. Results are returned in the same order as the sentences.
+		@arg sentences: list of sentences
+		@type sentences: C{List}
+		@arg batch_size: number of sentences sent to a session at once
+		@type batch_size: C{int}
+		@return: a list with the tagger output for each sentence (see L{GeniaTaggerSession.tag_sentence})
+		@rtype: C{List}
+		"""
+		t0=time.time()
+		batches=[sentences[i:i+batch_size] for i in range(0,len(sentences),batch_size)]
+		threads=ThreadPool(len(self.sessions))
+		try:
+			tagged_batches=threads.map(self._tag_batch, batches)
+		finally:
+			threads.close()
+			threads.join()
+		result=[tagged for batch in tagged_batches for tagged in batch]
+
+		self.elapsed+=time.time()-t0
+		# Blank sentences are not sent to the tagger, and get an empty result
+		self.sentences+=len([tagged for tagged in result if tagged])
+		self.tokens+=sum(tagged.count('\n') for tagged in result)
+		return result
+
+	def tag_files(self, fileNames, batch_size=50):
+		"""
+		Tag a list of files (one sentence per line). For each file, return the same text L{tag} would return: the tagger writes
+		a blank line after each line of the file, so a blank line of the file gives just a blank line
+		@arg fileNames: list of files to process. As in L{tag}, relative names are taken from the GENIA home
+		@type fileNames: C{List}
+		@arg batch_size: number of sentences sent to a session at once
+		@type batch_size: C{int}
+		@rtype: C{List}
+		"""
+		file_sentences=[]
+		for fileName in fileNames:
+			f=open(os.path.join(self.geniaHome,fileName),'r')
+			lines=f.read().split('\n')
+			f.close()
+			# The text after the last end of line is a line only if it is not empty
+			if lines[-1]=='':
+				lines.pop()
+			file_sentences.append(lines)
+
+		tagged=self.tag_sentences([s for sentences in file_sentences for s in sentences], batch_size)
+
+		result=[]
+		i=0
+		for sentences in file_sentences:
+			result.append(''.join([t+'\n' for t in tagged[i:i+len(sentences)]]))
+			i+=len(sentences)
+		return result
+
+	def throughput(self):
+		"""
+		Report the pool throughput for the work done so far
+		@return: a dictionary with the number of sentences, tokens, seconds, sentences per second and tokens per second
+		@rtype: C{Dictionary}
+		"""
+		if self.elapsed > 0:
+			sentences_per_second=self.sentences/self.elapsed
+			tokens_per_second=self.tokens/self.elapsed
+		else:
+			sentences_per_second=tokens_per_second=0.0
+		return {'sentences':self.sentences, 'tokens':self.tokens, 'seconds':self.elapsed, 'sentences_per_second':sentences_per_second, 'tokens_per_second':tokens_per_second}
+
+	def close(self):
+		"""
+		Stop every tagger session in the pool
+		@rtype: C{None}
+		"""
+		for session in self.sessions:
+			session.close()
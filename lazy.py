@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""
+Lazy module loading. Part of the pln-inco package
+Modules of the package use it for their heavy dependencies (nltk, other pln_inco modules), so importing one of them
+does not load, or require, what it only needs for some of its functions.
+"""
+import importlib
+
+
+class LazyModule:
+	"""
+	Stand-in for a module, which is imported the first time one of its attributes is used.
+	For example, after C{nltk=LazyModule('nltk')}, C{nltk.tree.Tree} imports nltk and returns C{nltk.tree.Tree}.
+	"""
+
+	def __init__(self, name):
+		"""
+		@arg name: full name of the module, for example 'nltk' or 'pln_inco.stanford_parser'
+		@type name: C{string}
+		@rtype: C{None}
+		"""
+		self.__dict__['_name']=name
+		self.__dict__['_module']=None
+
+	def __getattr__(self, attribute):
+		"""
+		Import the module (only the first time), and return the attribute. Attributes are also copied to the stand-in,
+		so later uses do not go through this method.
+		"""
+		if self._module is None:
+			self.__dict__['_module']=importlib.import_module(self._name)
+		value=getattr(self._module, attribute)
+		self.__dict__[attribute]=value
+		return value
+
+	def __repr__(self):
+		return '<lazy module %r>' % self._name
@@ -3,6 +3,15 @@ import subprocess
 import shlex
 import codecs
 import tempfile
+import time
+import multiprocessing
+import threading
+import Queue
+import os
+import sqlite3
+import hashlib
+import warnings
+from multiprocessing.pool import ThreadPool
 """
 Module for working with the Stanford Parser. Every function here assumes you have installed the Stanford Parser and set the CLASSPATH to:
 Something like...
@@ -10,21 +19,20 @@ export STANFORD_PARSER=$HOME/bin/stanford-parser-full-2014-01-04
 export CLASSPATH=$STANFORD_PARSER/stanford-parser.jar:$STANFORD_PARSER/stanford-parser-3.3.1-models.jar
 """
 	
-def lexicalized_parser_parse(sentences,model='englishPCFG',output='penn'):
-	""" 
-	Given a list of sentences, it parses them with the Lexicalized Stanford Parser, and return the results.  
-	
-	@arg sentences: List of C{String} containing the sentences  
-	@arg model: model to use. For the moment, the only valid value is 'englishPCFG' 
-	@arg output: type of output for the Stanford Parser. Valid values: penn (default), basicDependencies (coNLL dependencies). When called with the 'basicDependencies' value
-	it also add an outputFormatOptions valued with 'typedDependencies'
+def _parser_command(model='englishPCFG',output='penn',nthreads=1):
 	"""
+	Build the command line for running the Lexicalized Stanford Parser, reading one sentence for each line from its standard input.
 
+	@arg model: model to use. For the moment, the only valid value is 'englishPCFG'
+	@arg output: type of output for the Stanford Parser. Valid values: penn (default), basicDependencies (coNLL dependencies) and wordsAndTags (pos tags, see L{lexicalized_parser_tag})
+	@arg nthreads: number of threads the parser uses for parsing sentences
+	@rtype: C{List}
+	"""
 
-	# Build a text for parsing. Just one sentence for each line
-	text='\n'.join(sentences)
-	
-	command_line='java -mx1000m edu.stanford.nlp.parser.lexparser.LexicalizedParser -sentences newline -tagSeparator / -tokenizerFactory edu.stanford.nlp.process.WhitespaceTokenizer -tokenizerMethod newCoreLabelTokenizerFactory -outputFormat - -outputFormatOptions - modelFile -'
+	if output=='wordsAndTags':
+		command_line='java -mx1000m edu.stanford.nlp.parser.lexparser.LexicalizedParser -sentences newline -escaper edu.stanford.nlp.process.PTBEscapingProcessor -tagSeparator / -outputFormat wordsAndTags modelFile -'
+	else:
+		command_line='java -mx1000m edu.stanford.nlp.parser.lexparser.LexicalizedParser -sentences newline -tagSeparator / -tokenizerFactory edu.stanford.nlp.process.WhitespaceTokenizer -tokenizerMethod newCoreLabelTokenizerFactory -outputFormat - -outputFormatOptions - modelFile -'
 	args=shlex.split(command_line)
 
 	# Incorporate the model file
@@ -44,6 +52,294 @@ def lexicalized_parser_parse(sentences,model='englishPCFG',output='penn'):
 		args[-3]='basicDependencies'
 		args[-5]='typedDependencies'
 
+	# Parse several sentences at the same time within the JVM
+	if nthreads>1:
+		args[3:3]=['-nthreads',str(nthreads)]
+
+	return args
+
+def _read_parse(stream):
+	"""
+	Read the analysis of a sentence from the parser output. The parser writes a blank line after each analysis.
+	@arg stream: parser output
+	@type stream: C{file}
+	@return: the sentence analysis, or None if the parser output has finished
+	@rtype: C{String}
+	"""
+	lines=[]
+	while True:
+		line=stream.readline()
+		if not line:
+			if lines:
+				return ''.join(lines).rstrip('\n')
+			return None
+		if line=='\n':
+			if lines:
+				return ''.join(lines).rstrip('\n')
+		else:
+			lines.append(line)
+
+
+class LexicalizedParserServer:
+	"""
+	A long-running Lexicalized Stanford Parser. The JVM is started, and the model deserialized, only once; then sentences are sent to the
+	parser through a pipe, one for each line, and each analysis is read back as soon as the parser writes it.
+	A server can be shared by several threads: sentences are parsed one at a time.
+	Pass an instance as the C{server} argument of L{lexicalized_parser_parse} or L{lexicalized_parser_tag} to avoid starting a new JVM on each call.
+	@ivar model: model used by the parser
+	@type model: C{string}
+	@ivar output: output format of the parser (see L{lexicalized_parser_parse})
+	@type output: C{string}
+	@ivar process: the running parser
+	@type process: C{subprocess.Popen}
+	@ivar lock: held while a sentence is sent to the parser and its analysis is read
+	@type lock: C{threading.Lock}
+	"""
+
+	def __init__(self,model='englishPCFG',output='penn'):
+		"""
+		Start the parser process
+		@arg model: model to use. For the moment, the only valid value is 'englishPCFG'
+		@arg output: type of output: penn (default), basicDependencies or wordsAndTags
+		@rtype: C{None}
+		"""
+		self.model=model
+		self.output=output
+		self.process=subprocess.Popen(_parser_command(model,output),stdin=subprocess.PIPE,stdout=subprocess.PIPE)
+		self.lock=threading.Lock()
+
+	def is_alive(self):
+		"""
+		Returns True if the parser process is still running
+		@rtype: C{bool}
+		"""
+		return self.process.poll() is None
+
+	def parse_sentence(self,sentence):
+		"""
+		Parse a single sentence and return its analysis
+		@arg sentence: the sentence text
+		@type sentence: C{String}
+		@rtype: C{String}
+		"""
+		# The parser reads one sentence for each line, and skips the empty ones
+		sentence=' '.join(sentence.split())
+		if not sentence:
+			return ''
+		self.lock.acquire()
+		try:
+			self.process.stdin.write(sentence+'\n')
+			self.process.stdin.flush()
+			result=_read_parse(self.process.stdout)
+		finally:
+			self.lock.release()
+		if result is None:
+			raise IOError('Stanford parser process finished unexpectedly')
+		return result
+
+	def parse(self,sentences):
+		"""
+		Parse a list of sentences, and return the list of their analysis
+		@arg sentences: List of C{String} containing the sentences
+		@rtype: C{List}
+		"""
+		return [self.parse_sentence(sentence) for sentence in sentences]
+
+	def close(self):
+		"""
+		Stop the parser process
+		@rtype: C{None}
+		"""
+		if self.is_alive():
+			self.process.stdin.close()
+			self.process.wait()
+
+
+class ParseCache:
+	"""
+	On-disk cache for the parser results, stored in a SQLite file. Each entry is keyed by a hash of the sentence text, the model, the output format and the parser version,
+	so changing any of them never returns a stale analysis. When the stored results exceed C{max_size} bytes, the least recently used entries are evicted.
+	Pass an instance as the C{cache} argument of L{lexicalized_parser_parse} or L{lexicalized_parser_parse_batch}: cached sentences are not sent to the parser,
+	and if every sentence is cached no JVM is started at all.
+	@ivar filename: SQLite file
+	@type filename: C{string}
+	@ivar max_size: maximum size (bytes) of the stored results. None means no limit
+	@type max_size: C{int}
+	@ivar parser_version: parser version, included in every key. Defaults to the CLASSPATH, which includes the parser jar names
+	@type parser_version: C{string}
+	@ivar hits: number of sentences found in the cache
+	@type hits: C{int}
+	@ivar misses: number of sentences not found in the cache
+	@type misses: C{int}
+	"""
+
+	def __init__(self,filename,max_size=None,parser_version=None):
+		"""
+		Open the cache file, creating it if it does not exist
+		@arg filename: SQLite file
+		@type filename: C{string}
+		@arg max_size: maximum size (bytes) of the stored results
+		@type max_size: C{int}
+		@arg parser_version: parser version. Defaults to the CLASSPATH
+		@type parser_version: C{string}
+		@rtype: C{None}
+		"""
+		self.filename=filename
+		self.max_size=max_size
+		if parser_version is None:
+			parser_version=os.environ.get('CLASSPATH','')
+		self.parser_version=parser_version
+		self.hits=0
+		self.misses=0
+
+		self.conn=sqlite3.connect(filename)
+		self.conn.text_factory=str
+		self.conn.execute('create table if not exists parses (key text primary key, result text, size integer, last_used real)')
+		self.conn.execute('create index if not exists parses_last_used on parses (last_used)')
+		self.conn.commit()
+		self.size=self.conn.execute('select coalesce(sum(size),0) from parses').fetchone()[0]
+
+	def _key(self,sentence,model,output):
+		"""
+		Hash for a sentence analysis
+		"""
+		if isinstance(sentence,unicode):
+			sentence=sentence.encode('utf-8')
+		return hashlib.sha1('\0'.join([sentence,model,output,self.parser_version])).hexdigest()
+
+	def parse(self,sentences,model,output,parse_function):
+		"""
+		Return the analysis of the sentences, taking them from the cache when possible. The sentences that are not in the cache are
+		parsed with C{parse_function}, and their results are stored. Empty (or blank) sentences get an empty analysis, without calling the parser,
+		which skips them
+		@arg sentences: List of C{String} containing the sentences
+		@arg model: parser model
+		@arg output: parser output format
+		@arg parse_function: function that receives the list of missing sentences and returns the list of their analysis
+		@rtype: C{List}
+		"""
+		now=time.time()
+		keys=[self._key(sentence,model,output) for sentence in sentences]
+		results=[None]*len(sentences)
+		missing=[]
+		hits=[]
+		for (i,key) in enumerate(keys):
+			if not sentences[i].strip():
+				results[i]=''
+				continue
+			row=self.conn.execute('select result from parses where key=?',(key,)).fetchone()
+			if row is None:
+				missing.append(i)
+			else:
+				results[i]=row[0]
+				hits.append(key)
+		self.hits+=len(hits)
+		self.misses+=len(missing)
+
+		# Mark the hits as recently used
+		self.conn.executemany('update parses set last_used=? where key=?',[(now,key) for key in hits])
+		# Do not keep the database locked while parsing, so other processes can use the cache meanwhile
+		self.conn.commit()
+
+		if missing:
+			# Repeated sentences are parsed only once
+			first_missing=dict()
+			for i in missing:
+				first_missing.setdefault(keys[i],i)
+			to_parse=sorted(first_missing.values())
+			parse_results=parse_function([sentences[i] for i in to_parse])
+			if len(parse_results)!=len(to_parse):
+				raise ValueError('The parser returned %d analysis for %d sentences' % (len(parse_results),len(to_parse)))
+			parsed=dict(zip([keys[i] for i in to_parse],parse_results))
+			for i in missing:
+				results[i]=parsed[keys[i]]
+			for (key,result) in parsed.iteritems():
+				# Another process using the same file may have stored the sentence meanwhile
+				row=self.conn.execute('select size from parses where key=?',(key,)).fetchone()
+				if row is not None:
+					self.size-=row[0]
+				self.conn.execute('insert or replace into parses values (?,?,?,?)',(key,result,len(result),now))
+				self.size+=len(result)
+		self.conn.commit()
+		self._evict()
+		return results
+
+	def _evict(self):
+		"""
+		Delete the least recently used entries, until the stored results fit in C{max_size}
+		"""
+		if self.max_size is None:
+			return
+		while self.size>self.max_size:
+			rows=self.conn.execute('select key,size from parses order by last_used limit 100').fetchall()
+			if not rows:
+				break
+			for (key,size) in rows:
+				if self.size<=self.max_size:
+					break
+				self.conn.execute('delete from parses where key=?',(key,))
+				self.size-=size
+		self.conn.commit()
+
+	def stats(self):
+		"""
+		Cache statistics
+		@return: a dictionary with the number of hits, misses, entries and stored bytes
+		@rtype: C{Dictionary}
+		"""
+		entries=self.conn.execute('select count(*) from parses').fetchone()[0]
+		return {'hits':self.hits,'misses':self.misses,'entries':entries,'size':self.size}
+
+	def close(self):
+		"""
+		Close the cache file
+		@rtype: C{None}
+		"""
+		self.conn.close()
+
+
+def _server_parse(server,sentences,model,output):
+	"""
+	Parse the sentences with a running server. Raises C{ValueError} if it was started with another model or output format.
+	Returns None when there is no server, or it is not running, so the caller falls back to the one-shot mode (with a warning, as it starts a new JVM)
+	"""
+	if server is None:
+		return None
+	if server.model!=model or server.output!=output:
+		raise ValueError('The parser server was started with model %s and output %s, not %s and %s' % (server.model,server.output,model,output))
+	if server.is_alive():
+		try:
+			return server.parse(sentences)
+		except IOError:
+			pass
+	warnings.warn('The Stanford parser server is not running, starting a new parser process')
+	return None
+
+def lexicalized_parser_parse(sentences,model='englishPCFG',output='penn',server=None,nthreads=1,cache=None):
+	""" 
+	Given a list of sentences, it parses them with the Lexicalized Stanford Parser, and return the results.  
+	
+	@arg sentences: List of C{String} containing the sentences  
+	@arg model: model to use. For the moment, the only valid value is 'englishPCFG' 
+	@arg output: type of output for the Stanford Parser. Valid values: penn (default), basicDependencies (coNLL dependencies). When called with the 'basicDependencies' value
+	it also add an outputFormatOptions valued with 'typedDependencies'
+	@arg server: an optional L{LexicalizedParserServer}, started with the same model and output (otherwise, C{ValueError} is raised). If it is given, sentences 
+	are sent to it instead of starting a new parser. If it is not alive, the function warns, and falls back to running a new parser process
+	@arg nthreads: number of threads for the new parser process (the parser's -nthreads option)
+	@arg cache: an optional L{ParseCache}. Only the sentences that are not in the cache are parsed
+	"""
+
+	if cache is not None:
+		return cache.parse(sentences,model,output,lambda missing: lexicalized_parser_parse(missing,model,output,server,nthreads))
+
+	result=_server_parse(server,sentences,model,output)
+	if result is not None:
+		return result
+
+	# Build a text for parsing. Just one sentence for each line
+	text='\n'.join(sentences)
+	
+	args=_parser_command(model,output,nthreads)
 
 	# Create a process and read its output
 	p=subprocess.Popen(args,stdin=subprocess.PIPE,stdout=subprocess.PIPE)
@@ -52,46 +348,178 @@ def lexicalized_parser_parse(sentences,model='englishPCFG',output='penn'):
 	# Return a list of analyzed sentences, with the specified format
 	return result.split('\n\n')[:-1]
 	
-def lexicalized_parser_tag(sentences,model='englishPCFG'):
+def lexicalized_parser_iter_parse(sentences,model='englishPCFG',output='penn',nthreads=1,max_pending=100):
+	"""
+	Parse a stream of sentences with the Lexicalized Stanford Parser, and yield each analysis as soon as the parser writes it.
+	Sentences are taken from any iterable (a file, a generator...) and fed to the parser by a separate thread, which never gets
+	more than C{max_pending} sentences ahead of the results, so memory does not grow with the input size.
+
+	@arg sentences: iterable of C{String} containing the sentences
+	@arg model: model to use. For the moment, the only valid value is 'englishPCFG'
+	@arg output: type of output for the Stanford Parser (see L{lexicalized_parser_parse})
+	@arg nthreads: number of threads for the parser process
+	@arg max_pending: maximum number of sentences sent to the parser and not yet yielded
+	@type max_pending: C{int}
+	@return: a generator of analysis, one for each sentence, in order. Empty sentences get an empty analysis
+	@rtype: C{generator}
+
+	If the generator is closed before the end (or garbage collected), the parser process is killed and the feeder thread stops
+	after the sentence it is reading.
+	"""
+
+	p=subprocess.Popen(_parser_command(model,output,nthreads),stdin=subprocess.PIPE,stdout=subprocess.PIPE)
+
+	# For each sentence, the feeder puts True in the queue if it was sent to the parser, and False if it was empty (the parser skips empty lines)
+	# The queue is bounded, so the feeder blocks when the parser is too far ahead of us
+	pending=Queue.Queue(max_pending)
+	finished=object()
+	errors=[]
+	# Set when the consumer stops, so the feeder does not block forever on a full queue
+	stop=threading.Event()
+
+	def put(item):
+		# Returns False if the consumer stopped before the item could be queued
+		while not stop.is_set():
+			try:
+				pending.put(item,timeout=0.1)
+				return True
+			except Queue.Full:
+				pass
+		return False
+
+	def feed():
+		try:
+			try:
+				for sentence in sentences:
+					sentence=' '.join(sentence.split())
+					if sentence:
+						if not put(True):
+							break
+						p.stdin.write(sentence+'\n')
+						p.stdin.flush()
+					elif not put(False):
+						break
+			except Exception, e:
+				errors.append(e)
+		finally:
+			try:
+				p.stdin.close()
+			except IOError:
+				pass
+			put(finished)
+
+	feeder=threading.Thread(target=feed)
+	feeder.daemon=True
+	feeder.start()
+
+	try:
+		while True:
+			sent=pending.get()
+			if sent is finished:
+				break
+			elif not sent:
+				yield ''
+			else:
+				result=_read_parse(p.stdout)
+				if result is None:
+					raise IOError('Stanford parser process finished unexpectedly')
+				yield result
+		if errors:
+			raise errors[0]
+		p.wait()
+	finally:
+		stop.set()
+		if p.poll() is None:
+			p.kill()
+		feeder.join()
+
+def lexicalized_parser_tag(sentences,model='englishPCFG',server=None):
 	""" 
 	Given a list of sentences, parse them with the Lexicalized Stanford Parser, and return their pos_tags.
 	I guess I should better use the Stanford Tagger for performance decisions, but this is pretty direct
 	
 	@arg sentences: List of C{String} containing the sentences  
 	@arg model: model to use. For the moment, the only valid value is 'englishPCFG' 
+	@arg server: an optional L{LexicalizedParserServer}, started with the same model and the 'wordsAndTags' output (see L{lexicalized_parser_parse})
 	"""
 
+	result=_server_parse(server,sentences,model,'wordsAndTags')
+	if result is not None:
+		return result
+
 	# Build a text for parsing. Just one sentence for each line
 	text='\n'.join(sentences)
 	
+	args=_parser_command(model,'wordsAndTags')
 
-	command_line='java -mx1000m edu.stanford.nlp.parser.lexparser.LexicalizedParser -sentences newline -escaper edu.stanford.nlp.process.PTBEscapingProcessor -tagSeparator / -outputFormat wordsAndTags modelFile -'
-	args=shlex.split(command_line)
-
-	# Create a temporary file for storing the text. Pass it to the command line as an argument
-	# Last argument
-	#source=tempfile.NamedTemporaryFile(delete=False)
-	#source.write(text)
-	#source.close()
-	#args[-1]=source.name
-
-	# Incorporate the model file
-	if model=='englishPCFG':
-		model_file='edu/stanford/nlp/models/lexparser/englishPCFG.ser.gz'
-	args[-2]=model_file
-
-	# Create a temporary file for the results	
-	#target=tempfile.NamedTemporaryFile(delete=False)
-	#target_name=target.name
 	p=subprocess.Popen(args,stdin=subprocess.PIPE,stdout=subprocess.PIPE)
 	(result,stderrdata)=p.communicate(input=text)
-	#target.close()
-	#target=open(target_name,'r')
-	#result=target.read()
-	#target.close()
 
 	return result.split('\n\n')[:-1]
 
+def lexicalized_parser_parse_batch(sentences,model='englishPCFG',output='penn',workers=None,nthreads=1,shard_size=None,cache=None):
+	"""
+	Parse a (large) list of sentences in parallel. The list is split into shards, and each shard is parsed by its own parser process
+	(see L{lexicalized_parser_parse}), running up to C{workers} processes at the same time. Each process may also use several threads.
+	Results are returned in the same order as the sentences, and empty (or blank) sentences get an empty analysis. If a parser process returns
+	a different number of analysis than the sentences it got, C{ValueError} is raised.
+
+	@arg sentences: List of C{String} containing the sentences
+	@arg model: model to use. For the moment, the only valid value is 'englishPCFG'
+	@arg output: type of output for the Stanford Parser (see L{lexicalized_parser_parse})
+	@arg workers: number of parser processes running at the same time. Defaults to the number of cores divided by C{nthreads}
+	@type workers: C{int}
+	@arg nthreads: number of threads for each parser process
+	@type nthreads: C{int}
+	@arg shard_size: number of sentences in each shard. Defaults to an even split of the sentences among the workers
+	@type shard_size: C{int}
+	@arg cache: an optional L{ParseCache}. Only the sentences that are not in the cache are split into shards and parsed
+	@return: a pair (results, timings). C{timings} has a dictionary for each shard, with its number, its number of sentences and the seconds it took to parse it
+	@rtype: C{tuple}
+	"""
+
+	if cache is not None:
+		timings=[]
+		def parse_missing(missing):
+			(result,shard_timings)=lexicalized_parser_parse_batch(missing,model,output,workers,nthreads,shard_size)
+			timings.extend(shard_timings)
+			return result
+		return (cache.parse(sentences,model,output,parse_missing),timings)
+
+	if not workers:
+		workers=max(1,multiprocessing.cpu_count()/nthreads)
+	if not shard_size:
+		shard_size=max(1,(len(sentences)+workers-1)/workers)
+	shards=[sentences[i:i+shard_size] for i in range(0,len(sentences),shard_size)]
+
+	def parse_shard(shard_number):
+		t0=time.time()
+		shard=shards[shard_number]
+		# The parser skips empty lines, so blank sentences are not sent, and get an empty analysis
+		to_parse=[sentence for sentence in shard if sentence.strip()]
+		parsed=lexicalized_parser_parse(to_parse,model,output,nthreads=nthreads)
+		# If the parser loses or merges a sentence, every later analysis would belong to another sentence
+		if len(parsed)!=len(to_parse):
+			raise ValueError('The parser returned %d analysis for the %d sentences of shard %d' % (len(parsed),len(to_parse),shard_number))
+		parsed=iter(parsed)
+		result=[parsed.next() if sentence.strip() else '' for sentence in shard]
+		return (result,{'shard':shard_number,'sentences':len(shard),'seconds':time.time()-t0})
+
+	# The work is done by the parser processes, so threads are enough for waiting on them
+	threads=ThreadPool(workers)
+	try:
+		parsed_shards=threads.map(parse_shard,range(len(shards)))
+	finally:
+		threads.close()
+		threads.join()
+
+	results=[]
+	timings=[]
+	for (result,timing) in parsed_shards:
+		results+=result
+		timings.append(timing)
+	return (results,timings)
+
 if __name__ == '__main__':
 	parsed=lexicalized_parser_parse(['This is a demo text!','And this is another sentence', 'This an utf-8 encoded: cámara'],output='penn')
 	for p in parsed:
@@ -1,7 +1,10 @@
 """
 Module for working with  NLTK syntax trees...
 """
-import nltk.tree
+from pln_inco.lazy import LazyModule
+
+# nltk is loaded the first time it is used
+nltk=LazyModule('nltk')
 
 
 def tree_to_dot(t):
@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""
+Regression tests. Part of the pln-inco package
+They compare the optimized functions with the versions they replaced (see L{pln_inco.tests.reference}), on fixed and random, but seeded, inputs.
+Run them from the directory that contains the package with::
+	python -m unittest discover -s pln_inco/tests -t .
+"""
@@ -0,0 +1,575 @@
+# -*- coding: utf-8 -*- 
+"""
+Reference implementations for the regression tests: the versions of the functions before they were optimized, copied without changes.
+Methods are turned into functions, which get the sentence (or tree) the method looked up. The tests check the current versions give the same results
+"""
+import time
+import sqlite3
+import nltk
+import nltk.tokenize
+from string import strip, rstrip
+from pln_inco.freeling import sacarTildes
+
+
+def alinear_tokens_freeling(tokens_mios, oraciones_freeling, TokenTexto):
+	"""
+	Alignment loop of obtenerOracionesEtiquetadasFreeling(), before L{pln_inco.freeling.alinearTokensFreeling}. tokens_mios is modified
+	"""
+
+	resultado = []
+	
+	j = 0 # Índice para recorrer tokens_mios
+	
+	# Recorremos todas las oraciones que nos dio Freeling
+	for tokens_freeling in oraciones_freeling:
+	
+		resultado_oracion = []
+
+		# Vamos recorriendo todos los tokens de Freeling de la oración.
+		# Asignamos el token de Freeling a una variable temporal token_freeling, y vamos
+		# "reconociendo" tokens nuestros dentro de éste.
+		# Si token_freeling queda vacío, entonces quiere decir que todos los tokens nuestros
+		# que están dentro del token freeling fueron reconocidos y agregados a mis_tags.
+		i = 0
+		while i < len(tokens_freeling):
+			(token_freeling, lema, tag_freeling) = tokens_freeling[i]
+			token_mio = tokens_mios[j]
+
+			#
+			# Ej.
+			# Token freeling = "A_pesar_de_todo"
+			# Tokens mios = "A", "pesar", "de", "todo"
+			#
+			# Ej.
+			# Tokens freeling = "de", "el"
+			# Token mio = "del"
+			#
+			# Ej.
+			# Tokens freeling = "con_el_culo_a_el_aire"
+			# Tokens mios = "con", "el", "culo", "al", "aire".
+			# (sí, no se me ocurre otra por el momento :P)
+			#
+		
+			mi_TokenTexto_freeling = TokenTexto(token_freeling)
+
+			while len(token_freeling) > 0:
+		
+				#print '-> %s %s' % (token_mio.texto, token_freeling)
+			
+				# Casos especiales
+				#        del -> de el
+				#        al -> a el
+				#
+				# Cuidado especial en casos de locuciones como "con_el_culo_a_el_aire", donde el token_freeling
+				# eventualmente será algo como "a_el_aire".
+				#
+				caso_del = token_mio.texto.lower() == 'del' and token_freeling.lower()[:3] != 'del' and token_freeling.lower()[:2] == 'de'
+				caso_al = token_mio.texto.lower() == 'al' and token_freeling.lower()[:2] != 'al' and token_freeling.lower()[:1] == 'a'
+			
+				# Casos de sufijos
+				#       contándoselo -> contando se lo
+				#       vámonos -> vamos nos
+				if len(token_freeling) < len(token_mio.texto) and not (caso_del or caso_al):
+					#print '-> %s %s' % (token_mio.texto, token_freeling)
+			
+					# Ej.
+					# token_freeling: contando
+					# token_mio: contándoselo
+					mio_sin_tildes = sacarTildes(token_mio.texto)
+				
+					# Ej.
+					# token_freeling: contando
+					# mio_sin_tildes: contandoselo
+				
+					mi_TokenTexto_freeling.ini = token_mio.ini
+					mi_TokenTexto_freeling.fin = token_mio.fin
+					resultado_oracion.append((mi_TokenTexto_freeling, {'lema_freeling' : lema, 'tag_freeling' : tag_freeling}))
+				
+					resto = mio_sin_tildes.replace(token_freeling, '', 1)
+					if resto == mio_sin_tildes:
+						# Por un caso particular "vámonos" que Freeling separa en "vamos", "nos".
+						# Falla al reemplazar.
+						#
+						# Consideramos el caso cuando la palabra original termina en s
+						if token_freeling[-1].lower() == 's':
+							token_freeling = token_freeling[:-1]
+						resto = mio_sin_tildes.replace(token_freeling, '', 1)
+					
+						if resto == mio_sin_tildes:
+							print u'Problema reemplazando "%s" en "%s", quizá explote al devolver los tokens de Freeling.' % (token_freeling, mio_sin_tildes)
+
+					# Ej.
+					# resto: selo
+					#print 'Inserto resto=%s' % resto
+					tokens_mios.insert(j+1, TokenTexto(resto, token_mio.ini, token_mio.fin))
+				
+					token_freeling = ''
+					j += 1
+				
+				else:
+
+					if caso_del or caso_al:
+				
+						# Cambiamos nuestros token "del" o "al" por "de" y "a", y agregamos el "el" que falta
+						if caso_del:
+							token_mio.texto = 'de'
+						elif caso_al:
+							token_mio.texto = 'a'
+				
+						tokens_mios.insert(j+1, TokenTexto('el', token_mio.ini, token_mio.fin))
+
+					# token_mio debería estar al principio en token_freeling
+					# Lo borramos del token_freeling
+			
+					token_freeling_viejo = token_freeling
+					token_freeling = token_freeling.replace(token_mio.texto, '', 1)
+					if len(token_freeling) > 0 and token_freeling[0] == '_':
+						token_freeling = token_freeling[1:]
+			
+					# Si no hizo nada, caso raro. Probablemente sea porque quedan caracteres raros al final del token de Freeling.
+					if token_freeling_viejo == token_freeling:
+						token_freeling = ''
+
+					# Seteamos el ini (si ya lo habíamos seteado, el valor será distinto a -1)
+					if mi_TokenTexto_freeling.ini == -1:
+						mi_TokenTexto_freeling.ini = token_mio.ini
+					# Seteamos el fin (si token_freeling quedó vacío, y por lo tanto terminamos de reconocer)
+					# y agregamos a la lista...
+					if token_freeling == '':
+						mi_TokenTexto_freeling.fin = token_mio.fin
+						resultado_oracion.append((mi_TokenTexto_freeling, {'lema_freeling' : lema, 'tag_freeling' : tag_freeling}))
+
+					j += 1
+					# Agarramos el siguiente si los hay
+					if j < len(tokens_mios):
+						token_mio = tokens_mios[j]
+
+			i += 1
+		
+		resultado.append(resultado_oracion)
+
+	return resultado
+
+
+def get_basic_attributes(data):
+	"""
+	L{pln_inco.bioscope.BioscopeSentence.get_basic_attributes}, for the sentence tree data
+	"""
+
+
+	def get_tree_leaves(t):
+		"""
+		Given a tree, returns a list with its elements and tags, inorder.
+		"""
+		
+		res=[]
+		for child in t: 
+			if isinstance(child, unicode):
+				#s=t.node
+				s=t.label()
+				res=[(child,s['lemma'],s['pos'],s['chunk'],strip(s['entity']),s['specCue'],s['negCue'],s['specXcope'],s['negXcope'])]
+			else:
+				res += get_tree_leaves(child)
+		return res
+			
+	
+	s_table=[('TOKEN','LEMMA','POS','CHUNK','NE','SPEC-CUE','NEG-CUE','SPEC-XCOPE','NEG-XCOPE')]
+	s_table += get_tree_leaves(data)
+	return s_table
+
+
+def get_max_nesting_level(sentence,scope_type):
+	"""
+	Given a sentence returns the maximum nesting level for hedging/negation
+	@arg sentence: xml element of the sentence
+	@arg scope_type: One of 'negation' or 'hedging'
+	@type scope_type: C{String}
+	@rtype: Int
+	"""
+	
+
+	def includes_hedging_or_negation(element,xcope_id,scope_type):
+		if element.tag=='cue' and element.get('type')==scope_type and element.get('ref')==xcope_id:
+			return True
+		else:
+			for ch in element.getchildren():
+				if includes_hedging_or_negation(ch,xcope_id,scope_type):
+					return True
+			return False
+
+
+	def get_bioscope_element_hedge_or_negation_levels(element,scope_type):
+		if element.tag=='xcope' and includes_hedging_or_negation(element,element.get('id'),scope_type):
+			nested_levels=1
+		else:
+			nested_levels=0
+
+		# Sum children hedge nesting level
+		child_max_nested_levels=0
+		for ch in element.getchildren():
+				if get_bioscope_element_hedge_or_negation_levels(ch,scope_type) > child_max_nested_levels:
+					child_max_nested_levels=get_bioscope_element_hedge_or_negation_levels(ch,scope_type)
+		return child_max_nested_levels+nested_levels
+				
+	hedge_levels= get_bioscope_element_hedge_or_negation_levels(sentence,scope_type)
+
+	return hedge_levels
+
+
+def get_bioscope_tokens(sentence):
+	"""
+	Given a sentence, tokenize it, using C{nltk.tokenize.TreebankWordTokenizer}). Returns a list of pairs property:value for each token
+	@arg sentence: xml element of the sentence
+	@rtype: C{List}
+	"""
+
+	# Get the max nesting levels for the sentence 
+	max_hedge_levels=get_max_nesting_level(sentence,scope_type='speculation')
+	hedge_scopes = ['O' for i in range(max_hedge_levels)]
+	max_negation_levels=get_max_nesting_level(sentence,scope_type='negation')
+	negation_scopes = ['O' for i in range(max_negation_levels)]
+	
+	
+	def includes_hedging_or_negation(element,xcope_id,scope_type):
+		if element.tag=='cue' and element.get('type')==scope_type and element.get('ref')==xcope_id:
+			return True
+		else:
+			for ch in element.getchildren():
+				if includes_hedging_or_negation(ch,xcope_id,scope_type):
+					return True
+
+			return False
+	
+	
+	def get_bioscope_element_spec_tags(element,hedge_cue_num,negation_cue_num,hedge_scopes,negation_scopes):
+		
+		""" 
+		Given an element of the xml tree (C{xml.etree.ElementTree}), returns the Bioscope marks. If the node corresponds to a text, it tokenizes it.
+		Adicionalmente, si es un texto, lo tokeniza.
+		@type element: C{xml.etree.ElementTree}
+
+		"""
+	
+		# Tokenize using the Penn Treebank tokenizer... 
+		wt=nltk.tokenize.TreebankWordTokenizer()
+
+		# Find each token's attributes
+		hedge_cues=['O' for i in range(max_hedge_levels)]
+		negation_cues=['O' for i in range(max_negation_levels)]
+		if element.tag=='sentence':
+			# At the begining of the sentence, the speculation mark is False, the negation mark is empty, and the scope list is also empty
+			# La lista de scopes está vacía
+			hedge_scopes=['O' for i in hedge_scopes]
+			negation_scopes=['O' for i in negation_scopes]
+			hedge_cues=['O' for i in hedge_cues]
+			negation_cues=['O' for i in negation_cues]
+		elif element.tag=='cue' and element.get('type')=='negation':
+			# Found a negation cue
+			pass
+		elif element.tag=='cue' and element.get('type')=='speculation':
+			# Starts a speculation block
+			# Elements within this scope are marked as speculative
+			pass
+		elif element.tag=='xcope':
+			# If i am in a speculation/negation scope, I still do not have a hedge cue
+			
+			# If it is a hedge scope, increase de nesting levelSi es un hedge de scope, entonces aumento un nivel de anidamiento
+			if includes_hedging_or_negation(element,element.get('id'),scope_type='speculation'):
+				hedge_cue_num=hedge_cue_num+1
+				# New hedging level
+				j=0
+				for i in hedge_scopes:
+					if i!='O':
+						j=j+1
+					else:
+						# Substitute the first 'O' with a 'B'
+						hedge_scopes[j]='B'
+						break
+				
+			if includes_hedging_or_negation(element,element.get('id'),scope_type='negation'):
+				negation_cue_num=negation_cue_num+1				
+				# New negation level 
+				j=0
+				for i in negation_scopes:
+					if i!='O':
+						j=j+1
+					else:
+						negation_scopes[j]='B'
+						break
+
+		
+		# If the text contains text, tokenize it and add the corresponding tags
+		if element.text:
+			element_text=wt.tokenize(element.text)
+		else:
+			element_text=[]
+			
+		element_tagged_text=[]
+		
+		first_token=True
+		for elem in element_text:
+			
+			# Load the speculation mark values
+			
+			if hedge_cue_num>0 and element.get('type')=='speculation':
+				if first_token:
+					hedge_cues[hedge_cue_num-1]='B-SPECCUE'
+					first_token=False
+				else:
+					hedge_cues[hedge_cue_num-1]='I-SPECCUE'
+			else:
+				hedge_cues=['O' for i in hedge_cues]
+				
+			# Load negation mark values
+			if negation_cue_num>0  and element.get('type')=='negation':
+				if first_token:
+					negation_cues[negation_cue_num-1]='B-NEGCUE'
+					first_token=False
+				else:
+					negation_cues[negation_cue_num-1]='I-NEGCUE'
+			else:
+				negation_cues=['O' for i in negation_cues]
+				
+			# Load scope marks 
+			j=0
+			hedge_scope_marks=[]
+			for i in hedge_scopes:
+				if i=='B':
+					hedge_scope_marks.append('B-SPECXCOPE')
+					hedge_scopes[j]='I'
+				elif i=='I':
+					hedge_scope_marks.append('I-SPECXCOPE')						
+				else:
+					hedge_scope_marks.append('O')	
+				j=j+1
+
+
+			# Load negation scope marks 
+			j=0
+			negation_scope_marks=[]
+			for i in negation_scopes:
+				if i=='B':
+					negation_scope_marks.append('B-NEGXCOPE')
+					negation_scopes[j]='I'
+				elif i=='I':
+					negation_scope_marks.append('I-NEGXCOPE')						
+				else:
+					negation_scope_marks.append('O')	
+				j=j+1
+				
+		
+			if not hedge_scope_marks:
+				hedge_scope_marks=['O']
+
+			if not negation_scope_marks:
+				negation_scope_marks=['O']
+
+			if not hedge_cues:
+				hedge_cues=['O']
+			
+			if not negation_cues:
+				negation_cues=['O']
+				
+				
+			#print >> stderr, 'Anoto el texto ',elem, ' con el tag ',hedge_cues
+			# Add the element to the tagged text
+			element_tagged_text.append((elem,{'SpecCue':[h for h in hedge_cues],'NegCue':[h for h in negation_cues],'specXcope':hedge_scope_marks,'negXcope':negation_scope_marks}))
+				
+						
+		
+		# Process childen 
+		j=0
+		for ch in element.getchildren():
+			element_tagged_text += get_bioscope_element_spec_tags(ch,hedge_cue_num,negation_cue_num,hedge_scopes,negation_scopes)
+		
+		# Process the text to the right of the tag
+		if element.tail:
+			element_tail=wt.tokenize(element.tail)
+		else:
+			element_tail=[]
+
+		element_tagged_tail=[]
+		
+		
+		# What appears to the right is never a speculation/negation mark
+		hedge_cues=['O' for i in hedge_cues]
+		negation_cues=['O' for i in negation_cues]
+		
+		# If the speculation scope ends, drop the las nesting level
+		if includes_hedging_or_negation(element,element.get('id'),scope_type='speculation') and element.tag=='xcope':
+			j=0
+			for i in hedge_scopes:
+				if i !='O':
+					j=j+1
+				else:
+					hedge_scopes[j-1]='O'
+					break
+			# If at the end, assign True to the first one, because there is only one
+			hedge_scopes[j-1]='O'
+					
+		# Same for speculation 
+		if includes_hedging_or_negation(element,element.get('id'),scope_type='negation') and element.tag=='xcope':
+			j=0
+			for i in negation_scopes:
+				if i !='O':
+					j=j+1
+				else:
+					negation_scopes[j-1]='O'
+					break
+			negation_scopes[j-1]='O'
+					
+					
+
+		# Load scope mark values
+		j=0
+		hedge_scope_marks=[]
+		for i in hedge_scopes:
+			if i=='B':
+				hedge_scope_marks.append('B-SPECXCOPE')
+				hedge_scopes[j]='I'
+			elif i=='I':
+				hedge_scope_marks.append('I-SPECXCOPE')						
+			else:
+				hedge_scope_marks.append('O')	
+			j=j+1
+
+		# Same for negation scope marks
+		j=0
+		negation_scope_marks=[]
+		for i in negation_scopes:
+			if i=='B':
+				negation_scope_marks.append('B-NEGXCOPE')
+				negation_scopes[j]='I'
+			elif i=='I':
+				negation_scope_marks.append('I-NEGXCOPE')						
+			else:
+				negation_scope_marks.append('O')	
+			j=j+1
+
+
+				
+		if not hedge_scope_marks:
+			hedge_scope_marks=['O']
+
+		if not negation_scope_marks:
+			negation_scope_marks=['O']
+			
+		if not hedge_cues:
+			hedge_cues=['O']
+			
+						
+		if not negation_cues:
+			negation_cues=['O']
+		
+		
+		for elem in element_tail:
+			element_tagged_tail.append((elem,{'SpecCue':[h for h in hedge_cues],'NegCue':[h for h in negation_cues], 'specXcope':hedge_scope_marks,'negXcope':negation_scope_marks}))
+
+
+
+		return element_tagged_text + element_tagged_tail
+		
+	
+	tokens=get_bioscope_element_spec_tags(sentence,hedge_cue_num=0,negation_cue_num=0, hedge_scopes=hedge_scopes, negation_scopes=negation_scopes)
+	return tokens
+
+
+def bioscope_retokenize(genia_words,bioscope_tokens):
+	"""
+	Given a list of words, resulting form the GENIA tagger tokenizer, and another, resulting from text tokenizing using C{nltk.tokenize.TreebankWordTokenizer()}, retokenizes the second one, to mache Genia tagging
+	@arg genia_words: list of words from Genia Tagger tokenization
+	@type genia_words: C{List}
+	@arg bioscope_tokens: list of word from the C{nltk.tokenize.TreebankWordTokenizer()}
+	@type bioscope_tokens: C{List}
+	@return: bioscope_tokens, retokenizado
+	@rtype: C{List}
+	"""
+	
+	import warnings
+	# Ignoro los warnings al convertir unicode, no quiero problemas
+	warnings.simplefilter('ignore')
+
+	for i in range(0,len(genia_words)):
+		if i<len(bioscope_tokens):
+			genia_word=genia_words[i][0]
+			treebank_token=bioscope_tokens[i][0]
+			
+			if genia_word != treebank_token:
+				# 0: brackets seem different, by the are just encoded following the PennTreebank annotation guidelines. Skip. 
+				if treebank_token in ('(',')','[',']','{','}'):
+					pass
+				else:
+					# 2: if the genia word mathces the bioscope word plus the following word, join them
+					if i<len(bioscope_tokens)-1 and genia_word==treebank_token+bioscope_tokens[i+1][0]:
+						bioscope_tokens[i]=(bioscope_tokens[i][0]+bioscope_tokens[i+1][0], bioscope_tokens[i][1]) 
+						del(bioscope_tokens[i+1])
+					# Caso 3: ... even three separated words
+					elif i<len(bioscope_tokens)-2 and  genia_word==treebank_token+bioscope_tokens[i+1][0]+bioscope_tokens[i+2][0]:
+						del(bioscope_tokens[i+1])
+						del(bioscope_tokens[i+1])
+					# Caso 4:... even four f**  
+					elif i<len(bioscope_tokens)-3 and genia_word==treebank_token+bioscope_tokens[i+1][0]+bioscope_tokens[i+2][0]+bioscope_tokens[i+3][0]:
+						bioscope_tokens[i]=(bioscope_tokens[i][0]+bioscope_tokens[i+1][0]+bioscope_tokens[i+2][0]+bioscope_tokens[i+3][0], bioscope_tokens[i][1]) 					
+						del(bioscope_tokens[i+1])
+						del(bioscope_tokens[i+1])
+						del(bioscope_tokens[i+1])
+	warnings.simplefilter('always')
+	return bioscope_tokens
+	
+
+def gen_conll_file_hc(dbname,tablename,sentence_type,filename,xs,y,predicted_y):
+	""" 
+	Given a BIOSCOPE db table, generate the file for training/evaluation using CRF++
+	The file is in CoNLL format (one line for each token, with attributes space separated, and the last one is the target class). Blank lines separate sentences
+	@arg dbname: file for the database file 
+	@type dbname:C{string}
+	@arg tablename: table name
+	@type tablename:C{string}
+	@arg sentence_type: a string for SENTENCE_TYPE. If ALL, use every tuple
+	@type sentence_type: C{string}
+	@arg xs: list of attributes to generate. They must match the table's column name, and do not include the target class
+	@type xs: List
+	@arg y: Attribute indicating the target class
+	@type y:List
+	@arg predicted_y: Learned class (for evaluation)
+	@type predicted_y: C{string}
+	"""
+
+	content=''	
+	t0=time.clock()
+	f=open(filename,'w+')
+	conn= sqlite3.connect(dbname)	
+	conn.text_factory = str
+	conn.row_factory=sqlite3.Row
+	c=conn.cursor()
+	
+	# Create the attribute list 
+	cabezal_select=','.join(xs)
+	cabezal_select=cabezal_select+','+y+' '
+	if predicted_y:
+		cabezal_select=cabezal_select+','+predicted_y+' '
+
+	if sentence_type=='ALL':
+		c.execute('select document_id,sentence_id,token_num, '+cabezal_select+' from '+tablename+' order by document_id,sentence_id,token_num')
+	else:
+		c.execute('select document_id,sentence_id,token_num, '+cabezal_select+' from '+tablename+' where sentence_type=?  order by document_id,sentence_id,token_num', (sentence_type,))	
+	
+	prev_sentence_id='-1'	
+	in_scope=False
+	for row in c:
+		if (prev_sentence_id != row['sentence_id']):
+			# Sentence end, leave a blank space, except for the first sentence
+			if prev_sentence_id != '-1':					
+				content=content+'\n'
+			prev_sentence_id = row['sentence_id']
+		for k in row.keys():
+			value=row[k]		
+			content=content+str(value)+'\t'
+
+		# Delete las tab
+		content=rstrip(content)
+		content=content+'\n'	
+		f.write(content)
+		content=''
+	f.close()
+	c.close()
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+Regression tests for L{pln_inco.bioscope}
+"""
+import os
+import copy
+import random
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+import nltk
+from pln_inco import bioscope
+from pln_inco.tests import reference
+
+
+def random_sentence(r,sentence_id):
+	"""
+	Build a random bioscope sentence, with nested cues and xcopes, some of them with missing or wrong attributes
+	@rtype: C{xml.etree.ElementTree}
+	"""
+	words=['may','not','be','the','protein','x','(',')','no','.',',','suggest','cannot']
+
+	def text():
+		if r.random()<0.7:
+			return ' '.join([r.choice(words) for i in range(r.randint(0,3))])
+		return None
+
+	def children(depth):
+		elements=[]
+		for i in range(r.randint(0,3) if depth<6 else 0):
+			k=r.random()
+			if k<0.45:
+				element=ET.Element('xcope')
+				if r.random()<0.85:
+					element.set('id',r.choice(['X1','X2','X3']))
+			elif k<0.9:
+				element=ET.Element('cue')
+				if r.random()<0.9:
+					element.set('type',r.choice(['speculation','negation','other']))
+				if r.random()<0.85:
+					element.set('ref',r.choice(['X1','X2','X3']))
+			else:
+				element=ET.Element('other')
+				if r.random()<0.5:
+					element.set('type','speculation')
+			for child in children(depth+1):
+				element.append(child)
+			element.text=text()
+			element.tail=text()
+			elements.append(element)
+		return elements
+
+	sentence=ET.Element('sentence')
+	sentence.set('id',sentence_id)
+	sentence.text=text()
+	for child in children(0):
+		sentence.append(child)
+	return sentence
+
+
+def random_tree(r,depth=0):
+	"""
+	Build a random tree, with leaf attribute dictionaries as the labels of every node
+	@rtype: C{nltk.Tree}
+	"""
+	label={'lemma':u'l%d' % r.randint(0,9),'pos':u'NN','chunk':u'O','entity':r.choice([u' x ',u'O',u'B-p\n']),'specCue':r.choice([['O'],['B-SPECCUE','O']]),
+		'negCue':r.choice([['O'],['O','B-NEGCUE']]),'specXcope':['O'],'negXcope':r.choice([['I-NEGXCOPE'],['O','O']])}
+	children=[]
+	for i in range(r.randint(0,4) if depth<5 else 0):
+		if r.random()<0.4:
+			children.append(u'w%d' % r.randint(0,99))
+		else:
+			children.append(random_tree(r,depth+1))
+	return nltk.tree.Tree(label,children)
+
+
+def with_leaf_attributes(tree):
+	"""
+	Copy a tree built by L{random_tree}, changing the labels of the nodes with leaves into L{bioscope.LeafAttributes}
+	@rtype: C{nltk.Tree}
+	"""
+	tree=copy.deepcopy(tree)
+	store=bioscope.SentenceLeafAttributes()
+	for t in tree.subtrees():
+		if [child for child in t if isinstance(child,basestring)]:
+			label=t.label()
+			leaf=store.append(tuple([label[key] for key in bioscope.LEAF_LABEL_KEYS]))
+			t.set_label(store.label(leaf))
+	return tree
+
+
+def loaded_sentence(docId,sentenceId,sindex,tree):
+	"""
+	Return a sentence whose information was loaded, with the given tree
+	@rtype: L{bioscope.BioscopeSentence}
+	"""
+	sentence=bioscope.BioscopeSentence(docId,sentenceId,sindex,None)
+	sentence.data=tree
+	sentence.data_loaded=True
+	sentence.find_cues()
+	return sentence
+
+
+class BioscopeTokensTest(unittest.TestCase):
+	"""
+	L{bioscope.BioscopeCorpusProcessor.get_bioscope_tokens} and L{bioscope.BioscopeCorpusProcessor.get_max_nesting_level}, on a .bioscope document of random sentences
+	"""
+
+	def setUp(self):
+		self.working_dir=tempfile.mkdtemp()
+		for directory in ('bioscope','parsed','genia'):
+			os.mkdir(os.path.join(self.working_dir,directory))
+		f=open(os.path.join(self.working_dir,'corpus.xml'),'w')
+		f.write('<Annotation><DocumentSet><Document><DocID>1</DocID></Document></DocumentSet></Annotation>')
+		f.close()
+
+		r=random.Random(1)
+		fixed=ET.fromstring('<sentence id="S0">These results <xcope id="X1"><cue type="speculation" ref="X1">suggest</cue> that the protein is '
+			'<xcope id="X2"><cue type="negation" ref="X2">not</cue> required (in vivo)</xcope></xcope>.</sentence>')
+		self.sentences=[fixed]+[random_sentence(r,'S%d' % i) for i in range(1,400)]
+		document=ET.Element('Document')
+		for sentence in self.sentences:
+			document.append(sentence)
+		ET.ElementTree(document).write(os.path.join(self.working_dir,'bioscope','a1.bioscope'))
+		self.bcp=bioscope.BioscopeCorpusProcessor(self.working_dir,'corpus.xml')
+
+	def tearDown(self):
+		shutil.rmtree(self.working_dir)
+
+	def result(self,function,*args):
+		try:
+			return function(*args)
+		except Exception, e:
+			return e.__class__
+
+	def test_tokens(self):
+		for sentence in self.sentences:
+			sentenceId=sentence.get('id')
+			self.assertEqual(self.result(reference.get_bioscope_tokens,sentence),self.result(self.bcp.get_bioscope_tokens,'a1',sentenceId),ET.tostring(sentence))
+
+	def test_max_nesting_level(self):
+		for sentence in self.sentences:
+			for scope_type in ('speculation','negation','other'):
+				self.assertEqual(reference.get_max_nesting_level(sentence,scope_type),self.bcp.get_max_nesting_level('a1',sentence.get('id'),scope_type),ET.tostring(sentence))
+
+
+class BasicAttributesTest(unittest.TestCase):
+	"""
+	L{bioscope.BioscopeSentence.get_basic_attributes} and L{bioscope.BioscopeDocument.iter_basic_attributes}, with dictionary and L{bioscope.LeafAttributes} labels
+	"""
+
+	def setUp(self):
+		r=random.Random(3)
+		self.trees=[random_tree(r) for i in range(1000)]
+
+	def test_sentence(self):
+		for tree in self.trees:
+			expected=reference.get_basic_attributes(tree)
+			self.assertEqual(expected,loaded_sentence('a1','S1',0,tree).get_basic_attributes())
+			self.assertEqual(expected,loaded_sentence('a1','S1',0,with_leaf_attributes(tree)).get_basic_attributes())
+
+	def test_document(self):
+		sentences=[loaded_sentence('a1','S%d' % i,i,with_leaf_attributes(tree)) for (i,tree) in enumerate(self.trees)]
+		# Sentences whose information was not loaded are skipped
+		for sentence in sentences[::7]:
+			sentence.data_loaded=False
+		expected=[]
+		for sentence in sentences:
+			if sentence.data_loaded:
+				expected+=[(sentence.sentenceId,token_num,attributes) for (token_num,attributes) in enumerate(reference.get_basic_attributes(sentence.data)[1:])]
+		document=bioscope.BioscopeDocument('a1',None,sentences[::-1])
+		self.assertEqual(expected,list(document.iter_basic_attributes()))
+
+
+class RetokenizeTest(unittest.TestCase):
+	"""
+	L{bioscope.bioscope_retokenize}. The previous version joined at most four tokens, so only those cases are compared
+	"""
+
+	def test_fixed(self):
+		genia=[('IL-2-dependent','l','p','c','n'),('-LRB-','l','p','c','n'),('T-cell','l','p','c','n'),('-RRB-','l','p','c','n')]
+		tokens=[(token,{'id':i}) for (i,token) in enumerate(['IL','-','2','-dependent','(','T','-','cell',')'])]
+		stats=dict()
+		self.assertEqual([attributes for (token,attributes) in reference.bioscope_retokenize(genia,copy.deepcopy(tokens))],
+			[attributes for (token,attributes) in bioscope.bioscope_retokenize(genia,copy.deepcopy(tokens),stats)])
+		self.assertEqual((stats['merges'],stats['longest_merge']),(2,4))
+
+	def test_random(self):
+		r=random.Random(0)
+		compared=0
+		for i in range(20000):
+			words=[''.join([r.choice('abc') for k in range(r.randint(1,3))]) for j in range(r.randint(1,8))]
+			genia=[]
+			tokens=[]
+			longest_merge=1
+			for word in words:
+				x=r.random()
+				if x<0.15:
+					# The Genia word is split in several tokens
+					parts=r.randint(2,6)
+					longest_merge=max(longest_merge,parts)
+					word=word+''.join([r.choice('-/.') for k in range(parts)])
+					genia.append((word,'l','p','c','n'))
+					cuts=sorted(r.sample(range(1,len(word)),min(parts-1,len(word)-1)))+[len(word)]
+					start=0
+					for cut in cuts:
+						tokens.append((word[start:cut],{'id':len(tokens)}))
+						start=cut
+				elif x<0.2:
+					genia.append(('-LRB-','l','p','c','n'))
+					tokens.append(('(',{'id':len(tokens)}))
+				elif x<0.25:
+					genia.append((word,'l','p','c','n'))
+					tokens.append((word+'x',{'id':len(tokens)}))
+				elif x<0.28:
+					tokens.append((word,{'id':len(tokens)}))
+				else:
+					genia.append((word,'l','p','c','n'))
+					tokens.append((word,{'id':len(tokens)}))
+			if longest_merge>4:
+				continue
+			expected=[attributes for (token,attributes) in reference.bioscope_retokenize(genia,copy.deepcopy(tokens))]
+			self.assertEqual(expected,[attributes for (token,attributes) in bioscope.bioscope_retokenize(genia,copy.deepcopy(tokens))],(genia,tokens))
+			compared+=1
+		self.assertTrue(compared>10000)
+
+
+class ConllTest(unittest.TestCase):
+	"""
+	CoNLL files (L{bioscope.gen_conll_file_hc}, L{bioscope.gen_conll_files_hc}) and the attribute tables they are built from (L{bioscope.gen_attribute_table})
+	"""
+
+	def setUp(self):
+		self.directory=tempfile.mkdtemp()
+		self.dbname=os.path.join(self.directory,'attributes.db')
+		r=random.Random(1)
+		rows=[]
+		for d in range(60):
+			for s in range(r.randint(1,5)):
+				sentence_type=r.choice(bioscope.SENTENCE_TYPES)
+				# Some sentence ids are repeated in other documents
+				sentenceId='S%d' % (s if r.random()<0.5 else d*10+s)
+				for t in range(r.randint(1,12)):
+					rows.append(('a%d' % d,sentenceId,t,sentence_type,r.choice(['the','x y',' ','','cells']),r.choice(['a','',None,' b ']),
+						r.choice(['NN','','JJ']),r.choice(['O','B','',' ']),r.choice(['O','',None,1.5])))
+		conn=sqlite3.connect(self.dbname)
+		conn.execute('create table t (document_id text, sentence_id text, token_num integer, sentence_type text, token text, lemma text, pos text, y text, py text)')
+		conn.executemany('insert into t values (?,?,?,?,?,?,?,?,?)',rows)
+		conn.commit()
+		conn.close()
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def read(self,filename):
+		f=open(filename)
+		content=f.read()
+		f.close()
+		return content
+
+	def test_conll_file(self):
+		for sentence_type in ('ALL','SPECULATION','NONE'):
+			for (xs,y,predicted_y) in [(['token','lemma','pos'],'y','py'),(['token','pos'],'y',None),(['lemma'],'y','')]:
+				expected=os.path.join(self.directory,'expected.conll')
+				reference.gen_conll_file_hc(self.dbname,'t',sentence_type,expected,xs,y,predicted_y)
+				for (batch_size,create_index) in ((7,False),(10000,True)):
+					filename=os.path.join(self.directory,'conll%d.conll' % batch_size)
+					bioscope.gen_conll_file_hc(self.dbname,'t',sentence_type,filename,xs,y,predicted_y,batch_size,create_index)
+					self.assertEqual(self.read(expected),self.read(filename),(sentence_type,xs,y,predicted_y,batch_size))
+
+	def test_conll_files(self):
+		jobs=[('ALL',['token','lemma','pos'],'y','py'),('SPECULATION',['token','pos'],'y',None),('NEGATION',['lemma'],'y',''),('NONE',['lemma','token'],'py','y'),('ALL',['pos'],'y')]
+		for (i,job) in enumerate(jobs):
+			bioscope.gen_conll_file_hc(self.dbname,'t',job[0],os.path.join(self.directory,'single%d.conll' % i),job[1],job[2],job[3] if len(job)>3 else None)
+		bioscope.gen_conll_files_hc(self.dbname,'t',[job[0:3]+(os.path.join(self.directory,'multiple%d.conll' % i),)+job[3:] for (i,job) in enumerate(jobs)],batch_size=7)
+		for i in range(len(jobs)):
+			self.assertEqual(self.read(os.path.join(self.directory,'single%d.conll' % i)),self.read(os.path.join(self.directory,'multiple%d.conll' % i)),jobs[i])
+
+	def test_attribute_table(self):
+		r=random.Random(5)
+		documents=[]
+		for d in range(20):
+			sentences=[loaded_sentence('a%d' % d,'S%d' % s,s,with_leaf_attributes(random_tree(r))) for s in range(r.randint(1,5))]
+			documents.append(bioscope.BioscopeDocument('a%d' % d,None,sentences))
+
+		class Corpus:
+			def iter_documents(self):
+				return iter([(d.docId,d) for d in documents])
+
+		bioscope.gen_attribute_table(self.dbname,'attributes',Corpus())
+		expected=[]
+		for d in documents:
+			for s in sorted(d.sentences.values(),key=lambda s:s.sindex):
+				for (token_num,attributes) in enumerate(reference.get_basic_attributes(s.data)[1:]):
+					expected.append((d.docId,s.sentenceId,token_num,s.get_sentence_type())+tuple([','.join(value) if isinstance(value,list) else value for value in attributes]))
+		conn=sqlite3.connect(self.dbname)
+		rows=conn.execute('select * from attributes order by document_id,sentence_id,token_num').fetchall()
+		conn.close()
+		self.assertEqual(sorted(expected),[tuple(row) for row in rows])
+
+
+if __name__ == '__main__':
+	unittest.main()
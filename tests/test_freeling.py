@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Regression tests for L{pln_inco.freeling}
+"""
+import sys
+import random
+import unittest
+import StringIO
+from pln_inco import freeling
+from pln_inco.tests import reference
+
+try:
+	from pln_inco.util import Tokenizador
+except ImportError:
+	Tokenizador = None
+
+
+# Palabras de los textos generados, y cómo las separa FreeLing
+PALABRAS = [u'el', u'perro', u'del', u'al', u'casa', u'dámelo', u'contándoselo', u'vámonos', u'a', u'pesar', u'de', u'todo',
+	u'.', u',', u'Del', u'Al', u'sin', u'embargo']
+SEPARACIONES = {u'del': [u'de', u'el'], u'Del': [u'De', u'el'], u'al': [u'a', u'el'], u'Al': [u'A', u'el'], u'dámelo': [u'da', u'me', u'lo'],
+	u'contándoselo': [u'contando', u'se', u'lo'], u'vámonos': [u'vamos', u'nos']}
+
+
+def generarDocumento(r, largo):
+	"""Devuelve un texto de largo palabras y la salida de obtenerInfoEtiquetadoFreeling() para el texto, con contracciones,
+	clíticos, locuciones (tres palabras unidas con '_') y algunos tokens que no coinciden con los nuestros."""
+
+	palabras = [r.choice(PALABRAS) for i in range(largo)]
+	tokens_freeling = []
+	i = 0
+	while i < len(palabras):
+		if r.random() < 0.15 and i + 2 < len(palabras):
+			partes = []
+			for palabra in palabras[i:i+3]:
+				partes += SEPARACIONES.get(palabra, [palabra])
+			tokens_freeling.append(u'_'.join(partes))
+			i += 3
+		elif r.random() < 0.03:
+			tokens_freeling.append(palabras[i] + u'x')
+			i += 1
+		else:
+			tokens_freeling += SEPARACIONES.get(palabras[i], [palabras[i]])
+			i += 1
+
+	oraciones = []
+	oracion = []
+	for token in tokens_freeling:
+		oracion.append((token, token.lower(), u'TAG'))
+		if token == u'.':
+			oraciones.append(oracion)
+			oracion = []
+	if oracion:
+		oraciones.append(oracion)
+	return (u' '.join(palabras), oraciones)
+
+
+def resultado(alinear, texto, oraciones):
+	"""Alinea los tokens del texto con alinear, y devuelve el resultado como tuplas comparables (o el tipo de la excepción)."""
+
+	salida = sys.stdout
+	# Las dos versiones avisan por la salida estándar cuando no pueden separar un clítico
+	sys.stdout = StringIO.StringIO()
+	try:
+		try:
+			alineado = alinear(Tokenizador.obtenerTokens(texto), oraciones)
+		except Exception, e:
+			return e.__class__
+	finally:
+		sys.stdout = salida
+	return [[(token.texto, token.ini, token.fin, info) for (token, info) in oracion] for oracion in alineado]
+
+
+@unittest.skipIf(Tokenizador is None, 'pln_inco.util.Tokenizador is not available')
+class AlinearTokensFreelingTest(unittest.TestCase):
+
+	def comparar(self, texto, oraciones):
+		anterior = resultado(lambda tokens, oraciones: reference.alinear_tokens_freeling(tokens, oraciones, Tokenizador.TokenTexto), texto, oraciones)
+		self.assertEqual(anterior, resultado(freeling.alinearTokensFreeling, texto, oraciones), texto.encode('utf-8'))
+
+	def test_casos(self):
+		self.comparar(u'El perro del vecino ladra.', [[(u'El', u'el', u'DA'), (u'perro', u'perro', u'NC'), (u'de', u'de', u'SP'), (u'el', u'el', u'DA'),
+			(u'vecino', u'vecino', u'NC'), (u'ladra', u'ladrar', u'VM'), (u'.', u'.', u'Fp')]])
+		self.comparar(u'Dámelo al final.', [[(u'Da', u'dar', u'VM'), (u'me', u'me', u'PP'), (u'lo', u'lo', u'PP'), (u'a', u'a', u'SP'), (u'el', u'el', u'DA'),
+			(u'final', u'final', u'NC'), (u'.', u'.', u'Fp')]])
+		self.comparar(u'A pesar de todo, vámonos.', [[(u'A_pesar_de', u'a_pesar_de', u'SP'), (u'todo', u'todo', u'PI'), (u',', u',', u'Fc'),
+			(u'vamos', u'ir', u'VM'), (u'nos', u'nos', u'PP'), (u'.', u'.', u'Fp')]])
+
+	def test_documentos_aleatorios(self):
+		r = random.Random(1)
+		for i in range(2000):
+			(texto, oraciones) = generarDocumento(r, r.randint(1, 40))
+			self.comparar(texto, oraciones)
+
+
+if __name__ == '__main__':
+	unittest.main()